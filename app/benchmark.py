@@ -0,0 +1,498 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import re
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from typing import Callable, Dict, List, Optional, Tuple
+
+import aiohttp
+import yaml
+from aiohttp import web
+
+# End-to-end benchmark: builds a synthetic database, serves channel pages and the Bot API from a local stand-in
+# and drives a real "main.py serve" and "main.py fetch" at controlled concurrency.
+#
+#   python benchmark.py --posts 1000000 --sources 500 --concurrency 1 --concurrency 32
+#   python benchmark.py --compare data/benchmark/results-<commit>.json
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+PAGE_PATH = os.path.join(APP_DIR, "parsers", "tests", "tests_data", "page.html")
+SCENARIOS = ("index", "page", "webhook", "ingest")
+KEYWORDS = ["москва", "яндекс", "google", "нефть", "выборы"]
+SECRET = "benchmark"
+
+PAGE_POST_RE = re.compile(r"infoscape_test/(\d+)")
+BUILD_BATCH = 10000
+
+
+def word_list(rng: random.Random, size: int = 2000) -> List[str]:
+    syllables = ["ка", "ло", "ми", "ре", "ста", "но", "ви", "ра", "ту", "ше", "до", "ли", "за", "про", "ве"]
+    return ["".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))) for _ in range(size)]
+
+
+def build_db(filename: str, posts: int, sources: int, seed: int) -> None:
+    # reused while the parameters are the same, large databases take a while to build
+    from library import IngestRenderer, KeywordMatcher, Post, PostsDb
+
+    params = {"posts": posts, "sources": sources, "seed": seed}
+    meta_filename = f"{filename}.json"
+    if os.path.exists(filename) and os.path.exists(meta_filename):
+        with open(meta_filename) as fin:
+            if json.load(fin) == params:
+                print(f"reusing {filename}")
+                return
+
+    for suffix in ("", "-wal", "-shm", ".json"):
+        if os.path.exists(filename + suffix):
+            os.remove(filename + suffix)
+
+    rng = random.Random(seed)
+    words = word_list(rng) + KEYWORDS
+    render = IngestRenderer(KeywordMatcher(KEYWORDS))
+    db = PostsDb(filename)
+    now = int(time.time())
+    per_source = math.ceil(posts / sources)
+
+    start = time.perf_counter()
+    batch = []
+    for i in range(posts):
+        source, number = i % sources, i // sources
+        heading = " ".join(rng.choice(words) for _ in range(6)).capitalize()
+        body = " ".join(rng.choice(words) for _ in range(rng.randint(20, 60)))
+        # ten minutes between posts of a source, the newest ones are written last
+        timestamp = now - (per_source - number) * 600
+        batch.append(render(Post(f"bench{source:04d}", f"https://t.me/bench{source:04d}/{number + 1}", timestamp,
+                                 heading, f"{heading}\n{body}")))
+
+        if len(batch) == BUILD_BATCH or i == posts - 1:
+            db.add_many(batch)
+            batch = []
+            print(f"\rbuilding {filename}: {i + 1}/{posts} posts, {(i + 1) / (time.perf_counter() - start):.0f}/s", end="")
+    print()
+    db.conn.close()
+
+    with open(meta_filename, "w") as fout:
+        json.dump(params, fout)
+
+
+def reset_data(pristine: str, data_dir: str) -> None:
+    # web scenarios and ingest start from a copy of the built database: both write to it, and the stand-in numbers
+    # messages from scratch every run, so posts and source cursors of a previous run would skew the results
+    for name in os.listdir(data_dir):
+        path = os.path.join(data_dir, name)
+        if os.path.isfile(path) and not path.startswith(pristine):
+            os.remove(path)
+
+    source = sqlite3.connect(pristine)
+    target = sqlite3.connect(os.path.join(data_dir, "production.sqlite"))
+    source.backup(target)
+    source.close()
+    target.close()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class StandIn:
+    # Local replacement of t.me channel pages and the Bot API, runs its own event loop in a thread so the load
+    # generator doesn't compete with it; every page request gets new message ids, so each fetch ingests new posts
+    def __init__(self, page: str) -> None:
+        self.page = page
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.page_requests: Dict[str, int] = {}
+        self.first_request = 0.0
+        self.bot_requests = 0
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.ready = threading.Event()
+
+    async def channel(self, request: web.Request) -> web.Response:
+        channel = request.match_info["channel"]
+        count = self.page_requests[channel] = self.page_requests.get(channel, 0) + 1
+        self.first_request = self.first_request or time.perf_counter()
+
+        offset = count * 10
+        html = PAGE_POST_RE.sub(lambda m: f"{channel}/{int(m.group(1)) + offset}", self.page)
+        return web.Response(text=html.replace("infoscape_test", channel), content_type="text/html")
+
+    async def bot(self, request: web.Request) -> web.Response:
+        self.bot_requests += 1
+        return web.json_response({"ok": True, "result": True})
+
+    def run(self) -> None:
+        app = web.Application()
+        app.router.add_get("/s/{channel}", self.channel)
+        app.router.add_post("/bot{token}/{method}", self.bot)
+
+        asyncio.set_event_loop(self.loop)
+        runner = web.AppRunner(app, access_log=None)
+        self.loop.run_until_complete(runner.setup())
+        self.loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", self.port).start())
+        self.ready.set()
+        self.loop.run_forever()
+        self.loop.run_until_complete(runner.cleanup())
+
+    def start(self) -> None:
+        self.thread.start()
+        self.ready.wait()
+
+    def stop(self) -> None:
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+def write_config(filename: str, sources: int, pages: int, standin: StandIn) -> None:
+    config = {
+        "title": "infoscape benchmark",
+        "hostname": "localhost",
+        "keywords": KEYWORDS,
+        "sources": [
+            {
+                "title": f"Bench {i}",
+                "id": f"bench{i:04d}",
+                "parser": "telegram",
+                "link": f"{standin.url}/s/bench{i:04d}",
+                "pages": [f"page{i % pages}"],
+            }
+            for i in range(sources)
+        ],
+    }
+    with open(filename, "w") as fout:
+        yaml.safe_dump(config, fout, allow_unicode=True)
+
+
+def rss(pid: int) -> int:
+    # resident memory of the process and its children in bytes, linux only
+    total = 0
+    pids = [pid]
+    while pids:
+        current = pids.pop()
+        try:
+            with open(f"/proc/{current}/status") as fin:
+                for line in fin:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as fin:
+                    pids.extend(int(child) for child in fin.read().split())
+        except OSError:
+            continue
+    return total
+
+
+class RssSampler:
+    def __init__(self, pid: int, interval: float = 0.1) -> None:
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> int:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.peak = max(self.peak, rss(self.pid))
+        return self.peak
+
+    async def run(self) -> None:
+        while True:
+            self.peak = max(self.peak, rss(self.pid))
+            await asyncio.sleep(self.interval)
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))] if ordered else 0.0
+
+
+def summarize(
+    scenario: str, concurrency: int, latencies: List[float], errors: int, seconds: float, peak_rss: int
+) -> Dict:
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(seconds, 3),
+        "throughput": round(len(latencies) / seconds, 1) if seconds else 0,
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "max_rss_mb": round(peak_rss / 2**20, 1),
+    }
+
+
+# request number -> method, path, json body
+RequestFactory = Callable[[int], Tuple[str, str, Optional[Dict]]]
+
+
+def request_factories(pages: int) -> Dict[str, RequestFactory]:
+    def webhook(i: int) -> Tuple[str, str, Optional[Dict]]:
+        # mostly reads, every tenth request subscribes
+        text = f"/subscribe keyword{i % 50}" if i % 10 == 0 else "/subscriptions"
+        message = {"chat": {"id": 1 + i % 1000}, "text": text, "entities": [{"type": "bot_command"}]}
+        return "POST", "/tg-webhook", {"update_id": i + 1, "message": message}
+
+    return {
+        "index": lambda i: ("GET", "/", None),
+        "page": lambda i: ("GET", f"/p/page{i % pages}", None),
+        "webhook": webhook,
+    }
+
+
+async def drive(
+    base_url: str, scenario: str, make_request: RequestFactory, requests: int, concurrency: int, pid: int
+) -> Dict:
+    latencies: List[float] = []
+    errors = 0
+    numbers = iter(range(requests))
+
+    async with aiohttp.ClientSession(base_url, connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+        async def worker() -> None:
+            nonlocal errors
+            for i in numbers:
+                method, path, body = make_request(i)
+                start = time.perf_counter()
+                try:
+                    async with session.request(method, path, json=body) as response:
+                        await response.read()
+                        errors += response.status >= 400
+                except aiohttp.ClientError:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        sampler = RssSampler(pid)
+        sampler.start()
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        seconds = time.perf_counter() - start
+        peak_rss = await sampler.stop()
+
+    return summarize(scenario, concurrency, latencies, errors, seconds, peak_rss)
+
+
+def wait_ready(url: str, process: subprocess.Popen, timeout: float = 120) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with {process.returncode}")
+        try:
+            with urllib.request.urlopen(url, timeout=5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server is not ready after {timeout} seconds")
+
+
+def stop_process(process: subprocess.Popen) -> None:
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def run_server_scenarios(args: argparse.Namespace, env: Dict[str, str], scenarios: List[str]) -> List[Dict]:
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    process = subprocess.Popen(
+        [
+            sys.executable, os.path.join(APP_DIR, "main.py"), "--config", "config.yaml", "serve",
+            "--host", "127.0.0.1", "--port", str(port), "--web-workers", str(args.web_workers),
+        ],
+        cwd=args.workdir,
+        env=env,
+    )
+
+    results = []
+    try:
+        wait_ready(base_url, process)
+        factories = request_factories(args.pages)
+        for scenario in scenarios:
+            for concurrency in args.concurrency:
+                # warm up caches and connections of every worker
+                asyncio.run(drive(base_url, scenario, factories[scenario], args.warmup, concurrency, process.pid))
+                result = asyncio.run(
+                    drive(base_url, scenario, factories[scenario], args.requests, concurrency, process.pid)
+                )
+                results.append(result)
+                print_result(result)
+    finally:
+        stop_process(process)
+    return results
+
+
+def last_seq(filename: str) -> int:
+    with sqlite3.connect(filename) as conn:
+        return conn.execute("SELECT coalesce(max(seq), 0) FROM posts").fetchone()[0]
+
+
+def run_ingest(args: argparse.Namespace, env: Dict[str, str], standin: StandIn, db_filename: str) -> List[Dict]:
+    # every round is a "main.py fetch" cycle over all sources, timed from its first page request to its exit
+    # so interpreter startup is not counted
+    results = []
+    for concurrency in args.concurrency:
+        cycles: List[float] = []
+        pages = posts = 0
+        peak_rss = 0
+        for _ in range(args.rounds):
+            seq = last_seq(db_filename)
+            requests = sum(standin.page_requests.values())
+            standin.first_request = 0.0
+            process = subprocess.Popen(
+                [
+                    sys.executable, os.path.join(APP_DIR, "main.py"), "--config", "config.yaml", "fetch",
+                    "--daemonize", "0", "--host-interval", "0", "--workers", str(concurrency),
+                ],
+                cwd=args.workdir,
+                env=env,
+            )
+            while process.poll() is None:
+                peak_rss = max(peak_rss, rss(process.pid))
+                time.sleep(0.1)
+            if process.returncode:
+                raise RuntimeError(f"fetch exited with {process.returncode}")
+
+            cycles.append(time.perf_counter() - (standin.first_request or time.perf_counter()))
+            pages += sum(standin.page_requests.values()) - requests
+            posts += last_seq(db_filename) - seq
+
+        seconds = sum(cycles)
+        result = summarize("ingest", concurrency, cycles, 0, seconds, peak_rss)
+        # latencies of ingest are whole cycles, throughput is in pages and posts
+        result.update(
+            requests=pages,
+            throughput=round(pages / seconds, 1) if seconds else 0,
+            posts=posts,
+            posts_per_second=round(posts / seconds, 1) if seconds else 0,
+        )
+        results.append(result)
+        print_result(result)
+    return results
+
+
+def print_result(result: Dict) -> None:
+    print(
+        f"{result['scenario']:>8} c={result['concurrency']:<4} {result['throughput']:10.1f}/s "
+        f"p50 {result['p50_ms']:9.2f} ms  p99 {result['p99_ms']:9.2f} ms  "
+        f"errors {result['errors']:<5} rss {result['max_rss_mb']:8.1f} MiB"
+    )
+
+
+def compare(old: Dict, new: Dict) -> None:
+    previous = {(r["scenario"], r["concurrency"]): r for r in old["results"]}
+    print(f"compared to {old['commit']} ({old['params']}):")
+    for result in new["results"]:
+        if (before := previous.get((result["scenario"], result["concurrency"]))) is None:
+            continue
+
+        def change(key: str) -> str:
+            return f"{(result[key] / before[key] - 1) * 100:+7.1f}%" if before[key] else "      -"
+
+        print(
+            f"{result['scenario']:>8} c={result['concurrency']:<4} throughput {change('throughput')}  "
+            f"p50 {change('p50_ms')}  p99 {change('p99_ms')}  rss {change('max_rss_mb')}"
+        )
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=APP_DIR, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python benchmark.py")
+    parser.add_argument("--workdir", default="data/benchmark", help="Directory for the database, config and results")
+    parser.add_argument("--posts", type=int, default=100000, help="Number of posts in the synthetic database")
+    parser.add_argument("--sources", type=int, default=200, help="Number of sources")
+    parser.add_argument("--pages", type=int, default=10, help="Number of pages the sources are spread over")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed of the synthetic database")
+    parser.add_argument("--scenario", choices=SCENARIOS, action="append", help="Scenarios to run, all by default")
+    parser.add_argument(
+        "--concurrency", type=int, action="append", help="Concurrent requests or fetch workers, 1 and 16 by default"
+    )
+    parser.add_argument("--requests", type=int, default=2000, help="Requests per web scenario and concurrency")
+    parser.add_argument("--warmup", type=int, default=100, help="Requests before each measurement")
+    parser.add_argument("--rounds", type=int, default=3, help="Fetch cycles per ingest concurrency")
+    parser.add_argument("--web-workers", type=int, default=2, help="Number of server worker processes")
+    parser.add_argument("--output", help="Results file, <workdir>/results-<commit>.json by default")
+    parser.add_argument("--compare", help="Results file of another run to compare with")
+    args = parser.parse_args()
+
+    args.workdir = os.path.abspath(args.workdir)
+    args.concurrency = args.concurrency or [1, 16]
+    scenarios = args.scenario or list(SCENARIOS)
+
+    # library reads them on import
+    os.environ.setdefault("AUTH_SECRET", SECRET)
+    os.environ.setdefault("TG_TOKEN", SECRET)
+
+    os.makedirs(os.path.join(args.workdir, "data"), exist_ok=True)
+    data_dir = os.path.join(args.workdir, "data")
+    pristine = os.path.join(data_dir, "pristine.sqlite")
+    build_db(pristine, args.posts, args.sources, args.seed)
+
+    with open(PAGE_PATH) as fin:
+        standin = StandIn(fin.read())
+    standin.start()
+    write_config(os.path.join(args.workdir, "config.yaml"), args.sources, args.pages, standin)
+    env = {**os.environ, "TG_API_URL": standin.url}
+
+    results = []
+    try:
+        if web_scenarios := [s for s in scenarios if s != "ingest"]:
+            reset_data(pristine, data_dir)
+            results.extend(run_server_scenarios(args, env, web_scenarios))
+        if "ingest" in scenarios:
+            reset_data(pristine, data_dir)
+            results.extend(run_ingest(args, env, standin, os.path.join(data_dir, "production.sqlite")))
+    finally:
+        standin.stop()
+
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "time": int(time.time()),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("workdir", "output", "compare", "scenario")},
+        "results": results,
+    }
+    output = args.output or os.path.join(args.workdir, f"results-{commit}.json")
+    with open(output, "w") as fout:
+        json.dump(report, fout, indent=2)
+    print(f"results saved to {output}")
+
+    if args.compare:
+        with open(args.compare) as fin:
+            compare(json.load(fin), report)
+
+
+if __name__ == "__main__":
+    main()
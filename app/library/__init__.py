@@ -1,5 +1,23 @@
-from .config import Config  # noqa
+from .config import Config, ConfigException, RetentionConfig, SourceConfig, INDEX_PAGE  # noqa
+from .keywords import KeywordMatcher  # noqa
 from .auth import Auth  # noqa
+from .http_client import HttpClient  # noqa
 from .tg_bot import TgBot  # noqa
-from .posts_db import Post, PostsDb  # noqa
-from .source_renderer import SourceRenderer  # noqa
+from .posts_db import AddStats, Post, PostsDb, SourceState  # noqa
+from .async_db import AsyncPostsDb  # noqa
+from .source_renderer import IngestRenderer, SourceRenderer  # noqa
+from .scheduler import FetchScheduler, FetchResult  # noqa
+from .write_queue import WriteBehindQueue  # noqa
+from .page_cache import PageCache, CachedPage  # noqa
+from .retention import Retention, RetentionStats  # noqa
+from .config_manager import ConfigManager  # noqa
+from .live_updates import LiveUpdates  # noqa
+from .send_queue import SendException, SendQueue  # noqa
+from .alerts import Alerts, SubscriptionIndex  # noqa
+from .feed import FeedException  # noqa
+from .images import ImageCache  # noqa
+from .image_proxy import ImageProxy  # noqa
+from .page_store import PageStore  # noqa
+from .rerender import Rerenderer  # noqa
+from .resources import Resources  # noqa
+from .supervisor import WorkerLock, supervise  # noqa
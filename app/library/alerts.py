@@ -0,0 +1,80 @@
+import logging
+import time
+from typing import Dict, List, Set, Tuple
+
+from .async_db import AsyncPostsDb
+from .posts_db import Post, PostsDb
+from .send_queue import SendQueue
+from .text import TAG_RE, WORD_RE, fold
+
+logger = logging.getLogger("infoscape")
+
+MAX_KEYWORD_LENGTH = 100
+MAX_KEYWORDS = 50  # per chat
+MAX_AGE = 24 * 3600  # older posts, e.g. from backfill, don't alert
+
+
+def words(text: str) -> List[str]:
+    return WORD_RE.findall(fold(TAG_RE.sub(" ", text)).lower())
+
+
+def normalize_keyword(keyword: str) -> str:
+    # keywords are matched as whole words, case and ё insensitive
+    return " ".join(words(keyword))[:MAX_KEYWORD_LENGTH]
+
+
+class SubscriptionIndex:
+    # Keyword phrases are indexed by their first word and chats subscribed to the same keyword share one entry,
+    # so a post costs one dict lookup per word whatever the number of subscriptions
+    def __init__(self, subscriptions: List[Tuple[int, str]]) -> None:
+        self.phrases: Dict[str, Dict[Tuple[str, ...], Set[int]]] = {}
+        for chat_id, keyword in subscriptions:
+            if phrase := tuple(keyword.split()):
+                self.phrases.setdefault(phrase[0], {}).setdefault(phrase, set()).add(chat_id)
+
+    def match(self, text: str) -> Dict[int, List[str]]:
+        # chat id -> matched keywords
+        matches: Dict[int, List[str]] = {}
+        found: Set[Tuple[str, ...]] = set()
+
+        text_words = words(text)
+        for i, word in enumerate(text_words):
+            for phrase, chat_ids in self.phrases.get(word, {}).items():
+                if phrase in found or tuple(text_words[i: i + len(phrase)]) != phrase:
+                    continue
+                found.add(phrase)
+                for chat_id in chat_ids:
+                    matches.setdefault(chat_id, []).append(" ".join(phrase))
+        return matches
+
+
+class Alerts:
+    # Runs in the fetcher as a WriteBehindQueue listener: newly inserted posts are matched against all subscriptions
+    # and alerts go to the bot's send queue, subscriptions are reloaded when their version changes
+    def __init__(self, db: AsyncPostsDb, queue: SendQueue, max_age: int = MAX_AGE) -> None:
+        self.db = db
+        self.queue = queue
+        self.max_age = max_age
+        self.version = -1
+        self.index = SubscriptionIndex([])
+
+    async def refresh(self) -> None:
+        if await self.db.read(PostsDb.get_subscriptions_version) != self.version:
+            self.version, subscriptions = await self.db.read(PostsDb.get_subscriptions)
+            self.index = SubscriptionIndex(subscriptions)
+            logger.info(f"loaded {len(subscriptions)} subscriptions")
+
+    @staticmethod
+    def format(post: Post, keywords: List[str]) -> str:
+        heading = post.heading or post.text[:200]
+        return f"{', '.join(keywords)}: {TAG_RE.sub('', heading)}\n{post.link}"
+
+    async def notify(self, posts: List[Post]) -> None:
+        min_timestamp = time.time() - self.max_age
+        if not (posts := [p for p in posts if p.timestamp > min_timestamp]):
+            return
+
+        await self.refresh()
+        for post in posts:
+            for chat_id, keywords in self.index.match(f"{post.heading}\n{post.text}").items():
+                self.queue.put(chat_id, self.format(post, keywords))
@@ -0,0 +1,115 @@
+import json
+import zlib
+from pathlib import Path
+from typing import List
+
+from .posts_db import Post, PostsDb, post_columns
+from .text import fold
+
+
+def attach_archive(db: PostsDb, filename: str, readonly: bool = False) -> None:
+    # Archived posts live in a separate database file attached as "archive": post bodies are zlib-compressed,
+    # a contentless FTS5 index keeps them searchable
+    if readonly:
+        db.conn.execute("ATTACH DATABASE ? AS archive", (f"{Path(filename).absolute().as_uri()}?mode=ro",))
+        return
+
+    db.conn.execute("ATTACH DATABASE ? AS archive", (filename,))
+    db.conn.execute("PRAGMA archive.auto_vacuum = INCREMENTAL")
+    db.conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS archive.posts (
+            source_id   TEXT,
+            link        TEXT,
+            timestamp   INT,
+            heading     TEXT,
+            data        BLOB,
+            PRIMARY KEY (source_id, link)
+        );
+
+        CREATE VIRTUAL TABLE IF NOT EXISTS archive.posts_fts USING fts5(
+            heading, text,
+            content='',
+            tokenize='unicode61 remove_diacritics 2'
+        );
+        """
+    )
+
+
+def pack(post: Post) -> bytes:
+    return zlib.compress(json.dumps([post.text, post.post_id, post.summary, post.html]).encode())
+
+
+def unpack(row: tuple) -> Post:
+    source_id, link, timestamp, heading, data = row
+    text, post_id, summary, html = json.loads(zlib.decompress(data))
+    return Post(source_id, link, int(timestamp), heading, text, post_id, summary, html)
+
+
+def archive_posts(db: PostsDb, source_id: str, min_timestamp: int = 0, max_rows: int = 0) -> int:
+    # moves posts older than min_timestamp or beyond newest max_rows of the source to the archive
+    cursor = db.conn.cursor()
+    with db.conn:
+        cursor.execute(
+            f"""
+            SELECT {post_columns("p")}
+            FROM posts p
+            WHERE p.source_id = ? AND (
+                p.timestamp < ? OR p.rowid NOT IN (
+                    SELECT rowid FROM posts WHERE source_id = ? ORDER BY timestamp DESC LIMIT ?
+                )
+            )
+            """,
+            (source_id, min_timestamp, source_id, max_rows or -1),
+        )
+        posts = [db.to_post(row) for row in cursor.fetchall()]
+
+        for post in posts:
+            cursor.execute(
+                "INSERT OR IGNORE INTO archive.posts (source_id, link, timestamp, heading, data) VALUES (?, ?, ?, ?, ?)",
+                (post.source_id, post.link, post.timestamp, post.heading, pack(post)),
+            )
+            if cursor.rowcount == 1:
+                cursor.execute(
+                    "INSERT INTO archive.posts_fts (rowid, heading, text) VALUES (?, ?, ?)",
+                    (cursor.lastrowid, fold(post.heading), fold(post.text)),
+                )
+
+        cursor.executemany(
+            "DELETE FROM posts WHERE source_id = ? AND link = ?",
+            [(post.source_id, post.link) for post in posts],
+        )
+        if posts:
+            db.bump_versions({source_id})
+
+    return len(posts)
+
+
+def drop_archived(db: PostsDb, posts: List[Post]) -> List[Post]:
+    # e.g. posts parsed again from stored pages, archived ones are not brought back
+    cursor = db.conn.cursor()
+    return [
+        post for post in posts
+        if cursor.execute(
+            "SELECT 1 FROM archive.posts WHERE source_id = ? AND link = ?", (post.source_id, post.link)
+        ).fetchone() is None
+    ]
+
+
+def search_archive(db: PostsDb, query: str, source_ids: List[str], limit: int = 20, offset: int = 0) -> List[Post]:
+    if not (match := db.fts_query(query)) or not source_ids:
+        return []
+
+    cursor = db.conn.cursor()
+    cursor.execute(
+        f"""
+        SELECT a.source_id, a.link, a.timestamp, a.heading, a.data
+        FROM archive.posts_fts
+        JOIN archive.posts a ON a.rowid = posts_fts.rowid
+        WHERE posts_fts MATCH ? AND a.source_id IN ({", ".join("?" * len(source_ids))})
+        ORDER BY bm25(posts_fts, 2.0, 1.0)
+        LIMIT ? OFFSET ?
+        """,
+        (match, *source_ids, limit, offset),
+    )
+    return [unpack(row) for row in cursor.fetchall()]
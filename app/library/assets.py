@@ -0,0 +1,165 @@
+import gzip
+import hashlib
+import io
+import json
+import logging
+import mimetypes
+import os
+import re
+from typing import Dict, Match, Set, Tuple
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import StaticFiles
+from starlette.types import Scope
+
+from .compression import accepted_encodings, brotli
+
+try:
+    from fontTools import subset
+except ImportError:  # optional, the full font is served then
+    subset = None
+
+logger = logging.getLogger("infoscape")
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "static")
+MANIFEST = "manifest.json"
+IMMUTABLE = "public, max-age=31536000, immutable"
+COMPRESSIBLE = (".css", ".js", ".svg", ".ttf")
+
+# Latin, Cyrillic, punctuation, currency and arrows
+FONT_UNICODES = [
+    *range(0x20, 0x7F), *range(0xA0, 0x100), *range(0x400, 0x460), 0x490, 0x491,
+    *range(0x2010, 0x2028), *range(0x2030, 0x203B), 0x20AC, 0x20BD, 0x2116, 0x2122, *range(0x2190, 0x2194),
+]
+FONT_FORMATS = {".woff2": "woff2", ".ttf": "truetype"}
+CSS_URL_RE = re.compile(r'url\("/static/([^"]+)"\)(\s*format\("[^"]*"\))?')
+
+mimetypes.add_type("font/woff2", ".woff2")
+
+
+class Assets:
+    # Content-addressed copies of the static files, built by "serve" before workers start:
+    #   <build dir>/infoscape.<hash>.css, its .gz and .br variants, and manifest.json with name -> built name.
+    # Templates link assets by their source names through url(), unbuilt ones are linked as they are
+    def __init__(self, source_dir: str = STATIC_DIR, build_dir: str = "") -> None:
+        self.source_dir = source_dir
+        self.build_dir = build_dir or os.path.join(source_dir, "build")
+        self.manifest: Dict[str, str] = {}
+        self.built: Set[str] = set()
+        self.files: Set[str] = set()  # everything in the build dir, including compressed variants
+
+    def url(self, name: str) -> str:
+        return f"/static/{self.manifest.get(name, name)}"
+
+    def load(self) -> None:
+        try:
+            with open(os.path.join(self.build_dir, MANIFEST)) as fin:
+                manifest = json.load(fin)
+        except FileNotFoundError:
+            manifest = {}
+
+        self.files = set(os.listdir(self.build_dir)) if manifest else set()
+        self.built = set(manifest.values())
+        self.manifest = manifest
+
+    def build(self) -> None:
+        os.makedirs(self.build_dir, exist_ok=True)
+        names = [n for n in os.listdir(self.source_dir) if os.path.isfile(os.path.join(self.source_dir, n))]
+
+        # stylesheets last, they link the other assets by their built names
+        manifest: Dict[str, str] = {}
+        for name in sorted(names, key=lambda n: (n.endswith(".css"), n)):
+            with open(os.path.join(self.source_dir, name), "rb") as fin:
+                data = fin.read()
+
+            stem, ext = os.path.splitext(name)
+            if ext == ".ttf":
+                data, ext = self.subset_font(data)
+            elif ext == ".css":
+                data = self.rewrite_css(data.decode(), manifest).encode()
+
+            manifest[name] = f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+            self.write(manifest[name], data)
+
+        # the manifest is replaced last, then files of previous builds are removed
+        filename = os.path.join(self.build_dir, MANIFEST)
+        with open(f"{filename}.tmp", "w") as fout:
+            json.dump(manifest, fout, indent=2)
+        os.replace(f"{filename}.tmp", filename)
+
+        keep = set(manifest.values())
+        for name in os.listdir(self.build_dir):
+            if name != MANIFEST and re.sub(r"\.(gz|br)$", "", name) not in keep:
+                os.remove(os.path.join(self.build_dir, name))
+
+        self.load()
+        logger.info(f"built {len(manifest)} assets in {self.build_dir}")
+
+    def write(self, name: str, data: bytes) -> None:
+        variants = {name: data}
+        if name.endswith(COMPRESSIBLE):
+            variants[f"{name}.gz"] = gzip.compress(data, compresslevel=9, mtime=0)
+            if brotli is not None:
+                variants[f"{name}.br"] = brotli.compress(data, quality=11)
+
+        for variant, content in variants.items():
+            filename = os.path.join(self.build_dir, variant)
+            # names are content hashes, existing files are the same
+            if len(content) <= len(data) and not os.path.exists(filename):
+                with open(f"{filename}.tmp", "wb") as fout:
+                    fout.write(content)
+                os.replace(f"{filename}.tmp", filename)
+
+    @staticmethod
+    def subset_font(data: bytes) -> Tuple[bytes, str]:
+        # returns the font and its extension, WOFF2 needs brotli as well
+        if subset is None:
+            return data, ".ttf"
+
+        options = subset.Options()
+        options.flavor = "woff2" if brotli is not None else None
+        font = subset.load_font(io.BytesIO(data), options)
+        subsetter = subset.Subsetter(options)
+        subsetter.populate(unicodes=FONT_UNICODES)
+        subsetter.subset(font)
+
+        result = io.BytesIO()
+        subset.save_font(font, result, options)
+        return result.getvalue(), ".woff2" if options.flavor else ".ttf"
+
+    @staticmethod
+    def rewrite_css(css: str, manifest: Dict[str, str]) -> str:
+        def replace(match: Match) -> str:
+            if (built := manifest.get(match.group(1))) is None:
+                return match.group(0)
+            url = f'url("/static/{built}")'
+            if match.group(2) and (font_format := FONT_FORMATS.get(os.path.splitext(built)[1])):
+                return f'{url} format("{font_format}")'
+            return url + (match.group(2) or "")
+
+        return CSS_URL_RE.sub(replace, css)
+
+
+class AssetFiles(StaticFiles):
+    # Built assets are served from the build dir as immutable, precompressed variants are sent as they are;
+    # other paths are plain static files
+    def __init__(self, assets: Assets) -> None:
+        super().__init__(directory=assets.source_dir)
+        self.assets = assets
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        if path not in self.assets.built or scope["method"] not in ("GET", "HEAD"):
+            return await super().get_response(path, scope)
+
+        filename = os.path.join(self.assets.build_dir, path)
+        headers = {"Cache-Control": IMMUTABLE}
+        if path.endswith(COMPRESSIBLE):
+            headers["Vary"] = "Accept-Encoding"
+            encodings = accepted_encodings(Headers(scope=scope).get("accept-encoding", ""))
+            for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+                if encoding in encodings and f"{path}{suffix}" in self.assets.files:
+                    headers["Content-Encoding"] = encoding
+                    return FileResponse(f"{filename}{suffix}", headers=headers, media_type=mimetypes.guess_type(path)[0])
+
+        return FileResponse(filename, headers=headers)
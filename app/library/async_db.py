@@ -0,0 +1,68 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, TypeVar
+
+from .archive import attach_archive
+from .metrics import metrics
+from .posts_db import PostsDb
+
+T = TypeVar("T")
+
+DB_SECONDS = metrics.histogram(
+    "infoscape_db_seconds", "Database call time in the executor thread, without queueing", ("method", "mode")
+)
+
+
+class AsyncPostsDb:
+    # Every reader thread owns a read-only WAL connection, all writes go through a single writer thread,
+    # so routes don't block the event loop and never hit "database is locked" on each other.
+    #
+    #   posts = await adb.read(PostsDb.select_top, source_ids, 10)
+    #   stats = await adb.write(PostsDb.add_many, posts)
+    def __init__(
+        self, filename: str = "data/production.sqlite", readers: int = 4, archive: Optional[str] = None
+    ) -> None:
+        self.filename = filename
+        self.archive = archive
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections: List[PostsDb] = []
+
+        self.writer_executor = ThreadPoolExecutor(1, thread_name_prefix="db-writer")
+        self.reader_executor = ThreadPoolExecutor(readers, thread_name_prefix="db-reader")
+
+        # the writer creates the schema before any reader connects
+        self.writer_executor.submit(self.get_db, False).result()
+
+    def get_db(self, readonly: bool) -> PostsDb:
+        db = getattr(self.local, "db", None)
+        if db is None:
+            # connections are confined to their thread, check_same_thread is off only to close them in close()
+            db = PostsDb(self.filename, readonly=readonly, check_same_thread=False)
+            if self.archive:
+                attach_archive(db, self.archive, readonly)
+            self.local.db = db
+            with self.lock:
+                self.connections.append(db)
+        return db
+
+    def call(self, readonly: bool, func: Callable[..., T], *args: Any) -> T:
+        with DB_SECONDS.time(method=func.__name__, mode="read" if readonly else "write"):
+            return func(self.get_db(readonly), *args)
+
+    async def read(self, func: Callable[..., T], *args: Any) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.reader_executor, self.call, True, func, *args)
+
+    async def write(self, func: Callable[..., T], *args: Any) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.writer_executor, self.call, False, func, *args)
+
+    def close(self) -> None:
+        self.reader_executor.shutdown()
+        self.writer_executor.shutdown()
+        with self.lock:
+            for db in self.connections:
+                db.conn.close()
+            self.connections.clear()
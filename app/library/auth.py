@@ -1,34 +1,84 @@
 import jwt
+import math
 import os
 import time
 import logging
 
+from collections import Counter, OrderedDict
 from typing import Optional
 
+from .metrics import metrics
+
 AUTH_SECRET = os.environ["AUTH_SECRET"]
 
+TOKEN_CHECKS = metrics.counter("infoscape_token_checks_total", "Token checks by verified token cache result", ("result",))
+
 
 class Auth:
-    def __init__(self, secret: str = AUTH_SECRET):
+    def __init__(self, secret: str = AUTH_SECRET, cache_size: int = 1024, log_interval: float = 60) -> None:
         self.secret = secret
         self.algorithm = "HS256"
 
+        # verified token -> its "valid-til", least recently used first
+        self.cache: "OrderedDict[str, int]" = OrderedDict()
+        self.cache_size = cache_size
+        self.stats: Counter = Counter()  # per instance, TOKEN_CHECKS sums all instances and workers
+
+        self.log_interval = log_interval
+        self.last_log = -math.inf  # monotonic time may be below log_interval right after boot
+        self.suppressed = 0
+
     def get_token(self, lifetime: int = 3600) -> str:
         payload = {
             "valid-til": int(time.time()) + lifetime
         }
         return jwt.encode(payload, self.secret, algorithm=self.algorithm)
 
+    def count(self, result: str) -> None:
+        self.stats[result] += 1
+        TOKEN_CHECKS.inc(result=result)
+
+    def log_invalid(self) -> None:
+        now = time.monotonic()
+        if now - self.last_log < self.log_interval:
+            self.suppressed += 1
+            return
+
+        if self.suppressed:
+            logging.error(f"Invalid token ({self.suppressed} more since last report)")
+        else:
+            logging.error("Invalid token")
+        self.last_log = now
+        self.suppressed = 0
+
     def check_token(self, token: Optional[str]) -> bool:
         if not token:
             return False
 
+        now = time.time()
+        if (valid_til := self.cache.get(token)) is not None:
+            if valid_til > now:
+                self.cache.move_to_end(token)
+                self.count("hits")
+                return True
+
+            del self.cache[token]
+            self.count("expired")
+            return False
+
+        self.count("misses")
         try:
             decoded = jwt.decode(token, self.secret, algorithms=[self.algorithm])
 
-            if decoded["valid-til"] > time.time():
+            if decoded["valid-til"] > now:
+                self.cache[token] = decoded["valid-til"]
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
                 return True
+
+            self.count("expired")
         except Exception:
-            logging.error("Invalid token")
+            self.count("invalid")
+            self.log_invalid()
 
         return False
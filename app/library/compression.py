@@ -0,0 +1,32 @@
+import gzip
+from typing import Optional, Set, Tuple
+
+try:
+    import brotli
+except ImportError:  # optional, responses fall back to gzip
+    brotli = None
+
+MIN_SIZE = 512
+
+
+def accepted_encodings(accept_encoding: str) -> Set[str]:
+    encodings = set()
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        if params.strip().replace(" ", "") not in ("q=0", "q=0.0"):
+            encodings.add(name.strip().lower())
+    return encodings
+
+
+def compress(body: bytes, accept_encoding: str) -> Tuple[bytes, Optional[str]]:
+    # returns the body and its Content-Encoding, small bodies are not worth compressing
+    if len(body) < MIN_SIZE:
+        return body, None
+
+    encodings = accepted_encodings(accept_encoding)
+    if brotli is not None and "br" in encodings:
+        return brotli.compress(body, quality=5), "br"
+    if "gzip" in encodings:
+        return gzip.compress(body, compresslevel=6), "gzip"
+
+    return body, None
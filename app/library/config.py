@@ -1,5 +1,41 @@
+import re
 import yaml
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
+
+from .keywords import KeywordMatcher
+from .source_renderer import IngestRenderer, SourceRenderer
+
+ID_RE = re.compile(r"^[\w-]+$")
+INDEX_PAGE = "/"
+
+
+class ConfigException(ValueError):
+    pass
+
+
+def check(condition: bool, message: str) -> None:
+    if not condition:
+        raise ConfigException(message)
+
+
+class RetentionConfig:
+    def __init__(self, max_age_days: int = 0, max_rows: int = 0) -> None:
+        self.max_age_days = max_age_days  # Archive posts older than this, 0 to keep forever
+        self.max_rows = max_rows  # Archive all but newest max_rows posts of the source, 0 for no limit
+
+        for name in ("max_age_days", "max_rows"):
+            value = getattr(self, name)
+            check(isinstance(value, int) and value >= 0, f"retention {name} must be a non-negative integer")
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.max_age_days or self.max_rows)
+
+    def to_dict(self) -> Dict:
+        return {
+            "max_age_days": self.max_age_days,
+            "max_rows": self.max_rows,
+        }
 
 
 class SourceConfig:
@@ -8,7 +44,7 @@ class SourceConfig:
     def __init__(
         self,
         title: str, id: str, parser: str, link: str,
-        pages: Optional[List] = None, hidden: bool = False
+        pages: Optional[List] = None, hidden: bool = False, retention: Optional[Dict] = None
     ) -> None:
         self.title = title  # Link title
         self.id = id  # Internal unique news source name
@@ -16,8 +52,19 @@ class SourceConfig:
         self.parser = parser  # Parser kind
         self.pages = pages or []
         self.hidden = hidden
+        self.retention = RetentionConfig(**retention) if retention else None  # Overrides global retention
 
-        assert self.parser in self.allowed_parsers
+        self.validate()
+
+    def validate(self) -> None:
+        for name in ("title", "id", "link"):
+            check(isinstance(getattr(self, name), str) and getattr(self, name), f"source {name} must be set")
+        check(bool(ID_RE.match(self.id)), f"source id {self.id!r} may contain only letters, digits, _ and -")
+        check(self.link.startswith(("https://", "http://")), f"source {self.id} link must be an http(s) url")
+        check(self.parser in self.allowed_parsers, f"source {self.id} parser must be one of {self.allowed_parsers}")
+        check(isinstance(self.pages, list), f"source {self.id} pages must be a list")
+        for page in self.pages:
+            check(isinstance(page, str) and bool(ID_RE.match(page)), f"source {self.id} has invalid page {page!r}")
 
     def to_dict(self) -> Dict:
         return {
@@ -43,10 +90,29 @@ class PageConfig:
 
 
 class Config:
-    def __init__(self, title: str, hostname: str, keywords: List[str], sources: List[dict]) -> None:
+    # Immutable once built: everything requests need is precomputed here, ConfigManager swaps whole instances
+    def __init__(
+        self,
+        title: str,
+        hostname: str,
+        keywords: List[str],
+        sources: List[dict],
+        retention: Optional[Dict] = None,
+        image_cache_mb: int = 1024,
+    ) -> None:
         self.title = title
         self.hostname = hostname
+        self.retention = RetentionConfig(**(retention or {}))
         self.keywords = keywords
+        self.image_cache_mb = image_cache_mb  # Least recently used images are evicted beyond this size
+        check(isinstance(title, str) and isinstance(hostname, str), "title and hostname must be strings")
+        check(isinstance(keywords, list) and all(isinstance(k, str) for k in keywords), "keywords must be strings")
+        check(isinstance(sources, list) and bool(sources), "sources must be a non-empty list")
+        check(isinstance(image_cache_mb, int) and image_cache_mb > 0, "image_cache_mb must be a positive integer")
+
+        self.keyword_matcher = KeywordMatcher(keywords)
+        self.ingest_renderer = IngestRenderer(self.keyword_matcher)
+        self.source_renderer = SourceRenderer(self.keyword_matcher)
         self.sources = [SourceConfig(**s) for s in sources]
         self.sources.sort(key=lambda s: s.title)
 
@@ -60,13 +126,28 @@ class Config:
         for page in self.pages:
             self.pages[page].sources.sort(key=lambda s: s.title)
 
-        # TODO: check config integrity
+        self.sources_by_id = {s.id: s for s in self.sources}
+        check(len(self.sources_by_id) == len(self.sources), "source ids must be unique")
+
+        # (page slug, has token) -> sources shown, INDEX_PAGE has all of them
+        self.views: Dict[Tuple[str, bool], List[SourceConfig]] = {}
+        for slug, page_sources in [(INDEX_PAGE, self.sources)] + [(p.slug, p.sources) for p in self.pages.values()]:
+            self.views[slug, True] = list(page_sources)
+            self.views[slug, False] = [s for s in page_sources if not s.hidden]
+
+    def visible_sources(self, page_slug: str, has_token: bool) -> List[SourceConfig]:
+        # raises KeyError for unknown pages
+        return self.views[page_slug, has_token]
 
     @staticmethod
     def from_file_factory(filename: str) -> 'Config':
         with open(filename) as fin:
-            config = yaml.safe_load(fin)
-            return Config(**config)
+            try:
+                config = yaml.safe_load(fin)
+                check(isinstance(config, dict), "config must be a mapping")
+                return Config(**config)
+            except (yaml.YAMLError, TypeError) as e:
+                raise ConfigException(f"{filename}: {e}") from e
 
     def to_dict(self) -> Dict:
         return {
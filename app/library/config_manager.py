@@ -0,0 +1,67 @@
+import asyncio
+import logging
+import os
+from typing import Callable, List, Optional, Tuple
+
+from .config import Config, ConfigException
+
+logger = logging.getLogger("infoscape")
+
+
+class ConfigManager:
+    # Watches the config file and swaps in a new validated Config as a whole, so readers taking `manager.config`
+    # once per request or fetch cycle never see a half-loaded one; a broken file is logged and the old config kept
+    def __init__(self, filename: str, interval: float = 5) -> None:
+        self.filename = filename
+        self.interval = interval
+        self.listeners: List[Callable[[Config], None]] = []
+        self.task: Optional[asyncio.Task] = None
+
+        self.stamp = self.get_stamp()
+        self.config = Config.from_file_factory(filename)
+
+    def get_stamp(self) -> Tuple[int, int]:
+        stat = os.stat(self.filename)
+        return stat.st_mtime_ns, stat.st_size
+
+    def on_change(self, listener: Callable[[Config], None]) -> None:
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[Config], None]) -> None:
+        self.listeners.remove(listener)
+
+    def check(self) -> bool:
+        try:
+            stamp = self.get_stamp()
+            if stamp == self.stamp:
+                return False
+            self.stamp = stamp
+            config = Config.from_file_factory(self.filename)
+        except (OSError, ConfigException):
+            logger.exception(f"Error while reloading {self.filename}, keeping the current config")
+            return False
+
+        self.config = config
+        for listener in self.listeners:
+            listener(config)
+
+        logger.info(f"reloaded {self.filename}: {len(config.sources)} sources, {len(config.pages)} pages")
+        return True
+
+    def start(self) -> None:
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            self.check()
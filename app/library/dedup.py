@@ -0,0 +1,145 @@
+import hashlib
+import sqlite3
+from typing import Dict, List, Optional, Tuple
+
+from .text import TAG_RE, WORD_RE, fold
+
+# 64-bit SimHash split into 4 bands of 16 bits: signatures within MAX_DISTANCE bits share at least one band
+# exactly, so candidates are found by indexed band lookups instead of comparing with every post
+BANDS = 4
+BAND_BITS = 16
+MAX_DISTANCE = 3
+MIN_SHINGLES = 8  # shorter posts are too generic to be matched
+WINDOW = 2 * 24 * 3600  # duplicates are only looked for among posts within this many seconds
+
+
+def story_text(text: str) -> str:
+    # forwarded text is quoted with "> " prefixes by TelegramParser.format_body, it is the story itself,
+    # while the reposting channel's own comment would only make copies look different
+    quoted = [line.lstrip("> ") for line in text.splitlines() if line.startswith(">")]
+    return "\n".join(quoted) if quoted else text
+
+
+def shingles(text: str) -> List[str]:
+    text = fold(TAG_RE.sub(" ", story_text(text))).lower()
+    words = WORD_RE.findall(text)
+    return [" ".join(words[i: i + 2]) for i in range(len(words) - 1)]
+
+
+def simhash(text: str) -> int:
+    # returns 0 for texts too short to be fingerprinted
+    features = shingles(text)
+    if len(features) < MIN_SHINGLES:
+        return 0
+
+    # one 64-char bit string per feature, columns are counted by zip in C rather than bit by bit in python
+    bits = [
+        format(int.from_bytes(hashlib.blake2b(f.encode(), digest_size=8).digest(), "big"), "064b") for f in features
+    ]
+    half = len(bits) / 2
+    return int("".join("1" if column.count("1") > half else "0" for column in zip(*bits)), 2)
+
+
+def bands(signature: int) -> List[int]:
+    mask = (1 << BAND_BITS) - 1
+    return [signature >> (i * BAND_BITS) & mask for i in range(BANDS)]
+
+
+def distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def to_sql(signature: int) -> int:
+    # sqlite integers are signed 64-bit
+    return signature - (1 << 64) if signature >= 1 << 63 else signature
+
+
+def from_sql(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+def create_signatures(conn: sqlite3.Connection) -> None:
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'post_signatures'").fetchone()
+
+    band_columns = "".join(f"b{i} INT, " for i in range(BANDS))
+    band_indexes = "".join(
+        f"CREATE INDEX IF NOT EXISTS post_signatures_b{i} ON post_signatures (b{i}, timestamp);" for i in range(BANDS)
+    )
+    conn.executescript(
+        f"""
+        CREATE TABLE IF NOT EXISTS post_signatures (
+            source_id   TEXT,
+            link        TEXT,
+            timestamp   INT,
+            signature   INT,
+            {band_columns}
+            cluster     TEXT,
+            PRIMARY KEY (source_id, link)
+        );
+        {band_indexes}
+        CREATE INDEX IF NOT EXISTS post_signatures_link ON post_signatures (link);
+
+        CREATE TRIGGER IF NOT EXISTS posts_signature_delete AFTER DELETE ON posts BEGIN
+            DELETE FROM post_signatures WHERE source_id = old.source_id AND link = old.link;
+        END;
+        """
+    )
+
+    if not exists:
+        # oldest first, so clusters are named after the first copy of a story
+        with conn:
+            cursor = conn.cursor()
+            rows = conn.execute("SELECT source_id, link, timestamp, text FROM posts ORDER BY timestamp").fetchall()
+            for source_id, link, timestamp, text in rows:
+                index_post(cursor, source_id, link, int(timestamp), text)
+
+
+def find_cluster(cursor: sqlite3.Cursor, source_id: str, timestamp: int, signature: int) -> Optional[str]:
+    # nearest signature from other sources wins
+    band_filter = " OR ".join(f"(b{i} = ? AND timestamp BETWEEN ? AND ?)" for i in range(BANDS))
+    params: List[int] = []
+    for band in bands(signature):
+        params.extend((band, timestamp - WINDOW, timestamp + WINDOW))
+
+    cursor.execute(
+        f"SELECT source_id, signature, cluster FROM post_signatures WHERE {band_filter}",
+        params,
+    )
+
+    best: Optional[Tuple[int, str]] = None
+    for other_source_id, other_signature, cluster in cursor.fetchall():
+        if other_source_id == source_id:
+            continue
+        d = distance(signature, from_sql(other_signature))
+        if d <= MAX_DISTANCE and (best is None or d < best[0]):
+            best = d, cluster
+    return best[1] if best else None
+
+
+def index_post(cursor: sqlite3.Cursor, source_id: str, link: str, timestamp: int, text: str) -> None:
+    cursor.execute("DELETE FROM post_signatures WHERE source_id = ? AND link = ?", (source_id, link))
+    if not (signature := simhash(text)):
+        return
+
+    cluster = find_cluster(cursor, source_id, timestamp, signature) or link
+    band_columns = ", ".join(f"b{i}" for i in range(BANDS))
+    cursor.execute(
+        f"""
+        INSERT INTO post_signatures (source_id, link, timestamp, signature, {band_columns}, cluster)
+        VALUES (?, ?, ?, ?, {", ".join("?" * BANDS)}, ?)
+        """,
+        (source_id, link, timestamp, to_sql(signature), *bands(signature), cluster),
+    )
+
+
+def get_clusters(conn: sqlite3.Connection, links: List[str]) -> Dict[str, str]:
+    # link -> cluster, posts without a signature are not returned
+    clusters: Dict[str, str] = {}
+    for start in range(0, len(links), 500):
+        chunk = links[start: start + 500]
+        cursor = conn.execute(
+            f"SELECT link, cluster FROM post_signatures WHERE link IN ({', '.join('?' * len(chunk))})",
+            chunk,
+        )
+        clusters.update(cursor.fetchall())
+    return clusters
@@ -0,0 +1,69 @@
+import base64
+import binascii
+import json
+from typing import Dict, List, Optional, Tuple, Union
+
+from .posts_db import Post
+from .source_renderer import get_post_id
+
+# API field name -> Post attribute
+FIELDS = {
+    "id": "post_id",
+    "source_id": "source_id",
+    "link": "link",
+    "timestamp": "timestamp",
+    "heading": "heading",
+    "text": "text",
+    "summary": "summary",
+    "html": "html",
+}
+DEFAULT_FIELDS = ("id", "source_id", "link", "timestamp", "heading", "text")
+
+Cursor = Tuple[int, str]
+
+
+class FeedException(Exception):
+    pass
+
+
+def parse_fields(fields: str) -> List[str]:
+    if not fields:
+        return list(DEFAULT_FIELDS)
+
+    names = [f.strip() for f in fields.split(",") if f.strip()]
+    if unknown := [f for f in names if f not in FIELDS]:
+        raise FeedException(f"Unknown fields: {', '.join(unknown)}")
+    return names
+
+
+def encode_cursor(post: Post) -> str:
+    # opaque for clients, it is the (timestamp, link) keyset of the last returned post
+    data = json.dumps([post.timestamp, post.link], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Optional[Cursor]:
+    if not cursor:
+        return None
+
+    try:
+        timestamp, link = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return int(timestamp), str(link)
+    except (binascii.Error, ValueError, TypeError):
+        raise FeedException("Invalid cursor")
+
+
+def feed_item(post: Post, fields: List[str]) -> Dict[str, Union[str, int]]:
+    item = {f: getattr(post, FIELDS[f]) for f in fields}
+    if "id" in item and not item["id"]:
+        # row is not rendered yet, see "main.py render"
+        item["id"] = get_post_id(post.link)
+    return item
+
+
+def feed_page(posts: List[Post], fields: List[str], limit: int) -> Dict:
+    # posts are selected with limit + 1 to know whether there is a next page without an extra query
+    return {
+        "posts": [feed_item(p, fields) for p in posts[:limit]],
+        "next": encode_cursor(posts[limit - 1]) if len(posts) > limit else None,
+    }
@@ -0,0 +1,62 @@
+from typing import Any, Dict, Optional
+
+import aiohttp
+
+
+class HttpClient:
+    # Sessions are created lazily inside the running loop and share one connector with keep-alive and DNS cache
+
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 10,
+        dns_ttl: int = 300,
+        keepalive_timeout: float = 60,
+        timeout: float = 30,
+    ) -> None:
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+
+        self.connector: Optional[aiohttp.TCPConnector] = None
+        self.sessions: Dict[str, aiohttp.ClientSession] = {}
+
+    def get_connector(self) -> aiohttp.TCPConnector:
+        if self.connector is None or self.connector.closed:
+            self.connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.dns_ttl,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+        return self.connector
+
+    def session(self, base_url: Optional[str] = None) -> aiohttp.ClientSession:
+        key = base_url or ""
+        session = self.sessions.get(key)
+        if session is None or session.closed:
+            session = aiohttp.ClientSession(
+                base_url,
+                connector=self.get_connector(),
+                connector_owner=False,
+                timeout=self.timeout,
+            )
+            self.sessions[key] = session
+        return session
+
+    async def close(self) -> None:
+        for session in self.sessions.values():
+            await session.close()
+        self.sessions.clear()
+
+        if self.connector is not None:
+            await self.connector.close()
+            self.connector = None
+
+    async def __aenter__(self) -> "HttpClient":
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        await self.close()
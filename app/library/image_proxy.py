@@ -0,0 +1,103 @@
+import asyncio
+import logging
+from typing import List, Optional, Set, Tuple
+
+import aiohttp
+from starlette.responses import FileResponse, RedirectResponse, Response
+
+from .assets import IMMUTABLE
+from .async_db import AsyncPostsDb
+from .http_client import HttpClient
+from .images import IMG_RE, ImageCache, image_key
+from .metrics import metrics
+from .posts_db import Post, PostsDb
+
+logger = logging.getLogger("infoscape")
+
+MAX_IMAGE_BYTES = 10 << 20
+
+IMAGES = metrics.counter("infoscape_images_total", "Proxied image requests by result", ("result",))
+
+
+class ImageProxy:
+    # Images of new posts are downloaded by the fetcher in the background, /img/<key> serves them from the cache
+    # and fetches lazily what is missing, e.g. evicted or failed at ingest; if the original can't be fetched,
+    # the client is redirected to it
+    def __init__(self, db: AsyncPostsDb, client: HttpClient, cache: ImageCache, workers: int = 4) -> None:
+        self.db = db
+        self.client = client
+        self.cache = cache
+        self.workers = workers
+        self.queue: "asyncio.Queue[Tuple[str, str]]" = asyncio.Queue(maxsize=10000)
+        self.queued: Set[str] = set()
+        self.tasks: List[asyncio.Task] = []
+
+    async def prefetch(self, posts: List[Post]) -> None:
+        # WriteBehindQueue listener
+        if not self.tasks:
+            self.tasks = [asyncio.create_task(self.run()) for _ in range(self.workers)]
+
+        for post in posts:
+            for url in IMG_RE.findall(post.text):
+                key = image_key(url)
+                if key not in self.queued and not self.queue.full():
+                    self.queued.add(key)
+                    self.queue.put_nowait((key, url))
+
+    async def stop(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def run(self) -> None:
+        while True:
+            key, url = await self.queue.get()
+            try:
+                await self.fetch(key, url)
+            except Exception:
+                logger.exception(f"Error while prefetching {url}")
+            finally:
+                self.queued.discard(key)
+
+    async def download(self, url: str) -> Optional[bytes]:
+        try:
+            async with self.client.session().get(url) as response:
+                if response.status != 200 or (response.content_length or 0) > MAX_IMAGE_BYTES:
+                    return None
+                data = await response.content.read(MAX_IMAGE_BYTES + 1)
+                return data if len(data) <= MAX_IMAGE_BYTES else None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"could not download {url}: {e}")
+            return None
+
+    async def fetch(self, key: str, url: str) -> Optional[str]:
+        # downloads and caches the image, returns its digest
+        if (data := await self.download(url)) is None:
+            IMAGES.inc(result="download_failed")
+            return None
+
+        loop = asyncio.get_running_loop()
+        if (digest := await loop.run_in_executor(None, self.cache.store, data)) is None:
+            IMAGES.inc(result="not_image")
+            return None
+
+        await self.db.write(PostsDb.set_image_digest, key, digest)
+        IMAGES.inc(result="fetched")
+        return digest
+
+    async def response(self, key: str, webp: bool) -> Response:
+        if (image := await self.db.read(PostsDb.get_image, key)) is None:
+            IMAGES.inc(result="unknown")
+            return Response(status_code=404)
+
+        url, digest = image
+        if digest is None or (found := self.cache.find(digest, webp)) is None:
+            if (digest := await self.fetch(key, url)) is None or (found := self.cache.find(digest, webp)) is None:
+                return RedirectResponse(url)
+        else:
+            IMAGES.inc(result="hit")
+
+        path, media_type = found
+        # the key names the original url, so the content never changes
+        return FileResponse(path, media_type=media_type, headers={"Cache-Control": IMMUTABLE, "Vary": "Accept"})
@@ -0,0 +1,171 @@
+import hashlib
+import io
+import logging
+import os
+import re
+import sqlite3
+import time
+from contextlib import suppress
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from PIL import Image, ImageOps
+    HAS_PILLOW = True
+except ImportError:  # optional, originals are cached as they are then
+    HAS_PILLOW = False
+
+logger = logging.getLogger("infoscape")
+
+# as appended to post texts by TelegramParser.parse_html
+IMG_RE = re.compile(r'<img src="(https?://[^"]+)">')
+
+THUMBNAIL_SIZE = 800  # px, fits the widest post details
+TOUCH_INTERVAL = 3600  # seconds between access time updates of a cached image
+EVICT_INTERVAL = 60
+
+# extension -> media type, fallbacks are served to clients that don't accept WebP
+WEBP = ".webp"
+MEDIA_TYPES = {WEBP: "image/webp", ".jpg": "image/jpeg", ".png": "image/png", ".gif": "image/gif"}
+SIGNATURES = {b"\xff\xd8\xff": ".jpg", b"\x89PNG": ".png", b"GIF8": ".gif"}
+
+
+def image_key(url: str) -> str:
+    return hashlib.sha256(url.encode()).hexdigest()[:32]
+
+
+def proxy_images(html: str) -> str:
+    # post images are served by /img/<key> from the local cache instead of the CDN
+    return IMG_RE.sub(lambda m: f'<img src="/img/{image_key(m.group(1))}" loading="lazy">', html)
+
+
+def create_images(conn: sqlite3.Connection) -> None:
+    # image key -> original url and the digest of its cached content, null until fetched
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS images (
+            key     TEXT PRIMARY KEY,
+            url     TEXT,
+            digest  TEXT
+        );
+        """
+    )
+
+
+def index_images(cursor: sqlite3.Cursor, text: str) -> None:
+    if urls := IMG_RE.findall(text):
+        cursor.executemany(
+            "INSERT OR IGNORE INTO images (key, url) VALUES (?, ?)", [(image_key(url), url) for url in urls]
+        )
+
+
+def detect_extension(data: bytes) -> Optional[str]:
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return WEBP
+    for signature, extension in SIGNATURES.items():
+        if data.startswith(signature):
+            return extension
+    return None
+
+
+class ImageCache:
+    # Content-addressed files <directory>/<digest[:2]>/<digest>.<ext>: a WebP thumbnail and a JPEG or PNG fallback,
+    # or the original when Pillow is not installed. Least recently used images are evicted beyond max_bytes,
+    # file modification times serve as access times so server workers and the fetcher share the cache
+    def __init__(self, directory: str = "data/images", max_bytes: int = 1 << 30) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.last_eviction = 0.0
+
+    def path(self, digest: str, extension: str) -> str:
+        return os.path.join(self.directory, digest[:2], f"{digest}{extension}")
+
+    def find(self, digest: str, webp: bool) -> Optional[Tuple[str, str]]:
+        # path and media type of the best variant
+        for extension in ([WEBP] if webp else []) + [".jpg", ".png", ".gif", WEBP]:
+            path = self.path(digest, extension)
+            try:
+                mtime = os.stat(path).st_mtime
+            except FileNotFoundError:
+                continue
+            if mtime < time.time() - TOUCH_INTERVAL:
+                with suppress(OSError):
+                    os.utime(path)
+            return path, MEDIA_TYPES[extension]
+        return None
+
+    @staticmethod
+    def convert(data: bytes) -> Dict[str, bytes]:
+        # extension -> content, empty for unsupported data
+        if not HAS_PILLOW:
+            extension = detect_extension(data)
+            return {extension: data} if extension else {}
+
+        try:
+            with Image.open(io.BytesIO(data)) as original:
+                image = ImageOps.exif_transpose(original)
+                image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+
+                variants = {}
+                buffer = io.BytesIO()
+                image.save(buffer, "WEBP", quality=80, method=4)
+                variants[WEBP] = buffer.getvalue()
+
+                buffer = io.BytesIO()
+                if image.mode in ("RGBA", "LA", "P"):
+                    image.save(buffer, "PNG", optimize=True)
+                    variants[".png"] = buffer.getvalue()
+                else:
+                    image.convert("RGB").save(buffer, "JPEG", quality=85, optimize=True, progressive=True)
+                    variants[".jpg"] = buffer.getvalue()
+                return variants
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            logger.warning(f"could not convert an image: {e}")
+            return {}
+
+    def store(self, data: bytes) -> Optional[str]:
+        # returns the digest, None if the data is not an image; blocking, called in an executor
+        digest = hashlib.sha256(data).hexdigest()[:32]
+        if self.find(digest, webp=True) is not None:
+            return digest
+
+        if not (variants := self.convert(data)):
+            return None
+
+        os.makedirs(os.path.join(self.directory, digest[:2]), exist_ok=True)
+        for extension, content in variants.items():
+            path = self.path(digest, extension)
+            with open(f"{path}.tmp", "wb") as fout:
+                fout.write(content)
+            os.replace(f"{path}.tmp", path)
+
+        if time.monotonic() - self.last_eviction > EVICT_INTERVAL:
+            self.last_eviction = time.monotonic()
+            self.evict()
+        return digest
+
+    def evict(self) -> int:
+        # removes least recently used images until the cache is 10% below its limit, returns removed bytes
+        images: Dict[str, List] = {}  # digest -> [last access, size, paths]
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                with suppress(FileNotFoundError):
+                    stat = os.stat(path)
+                    image = images.setdefault(name.split(".")[0], [0.0, 0, []])
+                    image[0] = max(image[0], stat.st_mtime)
+                    image[1] += stat.st_size
+                    image[2].append(path)
+                    total += stat.st_size
+
+        removed = 0
+        if total > self.max_bytes:
+            for _, size, paths in sorted(images.values(), key=lambda image: image[0]):
+                if total - removed <= self.max_bytes * 0.9:
+                    break
+                for path in paths:
+                    with suppress(FileNotFoundError):
+                        os.remove(path)
+                removed += size
+            logger.info(f"evicted {removed} bytes of images")
+        return removed
@@ -0,0 +1,27 @@
+import re
+from typing import List
+
+TAG_RE = re.compile(r"(<[^>]*>)")
+
+
+class KeywordMatcher:
+    # Keywords are literal strings matched case-insensitively by one compiled alternation, longest first
+    def __init__(self, keywords: List[str]) -> None:
+        self.keywords = keywords
+
+        self.pattern = None
+        if words := sorted({k for k in keywords if k}, key=len, reverse=True):
+            self.pattern = re.compile("|".join(re.escape(w) for w in words), re.IGNORECASE)
+
+    def highlight(self, text: str) -> str:
+        if self.pattern is None:
+            return text
+        return self.pattern.sub(r"<mark>\g<0></mark>", text)
+
+    def highlight_html(self, html: str) -> str:
+        # keep tags and their attributes (e.g. image urls) untouched
+        if self.pattern is None:
+            return html
+        parts = TAG_RE.split(html)
+        parts[::2] = [self.highlight(part) for part in parts[::2]]
+        return "".join(parts)
@@ -0,0 +1,152 @@
+import asyncio
+import json
+import logging
+from collections import deque
+from typing import AsyncGenerator, Deque, FrozenSet, List, Optional, Tuple
+
+from .async_db import AsyncPostsDb
+from .keywords import KeywordMatcher
+from .posts_db import Post, PostsDb
+from .source_renderer import PostRenderer
+
+logger = logging.getLogger("infoscape")
+
+# seq, source id, rendered "post" event payload
+LiveEvent = Tuple[int, str, str]
+
+
+class LiveUpdates:
+    # One poller per worker reads new posts by the seq cursor and renders each of them once, connections only
+    # wait for a shared wake-up and filter the shared buffer, so fan-out doesn't touch the database.
+    #
+    #   async for chunk in live_updates.stream(source_ids, last_event_id):
+    #       ...  # Server-Sent Events wire format
+    def __init__(
+        self,
+        db: AsyncPostsDb,
+        keyword_matcher: KeywordMatcher,
+        interval: float = 1.0,
+        buffer_size: int = 1000,
+        heartbeat: float = 15.0,
+    ) -> None:
+        self.db = db
+        self.post_renderer = PostRenderer(keyword_matcher)
+        self.interval = interval
+        self.buffer_size = buffer_size
+        self.heartbeat = heartbeat
+
+        # the buffer holds every change after buffer_from up to last_seq
+        self.buffer: Deque[LiveEvent] = deque(maxlen=buffer_size)
+        self.buffer_from = 0
+        self.last_seq = 0
+        self.connections = 0
+
+        self.task: Optional[asyncio.Task] = None
+        self.ready: Optional[asyncio.Event] = None
+        self.changed: Optional[asyncio.Event] = None
+
+    def set_keyword_matcher(self, keyword_matcher: KeywordMatcher) -> None:
+        # buffered events stay as rendered, only posts read afterwards use the new keywords
+        self.post_renderer = PostRenderer(keyword_matcher)
+
+    def render(self, seq: int, post: Post) -> LiveEvent:
+        rendered = self.post_renderer(post)._asdict()
+        rendered["source_id"] = post.source_id
+        return seq, post.source_id, json.dumps(rendered, ensure_ascii=False)
+
+    async def start(self) -> None:
+        # lazily, inside the running loop of the worker
+        if self.task is None:
+            self.ready = asyncio.Event()
+            self.changed = asyncio.Event()
+            self.task = asyncio.create_task(self.run())
+
+        assert self.ready is not None
+        await self.ready.wait()
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def run(self) -> None:
+        assert self.ready is not None
+        self.last_seq = self.buffer_from = await self.db.read(PostsDb.get_last_seq)
+        self.ready.set()
+
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.poll()
+            except Exception:
+                logger.exception("Error while polling live updates")
+
+    async def poll(self) -> None:
+        rows = await self.db.read(PostsDb.select_since, self.last_seq, None, self.buffer_size)
+        if not rows:
+            return
+
+        self.buffer.extend(self.render(seq, post) for seq, post in rows)
+        self.last_seq = rows[-1][0]
+        if len(self.buffer) == self.buffer_size:
+            self.buffer_from = max(self.buffer_from, self.buffer[0][0] - 1)
+
+        # wake every connection once and arm a new event for the next batch
+        assert self.changed is not None
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+    async def since(self, source_ids: FrozenSet[str], after_seq: int) -> Tuple[List[LiveEvent], int]:
+        # returns events after the cursor and the new cursor; clients that fell behind the buffer,
+        # e.g. reconnecting after a while, are served from the database
+        if after_seq >= self.buffer_from:
+            events = [e for e in self.buffer if e[0] > after_seq and e[1] in source_ids]
+            return events, self.last_seq
+
+        last_seq = self.last_seq
+        rows = await self.db.read(PostsDb.select_since, after_seq, list(source_ids), self.buffer_size)
+        if len(rows) < self.buffer_size:
+            # everything up to the poller's cursor is covered, newer rows will come from the buffer
+            rows = [(seq, post) for seq, post in rows if seq <= last_seq]
+            cursor = last_seq
+        else:
+            cursor = rows[-1][0]
+
+        return [self.render(seq, post) for seq, post in rows], cursor
+
+    @staticmethod
+    def format(event: LiveEvent) -> str:
+        seq, _, data = event
+        return f"id: {seq}\nevent: post\ndata: {data}\n\n"
+
+    async def stream(self, source_ids: FrozenSet[str], after_seq: int = 0) -> AsyncGenerator[str, None]:
+        await self.start()
+
+        if after_seq <= 0 or after_seq > self.last_seq:
+            after_seq = self.last_seq
+
+        self.connections += 1
+        try:
+            yield "retry: 5000\n\n"
+
+            while True:
+                changed = self.changed
+                assert changed is not None
+
+                events, after_seq = await self.since(source_ids, after_seq)
+                for event in events:
+                    yield self.format(event)
+
+                if after_seq < self.last_seq:
+                    continue
+
+                try:
+                    await asyncio.wait_for(changed.wait(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+        finally:
+            self.connections -= 1
@@ -0,0 +1,273 @@
+import asyncio
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import suppress
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger("infoscape")
+
+LabelValues = Tuple[str, ...]
+
+# seconds, from sqlite point lookups to slow fetches
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()  # db metrics are updated from executor threads
+
+    def key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def format_labels(self, values: LabelValues, extra: str = "") -> str:
+        pairs = [f'{k}="{v}"' for k, v in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    @abstractmethod
+    def snapshot(self) -> List:
+        pass
+
+    @abstractmethod
+    def merge(self, total: Dict[LabelValues, Any], snapshot: List) -> None:
+        pass
+
+    @abstractmethod
+    def expose(self, total: Dict[LabelValues, Any]) -> Iterator[str]:
+        pass
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        super().__init__(name, help, labels)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def snapshot(self) -> List:
+        with self.lock:
+            return [[list(k), v] for k, v in self.values.items()]
+
+    def merge(self, total: Dict[LabelValues, Any], snapshot: List) -> None:
+        for key, value in snapshot:
+            total[tuple(key)] = total.get(tuple(key), 0) + value
+
+    def expose(self, total: Dict[LabelValues, Any]) -> Iterator[str]:
+        for key, value in sorted(total.items()):
+            yield f"{self.name}{self.format_labels(key)} {value}"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        # label values -> [per bucket counts (last one is +Inf), sum]
+        self.values: Dict[LabelValues, List] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self.key(labels)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            if (data := self.values.get(key)) is None:
+                data = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            data[0][index] += 1
+            data[1] += value
+
+    def time(self, **labels: str) -> "Timer":
+        return Timer(self, labels)
+
+    def snapshot(self) -> List:
+        with self.lock:
+            return [[list(k), list(counts), total] for k, (counts, total) in self.values.items()]
+
+    def merge(self, total: Dict[LabelValues, Any], snapshot: List) -> None:
+        for key, counts, value_sum in snapshot:
+            if (data := total.get(tuple(key))) is None:
+                total[tuple(key)] = [list(counts), value_sum]
+            else:
+                data[0] = [a + b for a, b in zip(data[0], counts)]
+                data[1] += value_sum
+
+    def expose(self, total: Dict[LabelValues, Any]) -> Iterator[str]:
+        for key, (counts, value_sum) in sorted(total.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{self.format_labels(key, le)} {cumulative}"
+            yield f"{self.name}_sum{self.format_labels(key)} {value_sum}"
+            yield f"{self.name}_count{self.format_labels(key)} {cumulative}"
+
+
+class Timer:
+    # with HISTOGRAM.time(route="/"): ...
+    def __init__(self, histogram: Histogram, labels: Dict[str, str]) -> None:
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self) -> "Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class Registry:
+    # Every process keeps its own metrics in memory and periodically dumps them to <directory>/<pid>-<start>.json;
+    # /metrics sums the dumps of all live processes, so server workers and the fetcher are reported together.
+    # The process start time tells a dump of a previous run apart when its pid is reused, e.g. after a container restart
+    def __init__(self, directory: str = "data/metrics") -> None:
+        self.directory = directory
+        self.metrics: Dict[str, Metric] = {}
+        self.task: Optional[asyncio.Task] = None
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        metric = self.metrics[name] = Counter(name, help, labels)
+        return metric
+
+    def histogram(
+        self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        metric = self.metrics[name] = Histogram(name, help, labels, buckets)
+        return metric
+
+    def snapshot(self) -> Dict[str, List]:
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def filename(self, pid: int) -> str:
+        return os.path.join(self.directory, f"{pid}-{process_start(pid)}.json")
+
+    def dump(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        filename = self.filename(os.getpid())
+        with open(f"{filename}.tmp", "w") as fout:
+            json.dump(self.snapshot(), fout)
+        os.replace(f"{filename}.tmp", filename)
+
+    def load(self) -> List[Dict[str, List]]:
+        # the current process is read from memory, dumps of exited processes are removed
+        snapshots = [self.snapshot()]
+        own = self.filename(os.getpid())
+        for filename in glob.glob(os.path.join(self.directory, "*.json")):
+            if filename == own:
+                continue
+            pid, _, start = os.path.basename(filename)[:-len(".json")].partition("-")
+            if not is_alive(int(pid)) or process_start(int(pid)) != start:
+                with suppress(OSError):
+                    os.remove(filename)
+                continue
+            try:
+                with open(filename) as fin:
+                    snapshots.append(json.load(fin))
+            except (OSError, ValueError):
+                continue  # being replaced right now
+        return snapshots
+
+    def expose(self) -> str:
+        totals: Dict[str, Dict[LabelValues, Any]] = {name: {} for name in self.metrics}
+        for snapshot in self.load():
+            for name, values in snapshot.items():
+                if name in self.metrics:
+                    self.metrics[name].merge(totals[name], values)
+
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(metric.expose(totals[name]))
+        return "\n".join(lines) + "\n"
+
+    def start(self, interval: float = 5) -> None:
+        if self.task is None:
+            self.task = asyncio.create_task(self.run(interval))
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        with suppress(OSError):
+            os.remove(self.filename(os.getpid()))
+
+    async def run(self, interval: float) -> None:
+        while True:
+            try:
+                self.dump()
+            except OSError:
+                logger.exception("Error while writing metrics")
+            await asyncio.sleep(interval)
+
+
+def is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def process_start(pid: int) -> str:
+    # start time in clock ticks since boot, field 22 of /proc/<pid>/stat; the command name before it may contain spaces
+    try:
+        with open(f"/proc/{pid}/stat") as fin:
+            return fin.read().rsplit(")", 1)[1].split()[19]
+    except (OSError, IndexError):
+        return ""
+
+
+metrics = Registry()
+
+REQUEST_SECONDS = metrics.histogram(
+    "infoscape_request_seconds", "Time to response headers per route", ("method", "route", "status")
+)
+
+
+class MetricsMiddleware:
+    # Plain ASGI middleware: times requests until the response starts, so live update streams are counted too,
+    # routes are reported by their path templates to keep the number of series bounded
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Dict, receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+
+        async def timed_send(message: Dict) -> None:
+            if message["type"] == "http.response.start":
+                route = getattr(scope.get("route"), "path", "unmatched")
+                REQUEST_SECONDS.observe(
+                    time.perf_counter() - start, method=scope["method"], route=route, status=str(message["status"])
+                )
+            await send(message)
+
+        await self.app(scope, receive, timed_send)
@@ -0,0 +1,85 @@
+import asyncio
+import hashlib
+import logging
+from contextlib import suppress
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, Hashable, Iterable, Optional, Set
+
+from .async_db import AsyncPostsDb
+from .metrics import metrics
+from .posts_db import PostsDb
+
+logger = logging.getLogger("infoscape")
+
+PAGE_CACHE = metrics.counter("infoscape_page_cache_requests_total", "Rendered page cache lookups", ("result",))
+
+
+@dataclass
+class CachedPage:
+    html: str
+    etag: str
+    source_ids: FrozenSet[str]
+
+
+class PageCache:
+    # Rendered pages are dropped when any of their sources gets new posts, ingest bumps per-source versions in the db.
+    # The versions are polled by a background task, so lookups are plain dict reads that never touch SQLite
+    def __init__(self, db: AsyncPostsDb, interval: float = 1.0) -> None:
+        self.db = db
+        self.interval = interval
+        self.pages: Dict[Hashable, CachedPage] = {}
+        self.versions: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        # lazily, inside the running loop of the worker
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self.task
+            self.task = None
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Error while refreshing the page cache")
+            await asyncio.sleep(self.interval)
+
+    async def refresh(self) -> None:
+        versions = await self.db.read(PostsDb.get_versions)
+        changed = {s for s, v in versions.items() if self.versions.get(s) != v}
+        self.versions = versions
+        self.invalidate(changed)
+
+    def invalidate(self, source_ids: Set[str]) -> None:
+        if source_ids:
+            self.pages = {k: p for k, p in self.pages.items() if not (p.source_ids & source_ids)}
+
+    def clear(self) -> None:
+        self.pages = {}
+
+    def get(self, key: Hashable) -> Optional[CachedPage]:
+        self.start()
+
+        page = self.pages.get(key)
+        if page is None:
+            self.misses += 1
+            PAGE_CACHE.inc(result="miss")
+        else:
+            self.hits += 1
+            PAGE_CACHE.inc(result="hit")
+        return page
+
+    def put(self, key: Hashable, html: str, source_ids: Iterable[str]) -> CachedPage:
+        etag = '"' + hashlib.sha1(html.encode()).hexdigest()[:20] + '"'
+        page = CachedPage(html, etag, frozenset(source_ids))
+        self.pages[key] = page
+        return page
@@ -0,0 +1,102 @@
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, List, Optional, Tuple
+
+from .metrics import metrics
+
+logger = logging.getLogger("infoscape")
+
+# source id, compressed page
+StoredPage = Tuple[str, bytes]
+
+STORED_PAGES = metrics.counter("infoscape_stored_pages_total", "Downloaded pages kept for reparse by result", ("result",))
+
+
+def pack(html: str) -> bytes:
+    return zlib.compress(html.encode(), 9)
+
+
+def unpack(data: bytes) -> str:
+    return zlib.decompress(data).decode()
+
+
+class PageStore:
+    # Raw channel pages as downloaded by the fetcher, so posts can be parsed again after parser fixes
+    # with "main.py reparse". Pages are zlib-compressed and stored once per content hash, rowid keeps
+    # the fetch order. The connection lives in a single thread, compression doesn't block the event loop
+    def __init__(self, filename: str = "data/pages.sqlite") -> None:
+        self.filename = filename
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="page-store")
+        self.conn: Optional[sqlite3.Connection] = None
+
+    def connect(self) -> sqlite3.Connection:
+        if self.conn is None:
+            # used from the executor thread only, check_same_thread is off only to close it in close()
+            self.conn = sqlite3.connect(self.filename, timeout=10, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS pages (
+                    digest      TEXT PRIMARY KEY,
+                    source_id   TEXT,
+                    fetched     INT,
+                    data        BLOB
+                );
+                """
+            )
+        return self.conn
+
+    def put(self, source_id: str, html: str) -> bool:
+        # False for a page stored before
+        conn = self.connect()
+        digest = hashlib.sha1(html.encode()).hexdigest()
+        if conn.execute("SELECT 1 FROM pages WHERE digest = ?", (digest,)).fetchone():
+            STORED_PAGES.inc(result="duplicate")
+            return False
+
+        with conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO pages (digest, source_id, fetched, data) VALUES (?, ?, ?, ?)",
+                (digest, source_id, int(time.time()), pack(html)),
+            )
+        STORED_PAGES.inc(result="stored")
+        return True
+
+    def select(self, after: int, limit: int, source_ids: List[str]) -> List[Tuple[int, str, bytes]]:
+        condition = f"AND source_id IN ({', '.join('?' * len(source_ids))})" if source_ids else ""
+        cursor = self.connect().execute(
+            f"SELECT rowid, source_id, data FROM pages WHERE rowid > ? {condition} ORDER BY rowid LIMIT ?",
+            (after, *source_ids, limit),
+        )
+        return cursor.fetchall()
+
+    async def add(self, source_id: str, html: str) -> bool:
+        # a failed write never fails the fetch
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self.executor, self.put, source_id, html)
+        except sqlite3.Error:
+            logger.exception(f"Error while storing a page of {source_id}")
+            return False
+
+    async def iter_batches(
+        self, batch_size: int = 50, source_ids: Optional[List[str]] = None
+    ) -> AsyncIterator[List[StoredPage]]:
+        # oldest first, so the latest version of a post seen on several pages is written last
+        loop = asyncio.get_running_loop()
+        after = 0
+        while rows := await loop.run_in_executor(self.executor, self.select, after, batch_size, source_ids or []):
+            after = rows[-1][0]
+            yield [(source_id, data) for _, source_id, data in rows]
+
+    def close(self) -> None:
+        self.executor.shutdown()
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
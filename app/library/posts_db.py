@@ -1,20 +1,87 @@
 import sqlite3
-from dataclasses import dataclass
-from typing import List
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, Tuple, Union
+
+from .dedup import create_signatures, get_clusters, index_post
+from .images import create_images, index_images
+from .text import fold
+
+
+def fold_sql(column: str) -> str:
+    return f"replace(replace({column}, 'ё', 'е'), 'Ё', 'Е')"
 
 
 @dataclass
 class Post:
     source_id: str
     link: str
-    timestamp: int
+    timestamp: int  # UTC unix time
     heading: str
     text: str
+    # rendered at ingest time, see source_renderer.IngestRenderer
+    post_id: str = ""
+    summary: str = ""
+    html: str = ""
+
+
+POST_COLUMNS = ("source_id", "link", "timestamp", "heading", "text", "post_id", "summary", "html")
+
+
+# SQLite's default SQLITE_MAX_COMPOUND_SELECT, per source queries are split into compound selects of this size
+MAX_COMPOUND_SELECT = 500
+
+
+def chunks(items: List[str], size: int) -> Iterator[List[str]]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def post_columns(table: str = "") -> str:
+    prefix = f"{table}." if table else ""
+    return ", ".join(prefix + c for c in POST_COLUMNS)
+
+
+@dataclass
+class AddStats:
+    inserted: int = 0
+    updated: int = 0
+    skipped: int = 0
+    # posts inserted by this call, for WriteBehindQueue listeners; not accumulated by +=
+    new_posts: List[Post] = field(default_factory=list, repr=False, compare=False)
+
+    def __iadd__(self, other: "AddStats") -> "AddStats":
+        self.inserted += other.inserted
+        self.updated += other.updated
+        self.skipped += other.skipped
+        return self
+
+
+@dataclass
+class SourceState:
+    source_id: str
+    etag: str = ""
+    last_modified: str = ""
+    last_message_id: int = 0
+    content_hash: str = ""
 
 
 class PostsDb:
-    def __init__(self, filename: str = "data/production.sqlite") -> None:
-        self.conn = sqlite3.connect(filename)
+    def __init__(
+        self, filename: str = "data/production.sqlite", readonly: bool = False, check_same_thread: bool = True
+    ) -> None:
+        if readonly:
+            # schema is created by a writer connection
+            uri = f"{Path(filename).absolute().as_uri()}?mode=ro"
+            self.conn = sqlite3.connect(uri, uri=True, timeout=10, check_same_thread=check_same_thread)
+            return
+
+        self.conn = sqlite3.connect(filename, timeout=10, check_same_thread=check_same_thread)
+        # takes effect for new databases only, existing ones are switched by retention.compact
+        self.conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        # WAL lets readers work concurrently with the single writer
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
 
         self.conn.execute(
             """
@@ -28,56 +95,464 @@ class PostsDb:
             );
             """
         )
+        self.migrate()
+        # (timestamp, link) is the keyset pagination order, it also serves newest-first selects
+        self.conn.execute("DROP INDEX IF EXISTS posts_source_timestamp")
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS posts_source_timestamp_link ON posts (source_id, timestamp DESC, link DESC)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS posts_seq ON posts (seq)")
+        self.create_fts()
+        create_signatures(self.conn)
+        create_images(self.conn)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sources_version (
+                source_id   TEXT PRIMARY KEY,
+                version     INT
+            );
+            """
+        )
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sources_state (
+                source_id       TEXT PRIMARY KEY,
+                etag            TEXT,
+                last_modified   TEXT,
+                last_message_id INT,
+                content_hash    TEXT
+            );
+            """
+        )
+        self.create_subscriptions()
 
-    def add(self, post: Post) -> None:
+    def migrate(self) -> None:
+        # rendered columns were added later, old rows get them from "main.py render"
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(posts)")}
+        for column in ("post_id", "summary", "html"):
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE posts ADD COLUMN {column} TEXT")
+        # change cursor for live updates, rows written before it was added are never pushed
+        if "seq" not in columns:
+            self.conn.execute("ALTER TABLE posts ADD COLUMN seq INT")
+        # the last given seq; max(seq) of posts goes back when retention archives the newest changes
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS last_seq (
+                id  INTEGER PRIMARY KEY CHECK (id = 0),
+                seq INT
+            );
+            """
+        )
+        self.conn.execute("INSERT OR IGNORE INTO last_seq (id, seq) SELECT 0, coalesce(max(seq), 0) FROM posts")
+        # keywords of the last complete render of all posts, see rerender.Rerenderer; unknown for older databases
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS rendered_keywords (
+                id          INTEGER PRIMARY KEY CHECK (id = 0),
+                keywords    TEXT
+            );
+            """
+        )
+        self.conn.commit()
+
+    def create_subscriptions(self) -> None:
+        # keyword alerts of Telegram chats, the version is bumped by triggers so the alerter reloads only on changes
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS subscriptions (
+                chat_id INT,
+                keyword TEXT,
+                PRIMARY KEY (chat_id, keyword)
+            );
+
+            CREATE TABLE IF NOT EXISTS subscriptions_version (
+                id      INTEGER PRIMARY KEY CHECK (id = 0),
+                version INT
+            );
+            INSERT OR IGNORE INTO subscriptions_version (id, version) VALUES (0, 0);
+
+            CREATE TRIGGER IF NOT EXISTS subscriptions_insert AFTER INSERT ON subscriptions BEGIN
+                UPDATE subscriptions_version SET version = version + 1;
+            END;
+            CREATE TRIGGER IF NOT EXISTS subscriptions_delete AFTER DELETE ON subscriptions BEGIN
+                UPDATE subscriptions_version SET version = version + 1;
+            END;
+            """
+        )
+
+    def create_fts(self) -> None:
+        # external content FTS5 index over posts kept in sync by triggers;
+        # unicode61 folds case for Cyrillic and Latin, "ё" is folded to "е" explicitly
+        fts_exists = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'posts_fts'"
+        ).fetchone()
+
+        self.conn.executescript(
+            f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(
+                heading, text,
+                content='posts', content_rowid='rowid',
+                tokenize='unicode61 remove_diacritics 2'
+            );
+
+            CREATE TRIGGER IF NOT EXISTS posts_fts_insert AFTER INSERT ON posts BEGIN
+                INSERT INTO posts_fts (rowid, heading, text)
+                VALUES (new.rowid, {fold_sql("new.heading")}, {fold_sql("new.text")});
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS posts_fts_delete AFTER DELETE ON posts BEGIN
+                INSERT INTO posts_fts (posts_fts, rowid, heading, text)
+                VALUES ('delete', old.rowid, {fold_sql("old.heading")}, {fold_sql("old.text")});
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS posts_fts_update AFTER UPDATE OF heading, text ON posts BEGIN
+                INSERT INTO posts_fts (posts_fts, rowid, heading, text)
+                VALUES ('delete', old.rowid, {fold_sql("old.heading")}, {fold_sql("old.text")});
+                INSERT INTO posts_fts (rowid, heading, text)
+                VALUES (new.rowid, {fold_sql("new.heading")}, {fold_sql("new.text")});
+            END;
+            """
+        )
+
+        if not fts_exists:
+            self.conn.execute(
+                f"""
+                INSERT INTO posts_fts (rowid, heading, text)
+                SELECT rowid, {fold_sql("heading")}, {fold_sql("text")} FROM posts
+                """
+            )
+            self.conn.commit()
+
+    @staticmethod
+    def to_post(row: Tuple) -> Post:
+        source_id, link, timestamp, heading, text, post_id, summary, html = row
+        return Post(source_id, link, int(timestamp), heading, text, post_id or "", summary or "", html or "")
+
+    @staticmethod
+    def fts_query(query: str) -> str:
+        # every word is quoted to escape FTS5 syntax and matched as a prefix
+        words = [w.replace('"', '""') for w in fold(query).split()]
+        return " ".join(f'"{w}"*' for w in words)
+
+    def get_last_seq(self) -> int:
+        return self.conn.execute("SELECT seq FROM last_seq").fetchone()[0]
+
+    def get_clusters(self, links: List[str]) -> Dict[str, str]:
+        return get_clusters(self.conn, links)
+
+    def get_versions(self) -> Dict[str, int]:
+        return dict(self.conn.execute("SELECT source_id, version FROM sources_version").fetchall())
+
+    def get_state(self, source_id: str) -> SourceState:
         cursor = self.conn.cursor()
         cursor.execute(
             """
-            INSERT OR REPLACE INTO posts (source_id, link, timestamp, heading, text)
+            SELECT etag, last_modified, last_message_id, content_hash
+            FROM sources_state
+            WHERE source_id = ?
+            """,
+            (source_id,),
+        )
+
+        if row := cursor.fetchone():
+            etag, last_modified, last_message_id, content_hash = row
+            return SourceState(source_id, etag, last_modified, int(last_message_id), content_hash)
+
+        return SourceState(source_id)
+
+    def save_state(self, state: SourceState) -> None:
+        self.conn.execute(
+            """
+            INSERT OR REPLACE INTO sources_state (source_id, etag, last_modified, last_message_id, content_hash)
             VALUES (?, ?, ?, ?, ?)
             """,
-            (post.source_id, post.link, post.timestamp, post.heading, post.text),
+            (state.source_id, state.etag, state.last_modified, state.last_message_id, state.content_hash),
         )
         self.conn.commit()
 
+    def add(self, post: Post) -> None:
+        self.add_many([post])
+
+    def add_many(self, posts: List[Post]) -> AddStats:
+        stats = AddStats()
+        changed_sources: Set[str] = set()
+
+        with self.conn:
+            cursor = self.conn.cursor()
+            # single writer, so the cursor can simply continue from the newest change
+            seq = self.get_last_seq()
+            for post in posts:
+                cursor.execute(
+                    "SELECT timestamp, heading, text, summary, html FROM posts WHERE source_id = ? AND link = ?",
+                    (post.source_id, post.link),
+                )
+                row = cursor.fetchone()
+
+                if row is None:
+                    seq += 1
+                    cursor.execute(
+                        f"""
+                        INSERT INTO posts ({post_columns()}, seq)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        """,
+                        (
+                            post.source_id, post.link, post.timestamp, post.heading, post.text,
+                            post.post_id, post.summary, post.html, seq,
+                        ),
+                    )
+                    index_post(cursor, post.source_id, post.link, post.timestamp, post.text)
+                    index_images(cursor, post.text)
+                    stats.inserted += 1
+                    stats.new_posts.append(post)
+                    changed_sources.add(post.source_id)
+                elif tuple(row) == (post.timestamp, post.heading, post.text, post.summary, post.html):
+                    stats.skipped += 1
+                else:
+                    seq += 1
+                    cursor.execute(
+                        """
+                        UPDATE posts SET timestamp = ?, heading = ?, text = ?, post_id = ?, summary = ?, html = ?, seq = ?
+                        WHERE source_id = ? AND link = ?
+                        """,
+                        (
+                            post.timestamp, post.heading, post.text, post.post_id, post.summary, post.html, seq,
+                            post.source_id, post.link,
+                        ),
+                    )
+                    index_post(cursor, post.source_id, post.link, post.timestamp, post.text)
+                    index_images(cursor, post.text)
+                    stats.updated += 1
+                    changed_sources.add(post.source_id)
+
+            cursor.execute("UPDATE last_seq SET seq = ?", (seq,))
+            self.bump_versions(changed_sources)
+
+        return stats
+
+    def subscribe(self, chat_id: int, keyword: str, max_keywords: int) -> bool:
+        # False when the chat already has max_keywords subscriptions
+        with self.conn:
+            count = self.conn.execute("SELECT count(*) FROM subscriptions WHERE chat_id = ?", (chat_id,)).fetchone()[0]
+            if count >= max_keywords:
+                return False
+            self.conn.execute("INSERT OR IGNORE INTO subscriptions (chat_id, keyword) VALUES (?, ?)", (chat_id, keyword))
+        return True
+
+    def unsubscribe(self, chat_id: int, keyword: str) -> bool:
+        with self.conn:
+            cursor = self.conn.execute("DELETE FROM subscriptions WHERE chat_id = ? AND keyword = ?", (chat_id, keyword))
+        return cursor.rowcount > 0
+
+    def get_chat_subscriptions(self, chat_id: int) -> List[str]:
+        cursor = self.conn.execute("SELECT keyword FROM subscriptions WHERE chat_id = ? ORDER BY keyword", (chat_id,))
+        return [row[0] for row in cursor]
+
+    def get_subscriptions_version(self) -> int:
+        return self.conn.execute("SELECT version FROM subscriptions_version").fetchone()[0]
+
+    def get_subscriptions(self) -> Tuple[int, List[Tuple[int, str]]]:
+        # version and (chat id, keyword) pairs; the version is read first, so a concurrent change only
+        # causes one more reload
+        version = self.get_subscriptions_version()
+        return version, self.conn.execute("SELECT chat_id, keyword FROM subscriptions").fetchall()
+
+    def get_image(self, key: str) -> Optional[Tuple[str, Optional[str]]]:
+        # url and digest of the cached content
+        return self.conn.execute("SELECT url, digest FROM images WHERE key = ?", (key,)).fetchone()
+
+    def set_image_digest(self, key: str, digest: str) -> None:
+        with self.conn:
+            self.conn.execute("UPDATE images SET digest = ? WHERE key = ?", (digest, key))
+
+    def bump_versions(self, source_ids: Set[str]) -> None:
+        if source_ids:
+            self.conn.executemany(
+                """
+                INSERT INTO sources_version (source_id, version) VALUES (?, 1)
+                ON CONFLICT (source_id) DO UPDATE SET version = version + 1
+                """,
+                [(source_id,) for source_id in source_ids],
+            )
+
+    def select_after(self, last_rowid: int, batch_size: int, unrendered_only: bool = False) -> List[Tuple[int, Post]]:
+        cursor = self.conn.execute(
+            f"""
+            SELECT rowid, {post_columns()}
+            FROM posts
+            WHERE rowid > ? {"AND post_id IS NULL" if unrendered_only else ""}
+            ORDER BY rowid
+            LIMIT ?
+            """,
+            (last_rowid, batch_size),
+        )
+        return [(row[0], self.to_post(row[1:])) for row in cursor.fetchall()]
+
+    def iter_posts(self, unrendered_only: bool = False, batch_size: int = 1000) -> Iterator[List[Post]]:
+        last_rowid = 0
+        while rows := self.select_after(last_rowid, batch_size, unrendered_only):
+            last_rowid = rows[-1][0]
+            yield [post for _, post in rows]
+
+    def get_rendered_keywords(self) -> Optional[str]:
+        row = self.conn.execute("SELECT keywords FROM rendered_keywords").fetchone()
+        return row[0] if row else None
+
+    def set_rendered_keywords(self, keywords: str) -> None:
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO rendered_keywords (id, keywords) VALUES (0, ?)", (keywords,))
+
+    def save_rendered(self, posts: List[Post]) -> None:
+        with self.conn:
+            cursor = self.conn.cursor()
+            cursor.executemany(
+                "UPDATE posts SET post_id = ?, summary = ?, html = ? WHERE source_id = ? AND link = ?",
+                [(p.post_id, p.summary, p.html, p.source_id, p.link) for p in posts],
+            )
+            # rendered html links images by their keys
+            for post in posts:
+                index_images(cursor, post.text)
+            self.bump_versions({p.source_id for p in posts})
+
+    def select_since(
+        self, seq: int, source_ids: Optional[List[str]] = None, limit: int = 100
+    ) -> List[Tuple[int, Post]]:
+        # posts inserted or updated after the `seq` cursor, oldest change first
+        source_filter = ""
+        params: List[Union[str, int]] = [seq]
+        if source_ids is not None:
+            source_filter = f"AND source_id IN ({', '.join('?' * len(source_ids))})"
+            params.extend(source_ids)
+        params.append(limit)
+
+        cursor = self.conn.cursor()
+        cursor.execute(
+            f"""
+            SELECT seq, {post_columns()}
+            FROM posts
+            WHERE seq > ? {source_filter}
+            ORDER BY seq
+            LIMIT ?
+            """,
+            params,
+        )
+
+        return [(row[0], self.to_post(row[1:])) for row in cursor.fetchall()]
+
     def select(self, source_ids: List[str], limit: int = 10) -> List[Post]:
         cursor = self.conn.cursor()
         cursor.execute(
-            """
-            SELECT source_id, link, timestamp, heading, text
+            f"""
+            SELECT {post_columns()}
             FROM posts
-            WHERE source_id IN (?)
+            WHERE source_id IN ({", ".join("?" * len(source_ids))})
             ORDER BY timestamp DESC
             LIMIT ?
             """,
-            (", ".join(source_ids), limit),
+            (*source_ids, limit),
         )
 
-        result = []
-        for row in cursor.fetchmany(limit):
-            source_id, link, timestamp, heading, text = row
-            timestamp = int(timestamp)
-            result.append(Post(source_id, link, timestamp, heading, text))
+        return [self.to_post(row) for row in cursor.fetchmany(limit)]
+
+    def select_top(self, source_ids: List[str], limit: int = 10) -> Dict[str, List[Post]]:
+        # newest `limit` posts of every source in one query, each subquery walks posts_source_timestamp_link index
+        result: Dict[str, List[Post]] = {source_id: [] for source_id in source_ids}
+        if not source_ids:
+            return result
+
+        subquery = f"""
+            SELECT * FROM (
+                SELECT {post_columns()}
+                FROM posts
+                WHERE source_id = ?
+                ORDER BY timestamp DESC
+                LIMIT ?
+            )
+        """
+        cursor = self.conn.cursor()
+        for chunk in chunks(source_ids, MAX_COMPOUND_SELECT):
+            params: List[Union[str, int]] = []
+            for source_id in chunk:
+                params.extend((source_id, limit))
+
+            cursor.execute(" UNION ALL ".join([subquery] * len(chunk)), params)
+            for row in cursor.fetchall():
+                post = self.to_post(row)
+                result[post.source_id].append(post)
 
         return result
 
+    def select_page(
+        self, source_ids: List[str], limit: int = 20, before: Optional[Tuple[int, str]] = None
+    ) -> List[Post]:
+        # posts ordered by (timestamp, link) descending, strictly after the `before` cursor;
+        # every source subquery starts with an index seek, so deep pages cost the same as the first one
+        if not source_ids:
+            return []
+
+        keyset = "AND (timestamp, link) < (?, ?)" if before else ""
+        subquery = f"""
+            SELECT * FROM (
+                SELECT {post_columns()}
+                FROM posts
+                WHERE source_id = ? {keyset}
+                ORDER BY timestamp DESC, link DESC
+                LIMIT ?
+            )
+        """
+        # every group of sources gives its own first `limit` posts, the page is the first `limit` of them all
+        cursor = self.conn.cursor()
+        posts: List[Post] = []
+        for chunk in chunks(source_ids, MAX_COMPOUND_SELECT):
+            params: List[Union[str, int]] = []
+            for source_id in chunk:
+                params.extend((source_id, *(before or ()), limit))
+
+            cursor.execute(
+                " UNION ALL ".join([subquery] * len(chunk)) + " ORDER BY timestamp DESC, link DESC LIMIT ?",
+                (*params, limit),
+            )
+            posts.extend(self.to_post(row) for row in cursor.fetchall())
+
+        if len(source_ids) > MAX_COMPOUND_SELECT:
+            posts.sort(key=lambda p: (p.timestamp, p.link), reverse=True)
+        return posts[:limit]
+
     def select_keyword(self, word: str, limit: int = 100) -> List[Post]:
+        if not (match := self.fts_query(word)):
+            return []
+
         cursor = self.conn.cursor()
         cursor.execute(
-            """
-            SELECT source_id, link, timestamp, heading, text
-            FROM posts
-            WHERE (?) IN text COLLATE NOCASE
-            ORDER BY timestamp DESC
+            f"""
+            SELECT {post_columns("posts")}
+            FROM posts_fts
+            JOIN posts ON posts.rowid = posts_fts.rowid
+            WHERE posts_fts MATCH ?
+            ORDER BY posts.timestamp DESC
             LIMIT ?
             """,
-            (word, limit),
+            (match, limit),
         )
 
-        result = []
-        for row in cursor.fetchmany(limit):
-            source_id, link, timestamp, heading, text = row
-            timestamp = int(timestamp)
-            result.append(Post(source_id, link, timestamp, heading, text))
+        return [self.to_post(row) for row in cursor.fetchmany(limit)]
 
-        return result
+    def search(self, query: str, source_ids: List[str], limit: int = 20, offset: int = 0) -> List[Post]:
+        # best bm25 matches first, heading matches weigh more than text ones
+        if not (match := self.fts_query(query)) or not source_ids:
+            return []
+
+        cursor = self.conn.cursor()
+        cursor.execute(
+            f"""
+            SELECT {post_columns("posts")}
+            FROM posts_fts
+            JOIN posts ON posts.rowid = posts_fts.rowid
+            WHERE posts_fts MATCH ? AND posts.source_id IN ({", ".join("?" * len(source_ids))})
+            ORDER BY bm25(posts_fts, 2.0, 1.0)
+            LIMIT ? OFFSET ?
+            """,
+            (match, *source_ids, limit, offset),
+        )
+
+        return [self.to_post(row) for row in cursor.fetchall()]
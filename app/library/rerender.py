@@ -0,0 +1,65 @@
+import asyncio
+import json
+import logging
+from typing import Callable, List, Optional
+
+from .async_db import AsyncPostsDb
+from .config import Config
+from .posts_db import Post, PostsDb
+
+logger = logging.getLogger("infoscape")
+
+
+def keywords_key(keywords: List[str]) -> str:
+    # highlighting doesn't depend on the order or repeats of keywords
+    return json.dumps(sorted({k for k in keywords if k}), ensure_ascii=False)
+
+
+def render_after(db: PostsDb, render_post: Callable[[Post], Post], last_rowid: int, batch_size: int) -> int:
+    # renders the next batch of posts, returns the rowid to continue after, 0 when all posts are done
+    if not (rows := db.select_after(last_rowid, batch_size)):
+        return 0
+    db.save_rendered([render_post(post) for _, post in rows])
+    return rows[-1][0]
+
+
+class Rerenderer:
+    # Stored posts keep the highlighting of the keywords they were rendered with. The fetcher renders them again
+    # when the keywords differ from the last complete render: on start, e.g. after the config was edited while
+    # stopped, and on config reloads. Every batch is a separate write, so ingest goes on meanwhile
+    def __init__(self, db: AsyncPostsDb, batch_size: int = 500) -> None:
+        self.db = db
+        self.batch_size = batch_size
+        self.keywords = ""
+        self.task: Optional[asyncio.Task] = None
+
+    def update(self, config: Config) -> None:
+        # ConfigManager listener; a newer config restarts the render
+        if (keywords := keywords_key(config.keywords)) == self.keywords:
+            return
+
+        self.keywords = keywords
+        if self.task is not None:
+            self.task.cancel()
+        self.task = asyncio.create_task(self.run(config, keywords))
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def run(self, config: Config, keywords: str) -> None:
+        try:
+            if await self.db.read(PostsDb.get_rendered_keywords) == keywords:
+                return
+
+            logger.info(f"keywords changed, rendering stored posts with {len(config.keywords)} keywords")
+            last_rowid = 0
+            while True:
+                if not (last_rowid := await self.db.write(render_after, config.ingest_renderer, last_rowid, self.batch_size)):
+                    break
+            await self.db.write(PostsDb.set_rendered_keywords, keywords)
+            logger.info("rendered stored posts")
+        except Exception:
+            logger.exception("Error while rendering stored posts")
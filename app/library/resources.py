@@ -0,0 +1,47 @@
+from .async_db import AsyncPostsDb
+from .config import Config
+from .http_client import HttpClient
+from .image_proxy import ImageProxy
+from .images import ImageCache
+from .live_updates import LiveUpdates
+from .page_cache import PageCache
+from .tg_bot import TgBot
+
+
+class Resources:
+    # Everything that owns threads, connections or sessions. Created empty on import and opened once per process:
+    # in every server worker by the app lifespan, after the worker is spawned, or by main() for command line modes
+    adb: AsyncPostsDb
+    page_cache: PageCache
+    http_client: HttpClient
+    live_updates: LiveUpdates
+    tg_bot: TgBot
+    image_proxy: ImageProxy
+
+    def __init__(
+        self,
+        filename: str = "data/production.sqlite",
+        archive: str = "data/archive.sqlite",
+        images: str = "data/images",
+    ) -> None:
+        self.filename = filename
+        self.archive = archive
+        self.images = images
+
+    def open(self, config: Config) -> None:
+        self.adb = AsyncPostsDb(self.filename, archive=self.archive)
+        self.page_cache = PageCache(self.adb)
+        self.http_client = HttpClient()
+        self.live_updates = LiveUpdates(self.adb, config.keyword_matcher)
+        self.tg_bot = TgBot(site_host=config.hostname, client=self.http_client, db=self.adb)
+        # the cache size is taken once per process, config reloads don't change it
+        cache = ImageCache(self.images, max_bytes=config.image_cache_mb << 20)
+        self.image_proxy = ImageProxy(self.adb, self.http_client, cache)
+
+    async def close(self) -> None:
+        await self.live_updates.stop()
+        await self.page_cache.stop()
+        await self.tg_bot.close()
+        await self.image_proxy.stop()
+        await self.http_client.close()
+        self.adb.close()
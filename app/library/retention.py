@@ -0,0 +1,82 @@
+import logging
+import time
+from dataclasses import dataclass
+from typing import List
+
+from .archive import archive_posts
+from .async_db import AsyncPostsDb
+from .config import Config, RetentionConfig, SourceConfig
+from .metrics import metrics
+from .posts_db import PostsDb
+
+logger = logging.getLogger("infoscape")
+
+ARCHIVED_POSTS = metrics.counter("infoscape_retention_archived_posts_total", "Posts moved to the archive", ("source",))
+RECLAIMED_BYTES = metrics.counter("infoscape_retention_reclaimed_bytes_total", "Bytes reclaimed by retention compaction")
+
+
+@dataclass
+class RetentionStats:
+    archived: int = 0
+    reclaimed: int = 0  # bytes
+
+
+def database_size(db: PostsDb, schema: str = "main") -> int:
+    page_count = db.conn.execute(f"PRAGMA {schema}.page_count").fetchone()[0]
+    page_size = db.conn.execute(f"PRAGMA {schema}.page_size").fetchone()[0]
+    return page_count * page_size
+
+
+def compact(db: PostsDb, pages: int = 0) -> int:
+    # returns number of reclaimed bytes in all attached databases
+    reclaimed = 0
+    for _, schema, _ in db.conn.execute("PRAGMA database_list").fetchall():
+        before = database_size(db, schema)
+
+        if db.conn.execute(f"PRAGMA {schema}.auto_vacuum").fetchone()[0] != 2:
+            # databases created before retention: switch to incremental mode once with the full vacuum
+            logger.info(f"switching {schema} database to incremental auto vacuum")
+            db.conn.execute(f"PRAGMA {schema}.auto_vacuum = INCREMENTAL")
+            db.conn.execute(f"VACUUM {schema}")
+        else:
+            pragma = f"PRAGMA {schema}.incremental_vacuum"
+            db.conn.execute(f"{pragma}({pages})" if pages else pragma).fetchall()
+
+        reclaimed += before - database_size(db, schema)
+
+    db.conn.execute("PRAGMA analysis_limit = 1000")
+    db.conn.execute("ANALYZE")
+    db.conn.commit()
+    return reclaimed
+
+
+class Retention:
+    def __init__(self, config: Config, compact_pages: int = 0) -> None:
+        self.config = config
+        self.compact_pages = compact_pages
+
+    def get_policy(self, source: SourceConfig) -> RetentionConfig:
+        return source.retention or self.config.retention
+
+    async def run(self, adb: AsyncPostsDb, sources: List[SourceConfig]) -> RetentionStats:
+        start = time.monotonic()
+        stats = RetentionStats()
+
+        for source in sources:
+            policy = self.get_policy(source)
+            if not policy.enabled:
+                continue
+
+            min_timestamp = int(time.time()) - policy.max_age_days * 86400 if policy.max_age_days else 0
+            archived = await adb.write(archive_posts, source.id, min_timestamp, policy.max_rows)
+            ARCHIVED_POSTS.inc(archived, source=source.id)
+            stats.archived += archived
+
+        stats.reclaimed = await adb.write(compact, self.compact_pages)
+        RECLAIMED_BYTES.inc(stats.reclaimed)
+
+        logger.info(
+            f"retention: archived {stats.archived} posts, reclaimed {stats.reclaimed / 2 ** 20:.1f} MiB "
+            f"in {time.monotonic() - start:.2f}s"
+        )
+        return stats
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List
+from urllib.parse import urlparse
+
+from .config import SourceConfig
+from .metrics import metrics
+
+logger = logging.getLogger("infoscape")
+
+FETCH_SECONDS = metrics.histogram("infoscape_fetch_seconds", "Source fetch duration including retries", ("source",))
+FETCHES = metrics.counter("infoscape_fetches_total", "Source fetches by result", ("source", "result"))
+
+
+@dataclass
+class FetchResult:
+    source_id: str
+    duration: float
+    attempts: int
+    ok: bool
+
+
+class HostRateLimiter:
+    def __init__(self, min_interval: float) -> None:
+        self.min_interval = min_interval
+        self.next_slot: Dict[str, float] = {}
+
+    async def wait(self, host: str) -> None:
+        # reserve the next free slot for the host before sleeping, so concurrent callers queue up
+        now = time.monotonic()
+        slot = max(now, self.next_slot.get(host, now))
+        self.next_slot[host] = slot + self.min_interval
+
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class FetchScheduler:
+    def __init__(
+        self,
+        fetch_source: Callable[[SourceConfig], Awaitable[None]],
+        workers: int = 8,
+        host_interval: float = 0.2,
+        timeout: float = 30,
+        retries: int = 2,
+        backoff: float = 1.0,
+    ) -> None:
+        self.fetch_source = fetch_source
+        self.semaphore = asyncio.Semaphore(workers)
+        self.rate_limiter = HostRateLimiter(host_interval)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+
+    def get_delay(self, attempt: int) -> float:
+        delay = self.backoff * 2 ** (attempt - 1)
+        return delay * random.uniform(0.5, 1.5)
+
+    async def fetch(self, source: SourceConfig) -> FetchResult:
+        host = urlparse(source.link).netloc
+
+        async with self.semaphore:
+            start = time.monotonic()
+            attempt = 0
+            while True:
+                attempt += 1
+                await self.rate_limiter.wait(host)
+                try:
+                    await asyncio.wait_for(self.fetch_source(source), self.timeout)
+                    ok = True
+                    break
+                except Exception:
+                    if attempt > self.retries:
+                        logger.exception(f"Error while fetching source {source.id}")
+                        ok = False
+                        break
+
+                    delay = self.get_delay(attempt)
+                    logger.warning(f"fetching {source.id} failed (attempt {attempt}), retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+
+            duration = time.monotonic() - start
+
+        FETCH_SECONDS.observe(duration, source=source.id)
+        FETCHES.inc(source=source.id, result="ok" if ok else "error")
+        logger.info(f"fetched {source.id} in {duration:.2f}s, attempts: {attempt}, ok: {ok}")
+        return FetchResult(source.id, duration, attempt, ok)
+
+    async def run_cycle(self, sources: List[SourceConfig]) -> List[FetchResult]:
+        start = time.monotonic()
+        results = await asyncio.gather(*(self.fetch(s) for s in sources))
+        duration = time.monotonic() - start
+
+        ok = sum(r.ok for r in results)
+        serial = sum(r.duration for r in results)
+        logger.info(
+            f"fetch cycle: {ok}/{len(results)} sources in {duration:.2f}s "
+            f"(sum of source durations {serial:.2f}s)"
+        )
+        return list(results)
@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from .metrics import metrics
+
+logger = logging.getLogger("infoscape")
+
+MAX_MESSAGE_SIZE = 4096  # Telegram limit in characters
+
+MESSAGES = metrics.counter("infoscape_telegram_messages_total", "Queued Telegram messages by result", ("result",))
+
+
+class SendException(Exception):
+    # retry_after: the chat is rate limited for that many seconds; permanent: e.g. the bot was blocked, don't retry
+    def __init__(self, message: str, retry_after: float = 0, permanent: bool = False) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.permanent = permanent
+
+
+class SendQueue:
+    # Messages are queued per chat and sent in the background: a chat gets at most one message per chat_interval,
+    # joining everything queued for it meanwhile, and all chats together stay under global_rate messages per second.
+    #
+    #   queue = SendQueue(bot.send_message)
+    #   queue.put(chat_id, text)  # never blocks
+    def __init__(
+        self,
+        send: Callable[[int, str], Awaitable[None]],
+        global_rate: float = 25,
+        chat_interval: float = 1.0,
+        concurrency: int = 4,
+        max_retries: int = 3,
+        max_pending: int = 10000,
+    ) -> None:
+        self.send = send
+        self.global_rate = global_rate
+        self.chat_interval = chat_interval
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.max_pending = max_pending
+
+        self.pending: "OrderedDict[int, List[str]]" = OrderedDict()  # chat id -> texts, oldest chat first
+        self.size = 0
+        self.sending: Set[int] = set()
+        self.not_before: Dict[int, float] = {}  # chat id -> monotonic time of its next allowed message
+        self.failures: Dict[int, int] = {}
+        self.global_not_before = 0.0
+
+        self.task: Optional[asyncio.Task] = None
+        self.changed: Optional[asyncio.Event] = None
+        self.slots: Optional[asyncio.Semaphore] = None
+        self.deliveries: Set[asyncio.Task] = set()
+
+    def put(self, chat_id: int, text: str) -> bool:
+        if self.size >= self.max_pending:
+            logger.warning(f"send queue is full, dropping a message to {chat_id}")
+            MESSAGES.inc(result="dropped")
+            return False
+
+        self.pending.setdefault(chat_id, []).append(text[:MAX_MESSAGE_SIZE])
+        self.size += 1
+        self.start()
+        assert self.changed is not None
+        self.changed.set()
+        return True
+
+    def start(self) -> None:
+        # lazily, inside the running loop
+        if self.task is None:
+            self.changed = asyncio.Event()
+            self.slots = asyncio.Semaphore(self.concurrency)
+            self.task = asyncio.create_task(self.run())
+
+    async def close(self, timeout: float = 5) -> None:
+        # gives queued messages a chance to go out, the rest is lost
+        if self.task is None:
+            return
+
+        deadline = time.monotonic() + timeout
+        while (self.size or self.sending) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self.size:
+            logger.warning(f"{self.size} messages were not sent before shutdown")
+
+        for task in [self.task, *self.deliveries]:
+            task.cancel()
+        await asyncio.gather(self.task, *self.deliveries, return_exceptions=True)
+        self.task = None
+
+    def next_chat(self, now: float) -> Tuple[Optional[int], Optional[float]]:
+        # the oldest chat that may get a message now, otherwise the time to wait for one
+        wait = None
+        for chat_id in self.pending:
+            if chat_id in self.sending:
+                continue
+            not_before = self.not_before.get(chat_id, 0)
+            if not_before <= now:
+                return chat_id, None
+            wait = not_before - now if wait is None else min(wait, not_before - now)
+        return None, wait
+
+    def take(self, chat_id: int) -> List[str]:
+        texts = self.pending.pop(chat_id)
+        size = len(texts[0])
+        count = 1
+        while count < len(texts) and size + 2 + len(texts[count]) <= MAX_MESSAGE_SIZE:
+            size += 2 + len(texts[count])
+            count += 1
+
+        if count < len(texts):
+            self.pending[chat_id] = texts[count:]
+        self.size -= count
+        return texts[:count]
+
+    async def run(self) -> None:
+        assert self.changed is not None and self.slots is not None
+        while True:
+            now = time.monotonic()
+            if self.global_not_before > now:
+                await asyncio.sleep(self.global_not_before - now)
+                continue
+
+            chat_id, wait = self.next_chat(now)
+            if chat_id is None:
+                self.changed.clear()
+                try:
+                    await asyncio.wait_for(self.changed.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self.slots.acquire()
+            self.global_not_before = time.monotonic() + 1 / self.global_rate
+            self.sending.add(chat_id)
+            task = asyncio.create_task(self.deliver(chat_id, self.take(chat_id)))
+            self.deliveries.add(task)
+            task.add_done_callback(self.deliveries.discard)
+
+    async def deliver(self, chat_id: int, texts: List[str]) -> None:
+        assert self.changed is not None and self.slots is not None
+        delay = self.chat_interval
+        try:
+            await self.send(chat_id, "\n\n".join(texts))
+            self.failures.pop(chat_id, None)
+            MESSAGES.inc(len(texts), result="sent")
+        except SendException as e:
+            if e.permanent:
+                logger.warning(f"dropping {len(texts)} messages to {chat_id}: {e}")
+                MESSAGES.inc(len(texts), result="dropped")
+            elif e.retry_after:
+                # rate limited, doesn't count as a failure
+                delay = max(delay, e.retry_after)
+                self.requeue(chat_id, texts)
+            else:
+                delay = self.retry(chat_id, texts, e)
+        except Exception as e:
+            delay = self.retry(chat_id, texts, e)
+        finally:
+            self.sending.discard(chat_id)
+            self.not_before[chat_id] = time.monotonic() + delay
+            if len(self.not_before) > self.max_pending:
+                now = time.monotonic()
+                self.not_before = {c: t for c, t in self.not_before.items() if t > now}
+            self.slots.release()
+            self.changed.set()
+
+    def requeue(self, chat_id: int, texts: List[str]) -> None:
+        self.pending[chat_id] = texts + self.pending.get(chat_id, [])
+        self.pending.move_to_end(chat_id, last=False)
+        self.size += len(texts)
+
+    def retry(self, chat_id: int, texts: List[str], error: Exception) -> float:
+        # returns the backoff before the next attempt
+        failures = self.failures[chat_id] = self.failures.get(chat_id, 0) + 1
+        if failures > self.max_retries:
+            logger.error(f"dropping {len(texts)} messages to {chat_id} after {self.max_retries} retries: {error}")
+            MESSAGES.inc(len(texts), result="dropped")
+            self.failures.pop(chat_id)
+            return self.chat_interval
+
+        logger.warning(f"error while sending to {chat_id}, retrying: {error}")
+        MESSAGES.inc(len(texts), result="retried")
+        self.requeue(chat_id, texts)
+        return self.chat_interval * 2 ** failures
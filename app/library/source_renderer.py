@@ -1,30 +1,80 @@
+import hashlib
 import pytz
-import re
 
+from dataclasses import replace
 from datetime import datetime
-from typing import List
-from collections import namedtuple
+from typing import Dict, List, Optional, Set, Tuple
+from collections import defaultdict, namedtuple
 
 
+from .images import proxy_images
+from .keywords import KeywordMatcher
 from .posts_db import Post
 
 
-RenderedPost = namedtuple("RenderedPost", ["date", "is_fresh", "link", "summary", "html", "id"])
-RenderedSource = namedtuple("RenderedSource", ["heading", "link", "posts"])
+RenderedPost = namedtuple(
+    "RenderedPost", ["date", "is_fresh", "link", "summary", "html", "id", "timestamp", "also_in"], defaults=[()]
+)
+RenderedSource = namedtuple("RenderedSource", ["heading", "link", "posts", "more_link", "source_id"], defaults=["", ""])
+
+
+MSK = pytz.timezone("Europe/Moscow")
+
+
+# (source title, link) of the collapsed copies of a post
+AlsoIn = List[Tuple[str, str]]
+
+
+def get_post_id(link: str) -> str:
+    return hashlib.sha1(link.encode()).hexdigest()[:16]
+
+
+def collapse_duplicates(
+    posts: Dict[str, List[Post]], clusters: Dict[str, str], titles: Dict[str, str]
+) -> Tuple[Dict[str, List[Post]], Dict[str, AlsoIn]]:
+    # the first copy of a story stays in its widget, the rest are dropped from the page and linked from it
+    by_cluster: Dict[str, List[Post]] = defaultdict(list)
+    for source_posts in posts.values():
+        for post in source_posts:
+            by_cluster[clusters.get(post.link, post.link)].append(post)
+
+    dropped: Set[str] = set()
+    also_in: Dict[str, AlsoIn] = {}
+    for copies in by_cluster.values():
+        if len(copies) > 1:
+            first, *rest = sorted(copies, key=lambda p: (p.timestamp, p.link))
+            also_in[first.link] = [(titles.get(p.source_id, p.source_id), p.link) for p in rest]
+            dropped.update(p.link for p in rest)
+
+    collapsed = {source_id: [p for p in source_posts if p.link not in dropped] for source_id, source_posts in posts.items()}
+    return collapsed, also_in
+
+
+class IngestRenderer:
+    # Renders everything that doesn't depend on the request time, result is stored with the post
+    def __init__(self, keyword_matcher: KeywordMatcher) -> None:
+        self.keyword_matcher = keyword_matcher
+
+    def __call__(self, post: Post) -> Post:
+        return replace(
+            post,
+            post_id=get_post_id(post.link),
+            summary=self.keyword_matcher.highlight(post.heading),
+            html=proxy_images(self.keyword_matcher.highlight_html("<br>".join(post.text.splitlines()))),
+        )
 
 
 class PostRenderer:
-    def __init__(self, keywords: List[str]) -> None:
-        self.keywords = keywords
+    def __init__(self, keyword_matcher: KeywordMatcher) -> None:
+        self.ingest_renderer = IngestRenderer(keyword_matcher)
 
     @staticmethod
     def get_msk_date(timestamp: int) -> datetime:
         utc_dt = datetime.fromtimestamp(timestamp, pytz.utc)
-        msk = pytz.timezone("Europe/Moscow")
-        local_dt = utc_dt.astimezone(msk)
+        local_dt = utc_dt.astimezone(MSK)
         return local_dt
 
-    def __call__(self, post: Post) -> RenderedPost:
+    def __call__(self, post: Post, also_in: Optional[AlsoIn] = None) -> RenderedPost:
         local_dt = self.get_msk_date(post.timestamp)
         is_fresh = (local_dt.date() == datetime.today().date())
 
@@ -32,31 +82,40 @@ class PostRenderer:
         if is_fresh:
             date = local_dt.strftime("%H:%M")
 
-        heading = post.heading
-        text = post.text
-
-        for kw in self.keywords:
-            heading = re.sub(kw, f"<mark>{kw}</mark>", heading, flags=re.IGNORECASE)
-
-        html = "<br>".join(text.splitlines())
+        if not post.post_id:
+            # row is not rendered yet, e.g. before "main.py render" backfill
+            post = self.ingest_renderer(post)
 
         return RenderedPost(
             date=date,
             is_fresh=is_fresh,
             link=post.link,
-            summary=heading,
-            html=html,
-            id=hash(post.link),
+            summary=post.summary,
+            html=post.html,
+            id=post.post_id,
+            timestamp=post.timestamp,
+            also_in=also_in or [],
         )
 
 
 class SourceRenderer:
-    def __init__(self, keywords: List[str]) -> None:
-        self.post_renderer = PostRenderer(keywords)
-
-    def __call__(self, heading: str, link: str, posts: List[Post]) -> RenderedSource:
+    def __init__(self, keyword_matcher: KeywordMatcher) -> None:
+        self.post_renderer = PostRenderer(keyword_matcher)
+
+    def __call__(
+        self,
+        heading: str,
+        link: str,
+        posts: List[Post],
+        more_link: str = "",
+        source_id: str = "",
+        also_in: Optional[Dict[str, AlsoIn]] = None,
+    ) -> RenderedSource:
+        also_in = also_in or {}
         return RenderedSource(
             heading=heading,
             link=link,
-            posts=[self.post_renderer(p) for p in posts],
+            posts=[self.post_renderer(p, also_in.get(p.link)) for p in posts],
+            more_link=more_link,
+            source_id=source_id,
         )
@@ -0,0 +1,60 @@
+import asyncio
+import fcntl
+import logging
+import os
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger("infoscape")
+
+
+class WorkerLock:
+    # Non-blocking flock on a file: only one process holds it, and the kernel releases it when the holder dies
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+        self.fd: Optional[int] = None
+
+    def acquire(self) -> bool:
+        if self.fd is not None:
+            return True
+
+        fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+
+        self.fd = fd
+        return True
+
+    def release(self) -> None:
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
+
+
+async def supervise(
+    name: str,
+    run: Callable[[], Awaitable[None]],
+    lock: WorkerLock,
+    standby_interval: float = 30,
+    restart_delay: float = 10,
+) -> None:
+    # Runs the task in the process holding the lock and restarts it after crashes,
+    # other processes stay on standby and take over if the holder exits
+    while not lock.acquire():
+        await asyncio.sleep(standby_interval)
+
+    logger.info(f"{name} runs in process {os.getpid()}")
+    try:
+        while True:
+            try:
+                await run()
+                logger.info(f"{name} finished")
+                return
+            except Exception:
+                logger.exception(f"{name} crashed, restarting in {restart_delay} seconds")
+                await asyncio.sleep(restart_delay)
+    finally:
+        lock.release()
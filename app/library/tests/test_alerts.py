@@ -0,0 +1,110 @@
+import asyncio
+import os
+import threading
+import time
+from typing import List, Tuple
+
+from library import Alerts, AsyncPostsDb, HttpClient, Post, PostsDb, SendException, SendQueue, SubscriptionIndex, TgBot
+from library.alerts import normalize_keyword
+
+
+def test_index() -> None:
+    index = SubscriptionIndex([(1, "яндекс"), (2, "яндекс"), (2, "group ib"), (3, "ib")])
+
+    assert normalize_keyword(" Group-IB ") == "group ib"
+    assert index.match("Новости <b>Яндекса</b>") == {}
+    assert index.match("Ёлки, Яндекс и Group-IB") == {1: ["яндекс"], 2: ["яндекс", "group ib"], 3: ["ib"]}
+    assert index.match("group, and then ib") == {3: ["ib"]}
+
+
+def test_send_queue() -> None:
+    sent: List[Tuple[int, str, float]] = []
+    failures = {"rate": 1, "error": 1}
+
+    async def send(chat_id: int, text: str) -> None:
+        if chat_id == 2 and failures["rate"]:
+            failures["rate"] -= 1
+            raise SendException("Too Many Requests", retry_after=0.1)
+        if chat_id == 3 and failures["error"]:
+            failures["error"] -= 1
+            raise OSError("connection reset")
+        if chat_id == 4:
+            raise SendException("Forbidden: bot was blocked by the user", permanent=True)
+        sent.append((chat_id, text, time.monotonic()))
+
+    async def run() -> None:
+        queue = SendQueue(send, global_rate=100, chat_interval=0.1)
+        for chat_id, text in [(1, "a"), (1, "b"), (2, "c"), (3, "d"), (4, "e")]:
+            queue.put(chat_id, text)
+        await asyncio.sleep(0.05)
+        queue.put(1, "f")
+        await queue.close(timeout=1)
+
+        # messages queued for a chat are joined, rate limited and failed chats are retried, blocked ones dropped
+        assert sorted((c, t) for c, t, _ in sent) == [(1, "a\n\nb"), (1, "f"), (2, "c"), (3, "d")]
+        times = [t for c, _, t in sent if c == 1]
+        assert times[1] - times[0] >= 0.1
+
+    asyncio.run(run())
+
+
+def test_alerts(tmp_path: str) -> None:
+    sent: List[Tuple[int, str]] = []
+
+    async def send(chat_id: int, text: str) -> None:
+        sent.append((chat_id, text))
+
+    async def run() -> None:
+        adb = AsyncPostsDb(os.path.join(tmp_path, "posts.sqlite"))
+        queue = SendQueue(send)
+        alerts = Alerts(adb, queue)
+        now = int(time.time())
+
+        await adb.write(PostsDb.subscribe, 1, "яндекс", 10)
+        await alerts.notify([Post("a", "https://t.me/a/1", now, "Яндекс", "text")])
+        # subscriptions are reloaded on change, old posts are skipped
+        await adb.write(PostsDb.subscribe, 2, "text", 10)
+        await alerts.notify([
+            Post("a", "https://t.me/a/2", now, "Яндекс", "text"),
+            Post("a", "https://t.me/a/3", now - 2 * 24 * 3600, "Яндекс", "text"),
+        ])
+        await queue.close(timeout=3)
+        adb.close()
+
+        assert sorted(sent) == [
+            (1, "яндекс: Яндекс\nhttps://t.me/a/1"),
+            (1, "яндекс: Яндекс\nhttps://t.me/a/2"),
+            (2, "text: Яндекс\nhttps://t.me/a/2"),
+        ]
+
+    asyncio.run(run())
+
+
+def test_webhook_update_in_background(tmp_path: str) -> None:
+    sent: List[Tuple[int, str]] = []
+
+    async def send(chat_id: int, text: str) -> None:
+        sent.append((chat_id, text))
+
+    async def run() -> None:
+        adb = AsyncPostsDb(os.path.join(tmp_path, "posts.sqlite"))
+        bot = TgBot("example.com", HttpClient(), db=adb)
+        bot.queue = SendQueue(send)
+        released = threading.Event()
+        # a long write, e.g. an ingest batch or VACUUM, holds the writer
+        busy = asyncio.ensure_future(adb.write(lambda db: released.wait(5)))
+
+        bot.handle_update({
+            "update_id": 1,
+            "message": {"chat": {"id": 7}, "text": "/subscribe Яндекс", "entities": [{"type": "bot_command"}]},
+        })
+        await asyncio.sleep(0.1)
+        assert sent == [] and len(bot.tasks) == 1
+
+        released.set()
+        await busy
+        await bot.close()
+        adb.close()
+        assert sent == [(7, "Subscribed to «яндекс»")]
+
+    asyncio.run(run())
@@ -0,0 +1,37 @@
+import os
+
+from library.assets import Assets
+
+
+def test_build(tmp_path: str) -> None:
+    source_dir = os.path.join(tmp_path, "static")
+    os.makedirs(source_dir)
+    with open(os.path.join(source_dir, "app.js"), "w") as fout:
+        fout.write("console.log('infoscape');\n" * 50)
+    with open(os.path.join(source_dir, "app.css"), "w") as fout:
+        fout.write('@font-face { src: url("/static/logo.svg") format("svg"); }\nbody { background: url("/static/x.png"); }')
+    with open(os.path.join(source_dir, "logo.svg"), "w") as fout:
+        fout.write("<svg></svg>")
+
+    assets = Assets(source_dir)
+    assert assets.url("app.js") == "/static/app.js"
+
+    assets.build()
+    js = assets.manifest["app.js"]
+    assert js.startswith("app.") and js.endswith(".js") and assets.url("app.js") == f"/static/{js}"
+    assert {js, f"{js}.gz"} <= assets.files
+
+    # stylesheets link the built names, unknown files stay as they are
+    with open(os.path.join(assets.build_dir, assets.manifest["app.css"])) as fin:
+        assert fin.read() == (
+            f'@font-face {{ src: url("/static/{assets.manifest["logo.svg"]}") format("svg"); }}\n'
+            'body { background: url("/static/x.png"); }'
+        )
+
+    # changed files get new names, old ones are removed
+    with open(os.path.join(source_dir, "app.js"), "a") as fout:
+        fout.write("console.log('changed');\n")
+    assets.build()
+    assert assets.manifest["app.js"] != js
+    assert not os.path.exists(os.path.join(assets.build_dir, js))
+    assert not os.path.exists(os.path.join(assets.build_dir, f"{js}.gz"))
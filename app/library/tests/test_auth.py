@@ -0,0 +1,39 @@
+import jwt
+import time
+
+from library import Auth
+
+SECRET = "test-secret-that-is-long-enough-for-hs256"
+OTHER_SECRET = "other-secret-that-is-long-enough-for-hs256"
+
+
+def test_check_token_cache() -> None:
+    auth = Auth(SECRET, cache_size=2)
+    tokens = [auth.get_token(lifetime=60 + i) for i in range(3)]
+
+    assert all(auth.check_token(t) for t in tokens)
+    assert auth.check_token(tokens[2])
+    assert list(auth.cache) == tokens[1:]
+    assert (auth.stats["misses"], auth.stats["hits"]) == (3, 1)
+
+
+def test_check_token_expired_in_cache() -> None:
+    auth = Auth(SECRET)
+    token = jwt.encode({"valid-til": int(time.time()) + 60}, SECRET, algorithm="HS256")
+    assert auth.check_token(token)
+
+    auth.cache[token] = int(time.time()) - 1
+    assert not auth.check_token(token)
+    assert token not in auth.cache
+    assert auth.stats["expired"] == 1
+
+
+def test_invalid_token_logging_is_rate_limited() -> None:
+    auth = Auth(SECRET)
+    for _ in range(5):
+        assert not auth.check_token("garbage")
+    assert not auth.check_token(Auth(OTHER_SECRET).get_token())
+
+    assert auth.stats["invalid"] == 6
+    assert auth.suppressed == 5
+    assert not auth.cache
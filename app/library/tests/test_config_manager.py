@@ -0,0 +1,105 @@
+import asyncio
+import os
+from typing import List
+
+import pytest
+
+from library import AsyncPostsDb, Config, ConfigException, ConfigManager, Post, PostsDb, Rerenderer
+
+CONFIG = """
+title: infoscape
+hostname: localhost
+keywords: []
+sources:
+- title: B
+  id: b
+  parser: telegram
+  link: https://t.me/s/b
+  pages: [fast]
+- title: A
+  id: a
+  parser: telegram
+  link: https://t.me/s/a
+  hidden: true
+  pages: [fast]
+"""
+
+
+def write(filename: str, text: str) -> None:
+    with open(filename, "w") as fout:
+        fout.write(text)
+    # mtime granularity may hide quick rewrites
+    stat = os.stat(filename)
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+def test_views(tmp_path: str) -> None:
+    filename = os.path.join(tmp_path, "config.yaml")
+    write(filename, CONFIG)
+    config = Config.from_file_factory(filename)
+
+    assert [s.id for s in config.visible_sources("/", True)] == ["a", "b"]
+    assert [s.id for s in config.visible_sources("fast", False)] == ["b"]
+    assert config.sources_by_id["a"].hidden
+    with pytest.raises(KeyError):
+        config.visible_sources("slow", True)
+
+    write(filename, CONFIG.replace("id: a", "id: b"))
+    with pytest.raises(ConfigException):
+        Config.from_file_factory(filename)
+
+
+def test_reload(tmp_path: str) -> None:
+    filename = os.path.join(tmp_path, "config.yaml")
+    write(filename, CONFIG)
+    manager = ConfigManager(filename)
+    changes: List[Config] = []
+    manager.on_change(changes.append)
+    assert not manager.check()
+
+    write(filename, CONFIG.replace("pages: [fast]\n- title: A", "pages: [slow]\n- title: A"))
+    assert manager.check()
+    assert changes == [manager.config]
+    assert [s.id for s in manager.config.visible_sources("slow", True)] == ["b"]
+
+    # broken files keep the last good config
+    config = manager.config
+    write(filename, CONFIG.replace("link: https://t.me/s/a", "link: t.me/s/a"))
+    assert not manager.check()
+    write(filename, "sources: [")
+    assert not manager.check()
+    assert manager.config is config and len(changes) == 1
+
+
+LINK = "https://t.me/s/a"
+
+
+def test_keyword_change_renders_stored_posts(tmp_path: str) -> None:
+    def config(keywords: List[str]) -> Config:
+        return Config("infoscape", "localhost", keywords, [{"title": "A", "id": "a", "parser": "telegram", "link": LINK}])
+
+    adb = AsyncPostsDb(os.path.join(tmp_path, "posts.sqlite"))
+    posts = [Post("a", f"https://t.me/a/{i}", 1653419210 + i, f"old new {i}", "text") for i in range(5)]
+
+    async def run() -> None:
+        await adb.write(PostsDb.add_many, [config(["old"]).ingest_renderer(p) for p in posts])
+
+        rerenderer = Rerenderer(adb, batch_size=2)
+        rerenderer.update(config(["new"]))
+        assert rerenderer.task is not None
+        await rerenderer.task
+        stored = await adb.read(PostsDb.select, ["a"], 10)
+        assert {p.summary.split(" ", 1)[1] for p in stored} == {f"<mark>new</mark> {i}" for i in range(5)}
+
+        # the same keywords in another order are rendered already, e.g. after a restart
+        restarted = Rerenderer(adb)
+        restarted.update(config(["new", "new"]))
+        assert restarted.task is not None
+        await restarted.task
+        assert await adb.read(PostsDb.get_rendered_keywords) == '["new"]'
+        await restarted.stop()
+
+    try:
+        asyncio.run(run())
+    finally:
+        adb.close()
@@ -0,0 +1,43 @@
+import asyncio
+from typing import List
+
+from aiohttp import web
+
+from library import HttpClient
+
+
+def test_pooled_session() -> None:
+    peers: List[int] = []
+
+    async def handler(request: web.Request) -> web.Response:
+        assert request.transport is not None
+        peers.append(request.transport.get_extra_info("peername")[1])
+        return web.Response(text="ok")
+
+    async def run() -> None:
+        app = web.Application()
+        app.router.add_get("/", handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", 0).start()
+        host, port = runner.addresses[0]
+        url = f"http://{host}:{port}"
+
+        try:
+            async with HttpClient() as client:
+                session = client.session()
+                for _ in range(3):
+                    async with client.session().get(f"{url}/") as response:
+                        assert await response.text() == "ok"
+                # the same session and one keep-alive connection for every fetch
+                assert client.session() is session
+                assert len(set(peers)) == 1
+                connector = client.get_connector()
+
+            assert session.closed
+            assert connector.closed
+            assert client.sessions == {} and client.connector is None
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(run())
@@ -0,0 +1,50 @@
+import os
+import struct
+import zlib
+
+from library import IngestRenderer, KeywordMatcher, ImageCache, Post, PostsDb
+from library.images import image_key
+
+
+def make_png(width: int, height: int, seed: int = 0) -> bytes:
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    rows = b"".join(b"\x00" + bytes((x * 7 + y * 13 + seed) % 256 for x in range(width * 3)) for y in range(height))
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b"")
+
+
+def test_proxy_images(tmp_path: str) -> None:
+    url = "https://cdn4.telegram-cdn.org/file/JYf.jpg"
+    text = f'text\n<img src="{url}"></img>'
+    post = IngestRenderer(KeywordMatcher([]))(Post("a", "https://t.me/a/1", 1653419210, "heading", text))
+    assert post.html == f'text<br><img src="/img/{image_key(url)}" loading="lazy"></img>'
+
+    db = PostsDb(os.path.join(tmp_path, "posts.sqlite"))
+    db.add_many([post])
+    assert db.get_image(image_key(url)) == (url, None)
+    db.set_image_digest(image_key(url), "digest")
+    assert db.get_image(image_key(url)) == (url, "digest")
+
+
+def test_image_cache(tmp_path: str) -> None:
+    cache = ImageCache(os.path.join(tmp_path, "images"), max_bytes=1 << 30)
+    assert cache.store(b"not an image") is None
+
+    digests = [cache.store(make_png(64, 64, seed)) or "" for seed in range(3)]
+    assert all(digests) and len(set(digests)) == 3
+    path, media_type = cache.find(digests[0], webp=False) or ("", "")
+    assert os.path.exists(path) and media_type in ("image/jpeg", "image/png")
+
+    # the least recently used images go first
+    for age, digest in enumerate(digests):
+        directory = os.path.dirname(cache.path(digest, ""))
+        for name in os.listdir(directory):
+            if name.startswith(digest):
+                os.utime(os.path.join(directory, name), (1e9 - age, 1e9 - age))
+    size = sum(os.path.getsize(os.path.join(r, n)) for r, _, ns in os.walk(cache.directory) for n in ns)
+    cache.max_bytes = size - 1
+    assert cache.evict() > 0
+    assert cache.find(digests[0], webp=True) is not None
+    assert cache.find(digests[2], webp=True) is None
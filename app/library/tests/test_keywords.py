@@ -0,0 +1,31 @@
+import pytest
+
+from library import KeywordMatcher
+
+
+@pytest.mark.parametrize(
+    "text, highlighted",
+    (
+        ("В МОСКВЕ и москва", "В МОСКВЕ и <mark>москва</mark>"),
+        ("yandex.cloud от Яндекса", "<mark>yandex</mark>.cloud от <mark>Яндекс</mark>а"),
+        ("Group-IB (group-ib)", "<mark>Group-IB</mark> (<mark>group-ib</mark>)"),
+        ("Google Cloud", "<mark>Google Cloud</mark>"),
+        ("no keywords here", "no keywords here"),
+    ),
+)
+def test_highlight(text: str, highlighted: str) -> None:
+    matcher = KeywordMatcher(["Yandex", "Яндекс", "Москва", "Group-IB", "Google", "Google Cloud"])
+    assert matcher.highlight(text) == highlighted
+
+
+def test_highlight_html_keeps_tags() -> None:
+    matcher = KeywordMatcher(["img", "Yandex"])
+    html = 'yandex img<br><img src="https://cdn.yandex.ru/img.jpg"></img>'
+
+    assert matcher.highlight_html(html) == (
+        '<mark>yandex</mark> <mark>img</mark><br><img src="https://cdn.yandex.ru/img.jpg"></img>'
+    )
+
+
+def test_empty_keywords() -> None:
+    assert KeywordMatcher([]).highlight_html("<b>text</b>") == "<b>text</b>"
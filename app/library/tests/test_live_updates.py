@@ -0,0 +1,72 @@
+import asyncio
+import json
+import os
+from typing import List
+
+from library import AsyncPostsDb, KeywordMatcher, LiveUpdates, Post, PostsDb
+from library.archive import archive_posts, attach_archive
+
+
+def make_post(source_id: str, i: int, heading: str = "heading") -> Post:
+    return Post(source_id, f"https://t.me/{source_id}/{i}", 1653419210 + i, heading, "text")
+
+
+def test_select_since(tmp_path: str) -> None:
+    db = PostsDb(os.path.join(tmp_path, "posts.sqlite"))
+    db.add_many([make_post("a", 1), make_post("b", 2)])
+    assert db.get_last_seq() == 2
+
+    # updates move the post to the end, unchanged rows keep their seq
+    db.add_many([make_post("a", 1, "edited"), make_post("b", 2)])
+    assert [(seq, p.heading) for seq, p in db.select_since(0)] == [(2, "heading"), (3, "edited")]
+    assert [seq for seq, _ in db.select_since(0, ["b"])] == [2]
+    assert db.select_since(3) == []
+
+
+def test_seq_after_archive(tmp_path: str) -> None:
+    db = PostsDb(os.path.join(tmp_path, "posts.sqlite"))
+    attach_archive(db, os.path.join(tmp_path, "archive.sqlite"))
+    db.add_many([make_post("a", 1), make_post("a", 2)])
+    db.add_many([make_post("a", 1, "edited")])
+    assert db.get_last_seq() == 3
+
+    # the newest change is archived, the next post still gets a seq after the cursor
+    assert archive_posts(db, "a", max_rows=1) == 1
+    db.add_many([make_post("a", 3)])
+    assert [(seq, p.link) for seq, p in db.select_since(3)] == [(4, "https://t.me/a/3")]
+
+
+def test_stream(tmp_path: str) -> None:
+    async def run() -> None:
+        adb = AsyncPostsDb(os.path.join(tmp_path, "posts.sqlite"))
+        await adb.write(PostsDb.add_many, [make_post("a", i) for i in range(1, 6)])
+        live_updates = LiveUpdates(adb, KeywordMatcher([]), interval=0.01, buffer_size=3)
+
+        async def read(after_seq: int, count: int) -> List[dict]:
+            events = []
+            stream = live_updates.stream(frozenset(["a"]), after_seq)
+            async for chunk in stream:
+                if chunk.startswith("id: "):
+                    events.append(json.loads(chunk.split("data: ", 1)[1]))
+                    if len(events) == count:
+                        break
+            await stream.aclose()
+            return events
+
+        # new posts of the subscribed sources only; the cursor is loaded before the write
+        await live_updates.start()
+        reader = asyncio.create_task(read(0, 2))
+        await asyncio.sleep(0.05)
+        await adb.write(PostsDb.add_many, [make_post("b", 6), make_post("a", 7), make_post("a", 8)])
+        events = await asyncio.wait_for(reader, 1)
+        assert [e["link"] for e in events] == ["https://t.me/a/7", "https://t.me/a/8"]
+        assert events[0]["source_id"] == "a" and events[0]["id"]
+
+        # resume from a cursor behind the buffer goes to the database
+        events = await asyncio.wait_for(read(3, 4), 1)
+        assert [e["link"] for e in events] == [f"https://t.me/a/{i}" for i in (4, 5, 7, 8)]
+
+        await live_updates.stop()
+        adb.close()
+
+    asyncio.run(run())
@@ -0,0 +1,35 @@
+import json
+import os
+
+from library.metrics import Registry, process_start
+
+
+def test_expose_sums_live_processes(tmp_path: str) -> None:
+    registry = Registry(str(tmp_path))
+    fetches = registry.counter("fetches_total", "Fetches", ("source",))
+    latency = registry.histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1))
+
+    fetches.inc(source="a")
+    fetches.inc(2, source="b")
+    latency.observe(0.05, route="/")
+    latency.observe(5, route="/")
+
+    # another live worker, an exited one and a previous run with the same pid as the live one
+    with open(os.path.join(tmp_path, f"{os.getppid()}-{process_start(os.getppid())}.json"), "w") as fout:
+        json.dump({"fetches_total": [[["a"], 3]], "latency_seconds": [[["/"], [0, 1, 0], 0.5]]}, fout)
+    dead = os.path.join(tmp_path, "999999999-1.json")
+    reused = os.path.join(tmp_path, f"{os.getppid()}-1.json")
+    for filename in (dead, reused):
+        with open(filename, "w") as fout:
+            json.dump({"fetches_total": [[["a"], 100]]}, fout)
+
+    lines = registry.expose().splitlines()
+    assert 'fetches_total{source="a"} 4' in lines
+    assert 'fetches_total{source="b"} 2' in lines
+    assert 'latency_seconds_bucket{route="/",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{route="/",le="1"} 2' in lines
+    assert 'latency_seconds_bucket{route="/",le="+Inf"} 3' in lines
+    assert 'latency_seconds_sum{route="/"} 5.55' in lines
+    assert "# TYPE latency_seconds histogram" in lines
+    assert not os.path.exists(dead)
+    assert not os.path.exists(reused)
@@ -0,0 +1,39 @@
+import asyncio
+import os
+
+from library import AsyncPostsDb, PageCache, Post, PostsDb
+
+
+def test_invalidate_on_ingest_from_other_connection(tmp_path: str) -> None:
+    filename = os.path.join(tmp_path, "posts.sqlite")
+    adb = AsyncPostsDb(filename, readers=1)
+    writer = PostsDb(filename)
+    cache = PageCache(adb)
+
+    async def run() -> None:
+        await cache.refresh()
+        cache.put("a", "<html>a</html>", ["a"])
+        cache.put("ab", "<html>ab</html>", ["a", "b"])
+        cache.put("c", "<html>c</html>", ["c"])
+        assert cache.get("a") is not None
+
+        # lookups don't see the change until the background refresh
+        writer.add(Post("b", "https://t.me/b/1", 1653419210, "heading", "text"))
+        assert cache.get("ab") is not None
+        await cache.refresh()
+        assert cache.get("ab") is None
+        assert cache.get("a") is not None
+        assert cache.get("c") is not None
+
+        # unchanged rows don't invalidate anything
+        cache.put("ab", "<html>ab</html>", ["a", "b"])
+        writer.add(Post("b", "https://t.me/b/1", 1653419210, "heading", "text"))
+        await cache.refresh()
+        assert cache.get("ab") is not None
+        assert (cache.hits, cache.misses) == (5, 1)
+        await cache.stop()
+
+    try:
+        asyncio.run(run())
+    finally:
+        adb.close()
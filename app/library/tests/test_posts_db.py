@@ -0,0 +1,218 @@
+import asyncio
+import os
+import sqlite3
+from typing import List, Tuple
+
+from library import AddStats, AsyncPostsDb, IngestRenderer, KeywordMatcher, Post, PostsDb, SourceState, WriteBehindQueue
+from library.feed import decode_cursor, feed_page
+from library.source_renderer import collapse_duplicates, get_post_id
+
+
+def test_add_many_stats() -> None:
+    db = PostsDb(":memory:")
+
+    posts = [Post("src", f"https://t.me/src/{i}", 1653419210 + i, f"heading {i}", f"text {i}") for i in range(3)]
+    assert db.add_many(posts) == AddStats(inserted=3)
+
+    posts[1].text = "edited"
+    assert db.add_many(posts) == AddStats(updated=1, skipped=2)
+
+
+def test_write_behind_queue(tmp_path: str) -> None:
+    adb = AsyncPostsDb(os.path.join(tmp_path, "posts.sqlite"), readers=2)
+
+    async def write() -> AddStats:
+        queue = WriteBehindQueue(adb, max_batch=2, max_delay=0.01)
+        queue.start()
+        for i in range(5):
+            await queue.put(Post("src", f"https://t.me/src/{i}", 1653419210 + i, "heading", "text"))
+        await queue.put(SourceState("src", last_message_id=4))
+        await queue.close()
+        return queue.stats
+
+    try:
+        assert asyncio.run(write()) == AddStats(inserted=5)
+        db = PostsDb(adb.filename)
+        assert db.get_state("src").last_message_id == 4
+        assert len(db.select(["src"], 10)) == 5
+    finally:
+        adb.close()
+
+
+def test_write_behind_queue_failed_batch(tmp_path: str) -> None:
+    adb = AsyncPostsDb(os.path.join(tmp_path, "posts.sqlite"), readers=1)
+
+    class FailingQueue(WriteBehindQueue):
+        @staticmethod
+        def write(db: PostsDb, posts: List[Post], states: List[SourceState]) -> AddStats:
+            if any(post.link == "https://t.me/a/2" for post in posts):
+                raise sqlite3.OperationalError("disk I/O error")
+            return WriteBehindQueue.write(db, posts, states)
+
+    async def write() -> None:
+        queue = FailingQueue(adb, max_batch=2, max_delay=0.01)
+        queue.start()
+        # the first batch fails, the state of "a" comes in the third one and must not skip the lost posts
+        for i in range(1, 5):
+            await queue.put(Post("a", f"https://t.me/a/{i}", 1653419210 + i, "heading", "text"))
+        await queue.put(SourceState("b", last_message_id=1))
+        await queue.put(SourceState("a", last_message_id=4))
+        await queue.close()
+
+    try:
+        asyncio.run(write())
+        db = PostsDb(adb.filename)
+        assert db.get_state("a").last_message_id == 0
+        assert db.get_state("b").last_message_id == 1
+        assert [p.link for p in db.select(["a"], 10)] == ["https://t.me/a/4", "https://t.me/a/3"]
+    finally:
+        adb.close()
+
+
+def test_async_reads_during_writes(tmp_path: str) -> None:
+    adb = AsyncPostsDb(os.path.join(tmp_path, "posts.sqlite"), readers=4)
+
+    async def run() -> None:
+        async def write(i: int) -> None:
+            posts = [Post(f"s{j}", f"https://t.me/s{j}/{i}", 1653419210 + i, "heading", "text") for j in range(10)]
+            await adb.write(PostsDb.add_many, posts)
+
+        async def read() -> int:
+            top = await adb.read(PostsDb.select_top, [f"s{j}" for j in range(10)], 10)
+            return sum(len(posts) for posts in top.values())
+
+        writes = [write(i) for i in range(20)]
+        counts = await asyncio.gather(*(read() for _ in range(50)), *writes)
+        # every write commits a post of each source, so readers see whole batches only
+        assert all(count is not None and count % 10 == 0 and count <= 100 for count in counts[:50])
+        assert await read() == 100
+
+    try:
+        asyncio.run(run())
+    finally:
+        adb.close()
+
+
+def test_select_multiple_sources() -> None:
+    db = PostsDb(":memory:")
+    db.add_many([
+        Post(source_id, f"https://t.me/{source_id}/{i}", 1653419210 + 10 * i + offset, "heading", "text")
+        for offset, source_id in enumerate(("a", "b", "c"))
+        for i in range(5)
+    ])
+
+    posts = db.select(["a", "b"], 4)
+    assert [p.link for p in posts] == [
+        "https://t.me/b/4", "https://t.me/a/4", "https://t.me/b/3", "https://t.me/a/3"
+    ]
+
+    top = db.select_top(["c", "a", "missing"], 2)
+    assert list(top) == ["c", "a", "missing"]
+    assert [p.link for p in top["c"]] == ["https://t.me/c/4", "https://t.me/c/3"]
+    assert [p.link for p in top["a"]] == ["https://t.me/a/4", "https://t.me/a/3"]
+    assert top["missing"] == []
+
+
+def test_select_top_many_sources() -> None:
+    db = PostsDb(":memory:")
+    source_ids = [f"s{i}" for i in range(1201)]
+    db.add_many([Post(s, f"https://t.me/{s}/{i}", 1653419210 + i, "heading", "text") for s in source_ids for i in range(3)])
+
+    # more sources than terms allowed in one compound select
+    top = db.select_top(source_ids, 2)
+    assert list(top) == source_ids
+    assert all([p.link for p in top[s]] == [f"https://t.me/{s}/2", f"https://t.me/{s}/1"] for s in source_ids)
+
+
+def test_select_page_keyset() -> None:
+    db = PostsDb(":memory:")
+    # timestamps collide across and within sources, (timestamp, link) still gives a total order
+    db.add_many([Post(s, f"https://t.me/{s}/{i}", 1653419210 + i // 3, "heading", "text") for s in "ab" for i in range(10)])
+
+    seen: List[Tuple] = []
+    cursor = ""
+    while True:
+        posts = db.select_page(["a", "b"], 4, decode_cursor(cursor))
+        page = feed_page(posts, ["link", "timestamp"], 3)
+        seen.extend((p["timestamp"], p["link"]) for p in page["posts"])
+        if not (cursor := page["next"]):
+            break
+
+    assert len(seen) == 20
+    assert seen == sorted(seen, reverse=True)
+    assert [p.link for p in db.select_page(["a"], 2, (1653419213, "https://t.me/a/9"))] == [
+        "https://t.me/a/8", "https://t.me/a/7",
+    ]
+
+
+def test_select_page_many_sources() -> None:
+    db = PostsDb(":memory:")
+    source_ids = [f"s{i}" for i in range(1201)]
+    db.add_many([Post(s, f"https://t.me/{s}/{i}", 1653419210 + i * 10000 + n % 500 * 3 + n // 500, "heading", "text")
+                 for n, s in enumerate(source_ids) for i in range(2)])
+
+    # the newest posts alternate between groups of the compound selects
+    posts = db.select_page(source_ids, 5)
+    assert [p.source_id for p in posts] == ["s999", "s499", "s998", "s498", "s997"]
+    posts = db.select_page(source_ids, 3, (posts[-1].timestamp, posts[-1].link))
+    assert [p.source_id for p in posts] == ["s497", "s996", "s496"]
+
+
+def test_search() -> None:
+    db = PostsDb(":memory:")
+    db.add_many([
+        Post("a", "https://t.me/a/1", 1653419210, "Новости Москвы", "Новости Москвы\nподробности"),
+        Post("b", "https://t.me/b/1", 1653419220, "Yandex", "YANDEX запустил сервис в Москве"),
+        Post("b", "https://t.me/b/2", 1653419230, "Погода", "Ёлки в лесу"),
+    ])
+
+    assert [p.link for p in db.search("москв", ["a", "b"])] == ["https://t.me/a/1", "https://t.me/b/1"]
+    assert [p.link for p in db.search("москв", ["b"])] == ["https://t.me/b/1"]
+    assert [p.link for p in db.search("yandex", ["a", "b"])] == ["https://t.me/b/1"]
+    assert [p.link for p in db.search("елки", ["a", "b"])] == ["https://t.me/b/2"]
+    assert db.search('"', ["a", "b"]) == []
+
+    db.add(Post("b", "https://t.me/b/2", 1653419230, "Погода", "Дождь"))
+    assert db.search("елки", ["a", "b"]) == []
+    assert [p.link for p in db.select_keyword("дождь")] == ["https://t.me/b/2"]
+
+
+def test_migrate_and_render_old_rows(tmp_path: str) -> None:
+    filename = os.path.join(tmp_path, "posts.sqlite")
+    conn = sqlite3.connect(filename)
+    conn.execute("CREATE TABLE posts (source_id TEXT, link TEXT, timestamp INT, heading TEXT, text TEXT)")
+    conn.execute("INSERT INTO posts VALUES ('a', 'https://t.me/a/1', 1653419210, 'Москва', 'Москва\nтекст')")
+    conn.commit()
+
+    db = PostsDb(filename)
+    render = IngestRenderer(KeywordMatcher(["москва"]))
+    for posts in db.iter_posts(unrendered_only=True):
+        db.save_rendered([render(p) for p in posts])
+
+    assert list(db.iter_posts(unrendered_only=True)) == []
+    post, = db.select(["a"])
+    assert post.post_id == get_post_id("https://t.me/a/1")
+    assert post.summary == "<mark>Москва</mark>"
+    assert post.html == "<mark>Москва</mark><br>текст"
+
+
+def test_duplicates_cluster_across_sources() -> None:
+    db = PostsDb(":memory:")
+    story = "Центробанк снизил ключевую ставку до семи процентов годовых, следующее заседание пройдет в июле"
+    db.add_many([
+        Post("a", "https://t.me/a/1", 1653419210, "heading", story),
+        Post("b", "https://t.me/b/1", 1653419310, "heading", f"> {story}\n\nкомментарий"),
+        Post("c", "https://t.me/c/1", 1653419410, "heading", "Другая новость про погоду: в выходные ожидается дождь и ветер"),
+        # same story, but outside of the time window
+        Post("d", "https://t.me/d/1", 1653419210 + 30 * 24 * 3600, "heading", story),
+    ])
+
+    clusters = db.get_clusters(["https://t.me/a/1", "https://t.me/b/1", "https://t.me/c/1", "https://t.me/d/1"])
+    assert clusters["https://t.me/a/1"] == clusters["https://t.me/b/1"] == "https://t.me/a/1"
+    assert clusters["https://t.me/c/1"] == "https://t.me/c/1"
+    assert clusters["https://t.me/d/1"] == "https://t.me/d/1"
+
+    posts, also_in = collapse_duplicates(db.select_top(["a", "b", "c"]), clusters, {"b": "Source B"})
+    assert [p.link for p in posts["a"]] == ["https://t.me/a/1"]
+    assert posts["b"] == []
+    assert also_in == {"https://t.me/a/1": [("Source B", "https://t.me/b/1")]}
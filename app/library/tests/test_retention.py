@@ -0,0 +1,52 @@
+import asyncio
+import os
+import time
+
+from library import AsyncPostsDb, Config, Post, PostsDb, Retention
+from library.archive import search_archive
+from library.retention import ARCHIVED_POSTS
+
+
+def test_retention_archives_and_keeps_searchable(tmp_path: str) -> None:
+    config = Config(
+        title="test",
+        hostname="localhost",
+        keywords=[],
+        sources=[
+            {"title": "a", "id": "a", "parser": "telegram", "link": "https://t.me/s/a"},
+            {"title": "b", "id": "b", "parser": "telegram", "link": "https://t.me/s/b", "retention": {"max_rows": 2}},
+        ],
+        retention={"max_age_days": 30},
+    )
+    now = int(time.time())
+    adb = AsyncPostsDb(os.path.join(tmp_path, "posts.sqlite"), archive=os.path.join(tmp_path, "archive.sqlite"))
+
+    async def run() -> None:
+        await adb.write(PostsDb.add_many, [
+            Post(source_id, f"https://t.me/{source_id}/{i}", now - i * 11 * 86400, f"Москва {i}", f"Москва {i}")
+            for source_id in ("a", "b")
+            for i in range(5)
+        ])
+
+        stats = await Retention(config).run(adb, config.sources)
+        assert stats.archived == 2 + 3
+        assert stats.reclaimed >= 0
+        assert ARCHIVED_POSTS.values[("a",)] == 2 and ARCHIVED_POSTS.values[("b",)] == 3
+
+        top = await adb.read(PostsDb.select_top, ["a", "b"], 10)
+        assert [p.link for p in top["a"]] == [f"https://t.me/a/{i}" for i in range(3)]
+        assert [p.link for p in top["b"]] == [f"https://t.me/b/{i}" for i in range(2)]
+
+        archived = await adb.read(search_archive, "москва", ["a", "b"])
+        assert sorted(p.link for p in archived) == ["https://t.me/a/3", "https://t.me/a/4"] + [
+            f"https://t.me/b/{i}" for i in range(2, 5)
+        ]
+        assert archived[0].text.startswith("Москва")
+
+        # second run has nothing to move
+        assert (await Retention(config).run(adb, config.sources)).archived == 0
+
+    try:
+        asyncio.run(run())
+    finally:
+        adb.close()
@@ -0,0 +1,89 @@
+import asyncio
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+from library.config import SourceConfig
+from library.scheduler import FetchResult, FetchScheduler, HostRateLimiter
+
+
+def source(id: str, host: str = "t.me") -> SourceConfig:
+    return SourceConfig(id, id, "telegram", f"https://{host}/s/{id}")
+
+
+def test_timeout_then_retry() -> None:
+    attempts: Dict[str, int] = defaultdict(int)
+
+    async def fetch_source(s: SourceConfig) -> None:
+        attempts[s.id] += 1
+        if attempts[s.id] == 1:
+            await asyncio.sleep(1)
+
+    async def run() -> FetchResult:
+        scheduler = FetchScheduler(fetch_source, timeout=0.05, retries=2, backoff=0.01, host_interval=0)
+        return await scheduler.fetch(source("a"))
+
+    result = asyncio.run(run())
+
+    assert (result.ok, result.attempts) == (True, 2)
+    assert attempts["a"] == 2
+    assert result.duration < 0.5
+
+
+def test_gives_up_after_retries() -> None:
+    attempts: List[str] = []
+
+    async def fetch_source(s: SourceConfig) -> None:
+        attempts.append(s.id)
+        raise ConnectionError("refused")
+
+    async def run() -> FetchResult:
+        scheduler = FetchScheduler(fetch_source, retries=2, backoff=0.01, host_interval=0)
+        return await scheduler.fetch(source("a"))
+
+    result = asyncio.run(run())
+
+    assert (result.ok, result.attempts) == (False, 3)
+    assert attempts == ["a", "a", "a"]
+
+
+def test_host_slots_spacing() -> None:
+    async def run() -> List[float]:
+        limiter = HostRateLimiter(0.05)
+        start = time.monotonic()
+        times: List[float] = []
+
+        async def take(host: str) -> None:
+            await limiter.wait(host)
+            if host == "a":
+                times.append(time.monotonic() - start)
+
+        # other hosts don't take the slots of "a"
+        await asyncio.gather(*(take(host) for host in "abab" * 2))
+        return sorted(times)
+
+    times = asyncio.run(run())
+    assert len(times) == 4
+    # the n-th caller of a host waits for its slot n * interval after the first one
+    assert all(t >= 0.05 * n - 0.005 for n, t in enumerate(times))
+    assert times[-1] < 0.3
+
+
+def test_concurrency_limited_by_workers() -> None:
+    running = 0
+    peak = 0
+
+    async def fetch_source(s: SourceConfig) -> None:
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    async def run() -> None:
+        scheduler = FetchScheduler(fetch_source, workers=3, host_interval=0)
+        results = await scheduler.run_cycle([source(f"s{i}", f"host{i}") for i in range(20)])
+        assert all(r.ok for r in results)
+
+    asyncio.run(run())
+    assert peak == 3
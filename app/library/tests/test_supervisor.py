@@ -0,0 +1,61 @@
+import asyncio
+import multiprocessing
+import os
+from multiprocessing.synchronize import Event
+from typing import List
+
+from library.supervisor import WorkerLock, supervise
+
+
+def hold_lock(filename: str, locked: Event, done: Event) -> None:
+    lock = WorkerLock(filename)
+    assert lock.acquire()
+    locked.set()
+    done.wait(5)
+    # exits without release(), the kernel drops the lock with the process
+
+
+def test_lock_released_on_exit(tmp_path: str) -> None:
+    filename = os.path.join(tmp_path, "fetcher.lock")
+    locked, done = multiprocessing.Event(), multiprocessing.Event()
+    holder = multiprocessing.Process(target=hold_lock, args=(filename, locked, done))
+    holder.start()
+
+    try:
+        assert locked.wait(5)
+        lock = WorkerLock(filename)
+        assert not lock.acquire()
+
+        done.set()
+        holder.join(5)
+        assert lock.acquire()
+        lock.release()
+    finally:
+        done.set()
+        holder.join(5)
+
+
+def test_supervise_single_worker(tmp_path: str) -> None:
+    filename = os.path.join(tmp_path, "fetcher.lock")
+    runs: List[str] = []
+
+    def worker(name: str, attempts: int) -> "asyncio.Future[None]":
+        async def run() -> None:
+            runs.append(name)
+            await asyncio.sleep(0.05)
+            if runs.count(name) < attempts:
+                raise RuntimeError("crash")
+
+        # every worker opens the lock file on its own, like separate processes
+        return asyncio.ensure_future(supervise(name, run, WorkerLock(filename), standby_interval=0.01, restart_delay=0.01))
+
+    async def main() -> None:
+        first = worker("first", attempts=2)
+        await asyncio.sleep(0.01)
+        second = worker("second", attempts=1)
+
+        await asyncio.wait_for(asyncio.gather(first, second), 1)
+        # the standby worker doesn't run while the first one crashes and restarts, and takes over once it exits
+        assert runs == ["first", "first", "second"]
+
+    asyncio.run(main())
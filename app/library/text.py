@@ -0,0 +1,8 @@
+import re
+
+WORD_RE = re.compile(r"\w+")
+TAG_RE = re.compile(r"<[^>]*>")
+
+
+def fold(text: str) -> str:
+    return text.replace("ё", "е").replace("Ё", "Е")
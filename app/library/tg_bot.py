@@ -1,13 +1,23 @@
+import asyncio
 from dataclasses import dataclass
+import logging
 import os
-import json
-from typing import Dict, Optional
-import aiohttp
+from typing import Dict, Optional, Set
 
+from .alerts import MAX_KEYWORDS, normalize_keyword
+from .async_db import AsyncPostsDb
 from .auth import Auth
+from .http_client import HttpClient
+from .metrics import metrics
+from .posts_db import PostsDb
+from .send_queue import SendException, SendQueue
+
+logger = logging.getLogger("infoscape")
 
 TG_TOKEN = os.environ["TG_TOKEN"]
-TG_API_URL = "https://api.telegram.org"
+TG_API_URL = os.environ.get("TG_API_URL", "https://api.telegram.org")  # overridden by benchmark.py
+
+API_SECONDS = metrics.histogram("infoscape_telegram_api_seconds", "Telegram Bot API call time", ("method",))
 
 
 @dataclass
@@ -20,7 +30,7 @@ class TgBotCommand:
     def parse(update: Dict) -> Optional["TgBotCommand"]:
         update_id = update.get("update_id")
         chat_id = update.get("message", {}).get("chat", {}).get("id")
-        text = update.get("message", {}).get("text").strip("/")
+        text = (update.get("message", {}).get("text") or "").strip("/")
 
         bot_command = False
         for entity in update.get("message", {}).get("entities", []):
@@ -32,51 +42,127 @@ class TgBotCommand:
 
 
 class TgBot:
-    def __init__(self, site_host: str, url: str = TG_API_URL, token: str = TG_TOKEN):
+    # Replies and alerts go through the send queue and webhook updates are handled in background tasks,
+    # so Telegram gets its reply without waiting for the API or the database writer shared with ingest
+    def __init__(
+        self,
+        site_host: str,
+        client: HttpClient,
+        url: str = TG_API_URL,
+        token: str = TG_TOKEN,
+        db: Optional[AsyncPostsDb] = None,
+    ):
+        self.client = client
         self.api_url = url
         self.token = token
         self.offset = 0
         self.commands = [
-            {"command": "link", "description": "Return link with token"}
+            {"command": "link", "description": "Return link with token"},
+            {"command": "subscribe", "description": "Alert on new posts with a keyword"},
+            {"command": "unsubscribe", "description": "Stop alerts on a keyword"},
+            {"command": "subscriptions", "description": "List keywords"},
         ]
         self.auth = Auth()
         self.site_host = site_host
+        self.db = db
+        self.queue = SendQueue(self.send_message)
+        self.tasks: Set[asyncio.Task] = set()
 
     async def init_bot(self) -> bool:
         status = False
-        async with aiohttp.ClientSession(f"{self.api_url}") as session:
-            async with session.post(f"/bot{self.token}/setMyCommands?commands={json.dumps(self.commands)}") as response:
+        session = self.client.session(self.api_url)
+        with API_SECONDS.time(method="setMyCommands"):
+            async with session.post(f"/bot{self.token}/setMyCommands", json={"commands": self.commands}) as response:
                 if not await response.json():
                     raise Exception("Error setting commands")
 
-            async with session.post(f"/bot{self.token}/setWebhook?url={self.site_host}/tg-webhook") as response:
+        with API_SECONDS.time(method="setWebhook"):
+            async with session.post(f"/bot{self.token}/setWebhook", json={"url": f"{self.site_host}/tg-webhook"}) as response:
                 if not await response.json():
                     raise Exception("Error setting webhook")
 
         return status
 
-    async def send_message(self, chat_id: int, text: str) -> bool:
-        async with aiohttp.ClientSession(f"{self.api_url}") as session:
-            async with session.get(f"/bot{self.token}/sendMessage?chat_id={chat_id}&text={text}") as response:
-                if _ := await response.json():
-                    return True
-
-                return False
+    async def send_message(self, chat_id: int, text: str) -> None:
+        # called by the send queue, which retries on errors
+        session = self.client.session(self.api_url)
+        with API_SECONDS.time(method="sendMessage"):
+            async with session.post(
+                f"/bot{self.token}/sendMessage",
+                json={"chat_id": chat_id, "text": text, "disable_web_page_preview": True},
+            ) as response:
+                result = await response.json(content_type=None)
+
+        if not result.get("ok"):
+            raise SendException(
+                result.get("description", f"status {response.status}"),
+                retry_after=result.get("parameters", {}).get("retry_after", 0),
+                permanent=response.status in (400, 403),
+            )
+
+    async def close(self) -> None:
+        # commands in progress still get their replies
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        await self.queue.close()
+
+    def handle_update(self, update: Dict) -> None:
+        task = asyncio.create_task(self.run_update(update))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def run_update(self, update: Dict) -> None:
+        try:
+            await self.process_update(update)
+        except Exception:
+            logger.exception("Error while processing a Telegram update")
+
+    async def subscribe(self, chat_id: int, keyword: str) -> str:
+        if not (keyword := normalize_keyword(keyword)):
+            return "Usage: /subscribe <keyword>, keywords are matched as whole words"
+        assert self.db is not None
+        if not await self.db.write(PostsDb.subscribe, chat_id, keyword, MAX_KEYWORDS):
+            return f"Too many keywords, at most {MAX_KEYWORDS} are allowed"
+        return f"Subscribed to «{keyword}»"
+
+    async def unsubscribe(self, chat_id: int, keyword: str) -> str:
+        assert self.db is not None
+        if await self.db.write(PostsDb.unsubscribe, chat_id, normalize_keyword(keyword)):
+            return f"Unsubscribed from «{normalize_keyword(keyword)}»"
+        return await self.subscriptions(chat_id)
+
+    async def subscriptions(self, chat_id: int) -> str:
+        assert self.db is not None
+        if keywords := await self.db.read(PostsDb.get_chat_subscriptions, chat_id):
+            return "Keywords:\n" + "\n".join(keywords)
+        return "No keywords, add one with /subscribe <keyword>"
 
     async def process_update(self, update: Dict) -> None:
         if command := TgBotCommand.parse(update):
-            if command.text == "link":
+            # "/subscribe@bot_name some words" in group chats
+            name, _, argument = command.text.partition(" ")
+            name = name.split("@")[0]
+
+            if name == "link":
                 token = self.auth.get_token(lifetime=12 * 3600)
                 text = f"https://{self.site_host}/set-token?value={token}"
+            elif name == "subscribe":
+                text = await self.subscribe(command.chat_id, argument)
+            elif name == "unsubscribe":
+                text = await self.unsubscribe(command.chat_id, argument)
+            elif name == "subscriptions":
+                text = await self.subscriptions(command.chat_id)
             else:
                 text = "Unknown command, maybe you need /link?"
-            await self.send_message(command.chat_id, text)
+            self.queue.put(command.chat_id, text)
 
     async def get_updates(self) -> None:
-        async with aiohttp.ClientSession(f"{self.api_url}") as session:
+        session = self.client.session(self.api_url)
+        with API_SECONDS.time(method="getUpdates"):
             async with session.get(f"/bot{self.token}/getUpdates?offset={self.offset}") as response:
-                if updates := await response.json():
-                    for update in updates["result"]:
-                        await self.process_update(update)
+                updates = await response.json()
+
+        if updates:
+            for update in updates["result"]:
+                await self.process_update(update)
 
-                        self.offset = max(self.offset, update["update_id"] + 1)
+                self.offset = max(self.offset, update["update_id"] + 1)
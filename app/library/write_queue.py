@@ -0,0 +1,129 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Optional, Set, Union
+
+from .async_db import AsyncPostsDb
+from .metrics import metrics
+from .posts_db import AddStats, Post, PostsDb, SourceState
+
+logger = logging.getLogger("infoscape")
+
+QueueItem = Union[Post, SourceState]
+
+POSTS_WRITTEN = metrics.counter("infoscape_posts_written_total", "Fetched posts by write result", ("result",))
+
+
+class WriteBehindQueue:
+    # Source states are queued after their posts, so a cursor is never saved before the posts it covers.
+    # A failed write loses its posts, so the next state of their sources is dropped too, even when it comes
+    # in a later batch, and the next fetch starts again from the old cursor
+    def __init__(self, db: AsyncPostsDb, max_batch: int = 500, max_delay: float = 1.0) -> None:
+        self.db = db
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.queue: "asyncio.Queue[Optional[QueueItem]]" = asyncio.Queue(maxsize=max_batch * 4)
+        self.stats = AddStats()
+        self.failed: Set[str] = set()
+        self.listeners: List[Callable[[List[Post]], Awaitable[None]]] = []
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self.run())
+
+    def on_insert(self, listener: Callable[[List[Post]], Awaitable[None]]) -> None:
+        # called with the posts inserted by every flush, after they are committed
+        self.listeners.append(listener)
+
+    async def put(self, item: QueueItem) -> None:
+        await self.queue.put(item)
+
+    async def join(self) -> None:
+        await self.queue.join()
+
+    async def close(self) -> None:
+        if self.task is not None:
+            await self.queue.put(None)
+            await self.task
+            self.task = None
+
+    @staticmethod
+    def write(db: PostsDb, posts: List[Post], states: List[SourceState]) -> AddStats:
+        stats = db.add_many(posts)
+        for state in states:
+            db.save_state(state)
+        return stats
+
+    def states_to_save(self, batch: List[QueueItem]) -> List[SourceState]:
+        states = []
+        for item in batch:
+            if not isinstance(item, SourceState):
+                continue
+            if item.source_id in self.failed:
+                self.failed.discard(item.source_id)
+                logger.warning(f"not saving the state of {item.source_id}, its posts were not written")
+            else:
+                states.append(item)
+        return states
+
+    def mark_failed(self, batch: List[QueueItem]) -> None:
+        # states of the batch are lost with its posts, posts after them belong to the next fetch
+        for item in batch:
+            if isinstance(item, Post):
+                self.failed.add(item.source_id)
+            else:
+                self.failed.discard(item.source_id)
+
+    async def flush(self, batch: List[QueueItem]) -> None:
+        posts = [item for item in batch if isinstance(item, Post)]
+        states = self.states_to_save(batch)
+
+        try:
+            stats = await self.db.write(self.write, posts, states)
+        except Exception:
+            logger.exception(f"Error while writing {len(posts)} posts")
+            self.mark_failed(batch)
+            return
+
+        self.stats += stats
+        POSTS_WRITTEN.inc(stats.inserted, result="inserted")
+        POSTS_WRITTEN.inc(stats.updated, result="updated")
+        POSTS_WRITTEN.inc(stats.skipped, result="skipped")
+        logger.debug(f"flushed {len(posts)} posts: {stats}")
+
+        if stats.new_posts:
+            for listener in self.listeners:
+                try:
+                    await listener(stats.new_posts)
+                except Exception:
+                    logger.exception("Error in a write listener")
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopped = False
+
+        while not stopped:
+            item = await self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                break
+
+            batch = [item]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+
+                if item is None:
+                    self.queue.task_done()
+                    stopped = True
+                    break
+                batch.append(item)
+
+            await self.flush(batch)
+            for _ in batch:
+                self.queue.task_done()
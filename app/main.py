@@ -1,51 +1,244 @@
 import argparse
+import json
 import os
 import asyncio
 import logging
+import socket
 import time
-from typing import Optional
+from contextlib import asynccontextmanager, suppress
+from collections import deque
+from datetime import date
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional
+from urllib.parse import urlencode
 
 
 import uvicorn
-from fastapi import FastAPI, Cookie, Request
-from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.staticfiles import StaticFiles
+from uvicorn.supervisors import Multiprocess
+from fastapi import FastAPI, Cookie, Header, HTTPException, Query, Request
+from fastapi.responses import HTMLResponse, PlainTextResponse, RedirectResponse, Response, StreamingResponse
 from jinja2 import Environment, PackageLoader, select_autoescape
+from markupsafe import escape
+
+from library import (
+    Config, SourceConfig, PostsDb, IngestRenderer, Auth, TgBot, FetchScheduler, HttpClient, WriteBehindQueue,
+    Retention, FeedException, Resources, WorkerLock, supervise, ConfigManager, INDEX_PAGE, Alerts, AddStats, Post,
+    PageStore, Rerenderer,
+)
+from library.archive import drop_archived, search_archive
+from library.assets import AssetFiles, Assets
+from library.compression import compress
+from library.feed import decode_cursor, feed_page, parse_fields
+from library.metrics import MetricsMiddleware, metrics
+from library.rerender import keywords_key
+from library.source_renderer import collapse_duplicates
+from parsers import ParseExecutor, TelegramParser
+from parsers.telegram import parse_stored_pages
+
+SEARCH_PAGE_SIZE = 30
+WIDGET_SIZE = 10
+API_PAGE_SIZE = 20
+API_MAX_PAGE_SIZE = 100
+
+# server workers import this module and get their options from the parent "serve" process through environment
+CONFIG_ENV = "INFOSCAPE_CONFIG"
+FETCH_ENV = "INFOSCAPE_FETCH"
+FETCHER_LOCK = "data/fetcher.lock"
 
-from library import Config, PostsDb, SourceRenderer, Auth, TgBot
-from parsers import TelegramParser, TelegramParserException
-
-app = FastAPI()
-app.mount("/static", StaticFiles(directory=os.path.join(os.path.dirname(__file__), "static")), name="static")
-
-config = Config.from_file_factory("config.yaml")
 logger = logging.getLogger("infoscape")
-db = PostsDb()
 auth = Auth()
+assets = Assets()
+assets.load()
 env = Environment(loader=PackageLoader("main"), autoescape=select_autoescape())
-tg_bot = TgBot(site_host=config.hostname)
+env.globals["asset"] = assets.url
+index_template = env.get_template("index.html")
 
+WIDGET_RENDER_SECONDS = metrics.histogram("infoscape_widget_render_seconds", "Widget render time", ("source",))
+PAGE_RENDER_SECONDS = metrics.histogram("infoscape_page_render_seconds", "Page template render time", ("page",))
 
-async def fetch(args: argparse.Namespace) -> None:
-    while True:
-        try:
-            for source in config.sources:
+config_manager = ConfigManager(os.environ.get(CONFIG_ENV, "config.yaml"))
+resources = Resources()
+
+
+def on_config_change(config: Config) -> None:
+    # pages may have got other sources or keywords, the fetcher renders stored posts again, see Rerenderer
+    resources.page_cache.clear()
+    resources.live_updates.set_keyword_matcher(config.keyword_matcher)
+
+
+config_manager.on_change(on_config_change)
+
+
+def setup_logging() -> None:
+    logging.basicConfig()
+    logger.setLevel(logging.INFO)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    setup_logging()
+    resources.open(config_manager.config)
+    metrics.start()
+    config_manager.start()
+
+    fetcher = None
+    if fetch_options := os.environ.get(FETCH_ENV):
+        fetch_args = argparse.Namespace(**json.loads(fetch_options))
+        fetcher = asyncio.create_task(supervise("fetcher", lambda: fetch(fetch_args), WorkerLock(FETCHER_LOCK)))
+
+    try:
+        yield
+    finally:
+        if fetcher is not None:
+            fetcher.cancel()
+            with suppress(asyncio.CancelledError):
+                await fetcher
+        await config_manager.stop()
+        await metrics.stop()
+        await resources.close()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+app.mount("/static", AssetFiles(assets), name="static")
+
+
+def fetch_source_factory(
+    write_queue: WriteBehindQueue,
+    backend: str,
+    executor: ParseExecutor,
+    backfill: int = 0,
+    page_store: Optional[PageStore] = None,
+) -> Callable[[SourceConfig], Awaitable[None]]:
+    async def fetch_source(source: SourceConfig) -> None:
+        render = config_manager.config.ingest_renderer
+        if source.parser == "telegram":
+            parser = TelegramParser(source.id, source.link, resources.http_client, backend, executor, page_store)
+
+            if backfill:
+                logger.info(f"backfilling {source.id}, {backfill} pages")
+                async for post in parser.get_history(backfill):
+                    await write_queue.put(render(post))
+            else:
                 logger.info(f"fetching {source.id}")
-                if source.parser == "telegram":
-                    try:
-                        parser = TelegramParser(source.id, source.link)
-                        async for post in parser.get_posts():
-                            db.add(post)
-                    except TelegramParserException:
-                        logger.exception(f"Error while fetching source {source.id}")
-
-            if args.daemonize > 0:
+                state = await resources.adb.read(PostsDb.get_state, source.id)
+                async for post in parser.get_posts(state):
+                    await write_queue.put(render(post))
+                await write_queue.put(state)
+
+    return fetch_source
+
+
+async def fetch(args: argparse.Namespace) -> None:
+    write_queue = WriteBehindQueue(resources.adb)
+    write_queue.on_insert(Alerts(resources.adb, resources.tg_bot.queue).notify)
+    write_queue.on_insert(resources.image_proxy.prefetch)
+    write_queue.start()
+    executor = ParseExecutor(args.parse_executor, args.parse_workers, args.parse_pending)
+    page_store = PageStore(args.store_pages) if args.store_pages else None
+    scheduler = FetchScheduler(
+        fetch_source_factory(write_queue, args.parser_backend, executor, args.backfill, page_store),
+        workers=args.workers,
+        host_interval=args.host_interval,
+        timeout=args.timeout,
+        retries=args.retries,
+    )
+
+    # stored posts are rendered again in the background when keywords change
+    rerenderer = Rerenderer(resources.adb)
+    rerenderer.update(config_manager.config)
+    config_manager.on_change(rerenderer.update)
+    last_retention = time.monotonic()
+
+    try:
+        while True:
+            # sources added or removed in the config file are picked up on the next cycle
+            config = config_manager.config
+            try:
+                await scheduler.run_cycle(config.sources)
+                await write_queue.join()
+                logger.info(f"posts written so far: {write_queue.stats}")
+
+                if args.retention_interval > 0 and time.monotonic() - last_retention > args.retention_interval:
+                    await Retention(config).run(resources.adb, config.sources)
+                    last_retention = time.monotonic()
+            except Exception:
+                logger.exception("General error while fetching updates")
+
+            if args.daemonize > 0 and not args.backfill:
                 logger.info(f"sleeping {args.daemonize} seconds")
-                time.sleep(args.daemonize)
+                await asyncio.sleep(args.daemonize)
             else:
                 break
-        except Exception:
-            logger.exception(f"General error while fetching updates")
+    finally:
+        config_manager.remove_listener(rerenderer.update)
+        await rerenderer.stop()
+        await write_queue.close()
+        executor.close()
+        if page_store is not None:
+            page_store.close()
+
+
+async def apply_retention(args: argparse.Namespace) -> None:
+    config = config_manager.config
+    await Retention(config, args.compact_pages).run(resources.adb, config.sources)
+
+
+def render_posts(db: PostsDb, render_post: IngestRenderer, unrendered_only: bool) -> None:
+    count = 0
+    for posts in db.iter_posts(unrendered_only=unrendered_only):
+        db.save_rendered([render_post(p) for p in posts])
+        count += len(posts)
+        logger.info(f"rendered {count} posts")
+
+
+async def render(args: argparse.Namespace) -> None:
+    config = config_manager.config
+    await resources.adb.write(render_posts, config.ingest_renderer, not args.all)
+    if args.all:
+        await resources.adb.write(PostsDb.set_rendered_keywords, keywords_key(config.keywords))
+
+
+def write_reparsed(db: PostsDb, posts: List[Post]) -> AddStats:
+    return db.add_many(drop_archived(db, posts))
+
+
+async def reparse(args: argparse.Namespace) -> None:
+    store = PageStore(args.pages)
+    executor = ParseExecutor("process", args.parse_workers)
+    render = config_manager.config.ingest_renderer
+    # batches are parsed on all cores while the parsed ones are written, in the order of the store
+    pending: Deque["asyncio.Future[List[Post]]"] = deque()
+    stats = AddStats()
+    pages = 0
+    start = last_log = time.monotonic()
+
+    try:
+        async for batch in store.iter_batches(args.batch_size, args.source):
+            pending.append(asyncio.ensure_future(executor.run(parse_stored_pages, args.parser_backend, batch, render)))
+            pages += len(batch)
+            if len(pending) >= executor.max_pending:
+                stats += await resources.adb.write(write_reparsed, await pending.popleft())
+
+            if time.monotonic() - last_log > 10:
+                last_log = time.monotonic()
+                logger.info(f"reparsed {pages} pages: {stats}")
+
+        while pending:
+            stats += await resources.adb.write(write_reparsed, await pending.popleft())
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.close()
+        store.close()
+
+    duration = time.monotonic() - start
+    logger.info(f"reparsed {pages} pages in {duration:.1f}s, {pages / max(duration, 1e-3):.0f} pages/s: {stats}")
+
+
+@app.get("/metrics")
+async def get_metrics() -> PlainTextResponse:
+    # sums dumps of all server workers and fetch processes sharing the data directory
+    return PlainTextResponse(metrics.expose(), media_type="text/plain; version=0.0.4")
 
 
 @app.get("/set-token")
@@ -60,94 +253,350 @@ async def set_token(value: str) -> RedirectResponse:
 async def tg_webhook(update: Request) -> str:
     data = await update.json()
 
-    await tg_bot.process_update(data)
+    # subscriptions wait for the database writer, Telegram redelivers updates that aren't answered in time
+    resources.tg_bot.handle_update(data)
 
     return ""
 
 
+def get_visible(config: Config, page_slug: str, has_token: bool) -> List[SourceConfig]:
+    try:
+        return config.visible_sources(page_slug, has_token)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Unknown page")
+
+
+async def render_page(request: Request, page_slug: str, has_token: bool) -> Response:
+    key = (page_slug, has_token, date.today())
+
+    if (cached := resources.page_cache.get(key)) is None:
+        config = config_manager.config
+        visible = get_visible(config, page_slug, has_token)
+        # cursor is taken before the posts, live updates may repeat a post but never miss one
+        cursor = await resources.adb.read(PostsDb.get_last_seq)
+        posts = await resources.adb.read(PostsDb.select_top, [s.id for s in visible], WIDGET_SIZE)
+        clusters = await resources.adb.read(PostsDb.get_clusters, [p.link for ps in posts.values() for p in ps])
+        posts, also_in = collapse_duplicates(posts, clusters, {s.id: s.title for s in visible})
+        widgets = []
+        for s in visible:
+            with WIDGET_RENDER_SECONDS.time(source=s.id):
+                widgets.append(
+                    config.source_renderer(heading=s.title, link=s.link, posts=posts[s.id], source_id=s.id, also_in=also_in)
+                )
+
+        with PAGE_RENDER_SECONDS.time(page=page_slug):
+            html = index_template.render(
+                title=config.title,
+                page_slug=page_slug,
+                pages=config.pages.values(),
+                widgets=widgets,
+                updates_url=f"/updates?{urlencode({'page': page_slug})}",
+                cursor=cursor,
+                limit=WIDGET_SIZE,
+            )
+        cached = resources.page_cache.put(key, html, [s.id for s in visible])
+
+    if request.headers.get("if-none-match") == cached.etag:
+        return Response(status_code=304, headers={"ETag": cached.etag})
+
+    return HTMLResponse(cached.html, headers={"ETag": cached.etag, "Cache-Control": "no-cache"})
+
+
 @app.get("/", response_class=HTMLResponse)
-async def index(token: Optional[str] = Cookie(default="")) -> str:
+async def index(request: Request, token: Optional[str] = Cookie(default="")) -> Response:
     has_token = auth.check_token(token)
-    source_renderer = SourceRenderer(config.keywords)
-    template = env.get_template("index.html")
-
-    widgets = []
-    for s in config.sources:
-        if s.hidden and not has_token:
-            continue
-        widgets.append(source_renderer(
-            heading=s.title,
-            link=s.link,
-            posts=db.select([s.id], 10)
-        ))
-
-    return template.render(
-        title=config.title,
-        page_slug="/",
-        pages=config.pages.values(),
-        widgets=widgets,
-    )
+    return await render_page(request, INDEX_PAGE, has_token)
 
 
 @app.get("/p/{page_slug}", response_class=HTMLResponse)
-async def get_page(page_slug: str, token: Optional[str] = Cookie(default="")) -> str:
+async def get_page(request: Request, page_slug: str, token: Optional[str] = Cookie(default="")) -> Response:
+    has_token = auth.check_token(token)
+    return await render_page(request, page_slug, has_token)
+
+
+@app.get("/updates")
+async def updates(
+    page: str = INDEX_PAGE,
+    since: int = 0,
+    last_event_id: Optional[str] = Header(default=None),
+    token: Optional[str] = Cookie(default=""),
+) -> StreamingResponse:
     has_token = auth.check_token(token)
-    source_renderer = SourceRenderer(config.keywords)
-    template = env.get_template("index.html")
-
-    page = config.pages[page_slug]
-    widgets = []
-    for s in page.sources:
-        if s.hidden and not has_token:
-            continue
-
-        widgets.append(source_renderer(
-            heading=s.title,
-            link=s.link,
-            posts=db.select([s.id], 10)
-        ))
-
-    return template.render(
+    source_ids = frozenset(s.id for s in get_visible(config_manager.config, page, has_token))
+
+    # browsers resend the id of the last received event on reconnect
+    if last_event_id and last_event_id.isdigit():
+        since = int(last_event_id)
+
+    return StreamingResponse(
+        resources.live_updates.stream(source_ids, since),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def json_response(request: Request, data: Dict) -> Response:
+    body, encoding = compress(
+        json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode(),
+        request.headers.get("accept-encoding", ""),
+    )
+    headers = {"Vary": "Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(body, media_type="application/json", headers=headers)
+
+
+async def api_feed(request: Request, sources: List[SourceConfig], cursor: str, limit: int, fields: str) -> Response:
+    try:
+        before = decode_cursor(cursor)
+        selected_fields = parse_fields(fields)
+    except FeedException as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    posts = await resources.adb.read(PostsDb.select_page, [s.id for s in sources], limit + 1, before)
+    return json_response(request, feed_page(posts, selected_fields, limit))
+
+
+@app.get("/api/sources/{source_id}/posts")
+async def api_source_posts(
+    request: Request,
+    source_id: str,
+    cursor: str = "",
+    limit: int = Query(default=API_PAGE_SIZE, ge=1, le=API_MAX_PAGE_SIZE),
+    fields: str = "",
+    token: Optional[str] = Cookie(default=""),
+) -> Response:
+    has_token = auth.check_token(token)
+    source = config_manager.config.sources_by_id.get(source_id)
+    if source is None or (source.hidden and not has_token):
+        raise HTTPException(status_code=404, detail="Unknown source")
+
+    return await api_feed(request, [source], cursor, limit, fields)
+
+
+@app.get("/api/pages/{page_slug}")
+async def api_page(
+    request: Request,
+    page_slug: str,
+    cursor: str = "",
+    limit: int = Query(default=API_PAGE_SIZE, ge=1, le=API_MAX_PAGE_SIZE),
+    fields: str = "",
+    token: Optional[str] = Cookie(default=""),
+) -> Response:
+    has_token = auth.check_token(token)
+    return await api_feed(request, get_visible(config_manager.config, page_slug, has_token), cursor, limit, fields)
+
+
+@app.get("/img/{key}")
+async def get_image(key: str, accept: str = Header(default="")) -> Response:
+    return await resources.image_proxy.response(key, webp="image/webp" in accept)
+
+
+@app.get("/search", response_class=HTMLResponse)
+async def search(
+    q: str = "", page: int = 1, archive: bool = False, token: Optional[str] = Cookie(default="")
+) -> str:
+    has_token = auth.check_token(token)
+    config = config_manager.config
+
+    page = max(page, 1)
+    source_ids = [s.id for s in config.visible_sources(INDEX_PAGE, has_token)]
+    search_func = search_archive if archive else PostsDb.search
+    posts = await resources.adb.read(search_func, q, source_ids, SEARCH_PAGE_SIZE + 1, (page - 1) * SEARCH_PAGE_SIZE)
+
+    more_link = ""
+    if len(posts) > SEARCH_PAGE_SIZE:
+        more_link = f"/search?{urlencode({'q': q, 'page': page + 1, 'archive': int(archive)})}"
+    elif not archive:
+        # continue in archived posts after the last page
+        more_link = f"/search?{urlencode({'q': q, 'archive': 1})}"
+
+    widget = config.source_renderer(
+        heading=escape(q),
+        link=f"/search?{urlencode({'q': q})}",
+        posts=posts[:SEARCH_PAGE_SIZE],
+        more_link=more_link,
+    )
+
+    return index_template.render(
         title=config.title,
-        page_slug=page_slug,
+        page_slug="/search",
         pages=config.pages.values(),
-        widgets=widgets,
+        widgets=[widget],
+        query=q,
     )
 
 
-async def serve(args: argparse.Namespace) -> None:
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True, workers=3)
+async def init_bot(config_filename: str) -> None:
+    async with HttpClient() as client:
+        await TgBot(site_host=Config.from_file_factory(config_filename).hostname, client=client).init_bot()
+
 
+def serve(args: argparse.Namespace) -> None:
+    # workers are separate processes importing "main:app", they open their resources in lifespan()
+    # and load the asset manifest on import
+    asyncio.run(init_bot(args.config))
+    assets.build()
+
+    os.environ[CONFIG_ENV] = os.path.abspath(args.config)
+    if args.fetch:
+        os.environ[FETCH_ENV] = json.dumps({k: v for k, v in vars(args).items() if k != "func"})
+
+    server_config = uvicorn.Config(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.web_workers,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        proxy_headers=True,
+    )
+    # uvicorn binds the shared socket without IPPROTO_TCP, so asyncio doesn't disable Nagle's algorithm for accepted
+    # connections and small responses wait ~40 ms for delayed ACKs; accepted sockets inherit the option on Linux
+    sock = server_config.bind_socket()
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
-async def main() -> None:
+    if args.web_workers > 1:
+        # the supervisor takes (config, sockets) since uvicorn 0.51, see requirements.txt
+        Multiprocess(server_config, sockets=[sock]).run()
+    else:
+        uvicorn.Server(server_config).run(sockets=[sock])
+
+
+def add_fetch_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--daemonize",
+        type=int,
+        default=600,
+        help="Run program in the infinite loop with specified seconds sleep",
+    )
+    parser.add_argument("--workers", type=int, default=8, help="Number of sources fetched concurrently")
+    parser.add_argument(
+        "--host-interval",
+        type=float,
+        default=0.2,
+        help="Minimal interval in seconds between requests to the same host",
+    )
+    parser.add_argument("--timeout", type=float, default=30, help="Timeout in seconds for a single source fetch")
+    parser.add_argument("--retries", type=int, default=2, help="Number of retries for a failed source fetch")
+    parser.add_argument(
+        "--backfill",
+        type=int,
+        default=0,
+        help="Fetch history once, following up to specified number of pages back for each source",
+    )
+    parser.add_argument(
+        "--parser-backend",
+        choices=TelegramParser.backends,
+        default="lxml",
+        help="HTML parsing backend, see python -m parsers.benchmark",
+    )
+    parser.add_argument(
+        "--parse-executor",
+        choices=ParseExecutor.kinds,
+        default="process",
+        help="Where pages are parsed: process pool, thread pool or inline in the event loop",
+    )
+    parser.add_argument("--parse-workers", type=int, default=0, help="Parser pool size, CPU count by default")
+    parser.add_argument(
+        "--parse-pending",
+        type=int,
+        default=0,
+        help="Maximal number of downloaded pages waiting for parsers, twice the pool size by default",
+    )
+    parser.add_argument(
+        "--store-pages",
+        default="",
+        help="Keep downloaded pages compressed in this database for reparse, e.g. data/pages.sqlite",
+    )
+    parser.add_argument(
+        "--retention-interval",
+        type=int,
+        default=6 * 3600,
+        help="Apply retention policies and compact the database every specified seconds, 0 to disable",
+    )
+
+
+def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(prog="infoscape")
     parser.add_argument("--config", default="config.yaml", help="App configuration")
     subparsers = parser.add_subparsers(help="mode")
 
     serve_parser = subparsers.add_parser("serve", help="serve news")
+    serve_parser.add_argument("--host", default="0.0.0.0", help="Address to bind")
+    serve_parser.add_argument("--port", type=int, default=8000, help="Port to bind")
+    serve_parser.add_argument("--web-workers", type=int, default=2, help="Number of server worker processes")
+    serve_parser.add_argument(
+        "--graceful-timeout",
+        type=float,
+        default=10,
+        help="Seconds to wait for open connections, e.g. live updates, on shutdown",
+    )
+    serve_parser.add_argument(
+        "--fetch",
+        action="store_true",
+        help="Run the fetcher in one of the workers, it accepts all fetch mode options",
+    )
+    add_fetch_arguments(serve_parser)
     serve_parser.set_defaults(func=serve)
 
     fetch_parser = subparsers.add_parser("fetch", help="fetch news")
-    fetch_parser.add_argument(
-        "--daemonize",
+    add_fetch_arguments(fetch_parser)
+    fetch_parser.set_defaults(func=fetch)
+
+    retention_parser = subparsers.add_parser("retention", help="archive old posts and compact the database")
+    retention_parser.add_argument(
+        "--compact-pages",
         type=int,
-        default=600,
-        help="Run program in the infinite loop with specified seconds sleep",
+        default=0,
+        help="Maximal number of free pages to release by incremental vacuum, all by default",
     )
-    fetch_parser.set_defaults(func=fetch)
+    retention_parser.set_defaults(func=apply_retention)
+
+    render_parser = subparsers.add_parser("render", help="render stored posts, e.g. after keywords change")
+    render_parser.add_argument("--all", action="store_true", help="Re-render all posts, not only unrendered ones")
+    render_parser.set_defaults(func=render)
+
+    reparse_parser = subparsers.add_parser("reparse", help="parse pages kept by fetch --store-pages again")
+    reparse_parser.add_argument("--pages", default="data/pages.sqlite", help="Database of stored pages")
+    reparse_parser.add_argument("--source", action="append", help="Reparse pages of this source only, repeatable")
+    reparse_parser.add_argument(
+        "--parser-backend", choices=TelegramParser.backends, default="lxml", help="HTML parsing backend"
+    )
+    reparse_parser.add_argument("--parse-workers", type=int, default=0, help="Parser pool size, CPU count by default")
+    reparse_parser.add_argument("--batch-size", type=int, default=50, help="Pages parsed by a worker at once")
+    reparse_parser.set_defaults(func=reparse)
 
-    args = parser.parse_args()
+    return parser.parse_args()
 
-    global config
-    config = Config.from_file_factory("config.yaml")
 
-    await tg_bot.init_bot()
+async def run(args: argparse.Namespace) -> None:
+    global config_manager
+    config_manager = ConfigManager(args.config)
+    config_manager.on_change(on_config_change)
+    resources.open(config_manager.config)
+    metrics.start()
+    config_manager.start()
 
-    await args.func(args)
+    try:
+        await resources.tg_bot.init_bot()
+
+        await args.func(args)
+    finally:
+        await config_manager.stop()
+        await metrics.stop()
+        await resources.close()
+
+
+def main() -> None:
+    args = parse_args()
+
+    if args.func is serve:
+        serve(args)
+    else:
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(run(args))
 
 
 if __name__ == "__main__":
-    logging.basicConfig()
-    logger.setLevel(logging.INFO)
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(main())
+    setup_logging()
+    main()
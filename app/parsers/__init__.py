@@ -1 +1,2 @@
 from .telegram import TelegramParser, TelegramParserException  # noqa
+from .executor import ParseExecutor  # noqa
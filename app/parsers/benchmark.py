@@ -0,0 +1,48 @@
+import argparse
+import os
+import time
+import tracemalloc
+
+from .telegram import TelegramParser
+
+PAGE_PATH = os.path.join(os.path.dirname(__file__), "tests", "tests_data", "page.html")
+
+
+def run_backend(backend: str, html: str, repeat: int) -> None:
+    parser = TelegramParser("benchmark", "https://t.me/s/benchmark", backend=backend)
+    list(parser.parse_html(html))  # warm up lazy imports
+
+    posts = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        posts += len(list(parser.parse_html(html)))
+    duration = time.perf_counter() - start
+
+    tracemalloc.start()
+    list(parser.parse_html(html))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(
+        f"{backend:>6}: {posts / duration:10.0f} posts/s, {repeat / duration:8.1f} pages/s, "
+        f"peak python memory per page {peak / 1024:8.1f} KiB"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m parsers.benchmark")
+    parser.add_argument("--page", default=PAGE_PATH, help="Channel page to parse")
+    parser.add_argument("--repeat", type=int, default=200, help="Number of times the page is parsed")
+    parser.add_argument("--backend", choices=TelegramParser.backends, action="append", help="Backends to run")
+    args = parser.parse_args()
+
+    with open(args.page) as fin:
+        html = fin.read()
+
+    print(f"{args.page}: {len(html)} chars, {args.repeat} runs")
+    for backend in args.backend or TelegramParser.backends:
+        run_backend(backend, html, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
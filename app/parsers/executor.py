@@ -0,0 +1,48 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class ParseExecutor:
+    # "process" for pure python backends, "thread" is enough for backends that release the GIL (lxml),
+    # "inline" parses right in the event loop
+    kinds = ("process", "thread", "inline")
+
+    def __init__(self, kind: str = "inline", workers: Optional[int] = None, max_pending: int = 0) -> None:
+        assert kind in self.kinds
+
+        self.kind = kind
+        self.workers = workers or os.cpu_count() or 1
+        # pages allowed between download start and parse end, the downloader waits for a free slot
+        self.max_pending = max_pending or self.workers * 2
+        self.executor: Optional[Executor] = None
+        if kind == "process":
+            # the pool is created in processes that already run threads (database executors, metrics, server
+            # workers with "serve --fetch"), forked parsers could inherit locks held by them
+            self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("forkserver"))
+        elif kind == "thread":
+            self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix="parser")
+
+        self._pending: Optional[asyncio.Semaphore] = None
+
+    @property
+    def pending(self) -> asyncio.Semaphore:
+        # created lazily to bind to the running loop
+        if self._pending is None:
+            self._pending = asyncio.Semaphore(self.max_pending)
+        return self._pending
+
+    async def run(self, func: Callable[..., T], *args: Any) -> T:
+        if self.executor is None:
+            return func(*args)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown()
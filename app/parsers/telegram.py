@@ -1,20 +1,26 @@
+import hashlib
 from typing import List
 from asyncio.log import logger
 from datetime import datetime
-from typing import Generator, Optional, AsyncGenerator
+from typing import Callable, Dict, Generator, Iterator, Optional, AsyncGenerator, Tuple
 
-import aiohttp
-from bs4 import BeautifulSoup, ResultSet
+from bs4 import BeautifulSoup, ResultSet, Tag
 
-from library import Post
+from library import Post, HttpClient, SourceState, PageStore
+from library.metrics import metrics
+from library.page_store import StoredPage, unpack
 
+from .executor import ParseExecutor
 
-def extract_text(bs_set: ResultSet) -> List[str]:
+
+def extract_text(bs_set: Tag) -> List[str]:
     for br in bs_set.find_all("br"):
         br.replace_with("\n")
 
-    text = bs_set.get_text(" ")
+    return fix_lines(bs_set.get_text(" "))
+
 
+def fix_lines(text: str) -> List[str]:
     lines = []
     for line in text.splitlines():
         if fixed_line := " ".join(line.replace("\u200b", "").strip().split()):
@@ -23,14 +29,47 @@ def extract_text(bs_set: ResultSet) -> List[str]:
     return lines
 
 
+def parse_datetime(dt: str) -> int:
+    return int(datetime.strptime(dt, "%Y-%m-%dT%H:%M:%S%z").timestamp())
+
+
+# link, timestamp, lines of every message text block, image url
+RawMessage = Tuple[str, int, List[List[str]], Optional[str]]
+# link, timestamp, heading, text: compact form passed back from parser processes
+PostTuple = Tuple[str, int, str, str]
+
+
+DOWNLOADS = metrics.counter("infoscape_downloads_total", "Downloaded channel pages by HTTP status", ("source", "status"))
+DOWNLOADED_BYTES = metrics.counter("infoscape_download_bytes_total", "Downloaded bytes, as sent by the server", ("source",))
+PARSE_SECONDS = metrics.histogram(
+    "infoscape_parse_seconds", "Channel page parse time including the executor queue", ("backend",)
+)
+
+
 class TelegramParserException(Exception):
     pass
 
 
 class TelegramParser:
-    def __init__(self, source_id: str, link: str) -> None:
+    backends = ("bs4", "lxml")
+
+    def __init__(
+        self,
+        source_id: str,
+        link: str,
+        client: Optional[HttpClient] = None,
+        backend: str = "bs4",
+        executor: Optional[ParseExecutor] = None,
+        page_store: Optional[PageStore] = None,
+    ) -> None:
         self.source_id = source_id
         self.link = link
+        self.client = client
+        self.backend = backend
+        self.executor = executor or ParseExecutor("inline")
+        self.page_store = page_store  # keeps downloaded pages for reparse
+
+        assert self.backend in self.backends
 
     @staticmethod
     def get_image_url(tgme_widget: ResultSet) -> Optional[str]:
@@ -42,8 +81,7 @@ class TelegramParser:
     @staticmethod
     def get_timestamp(tgme_widget: ResultSet) -> int:
         if a_date := tgme_widget.find("a", "tgme_widget_message_date"):
-            dt = a_date.find("time").get("datetime")
-            return int(datetime.strptime(dt, "%Y-%m-%dT%H:%M:%S%z").timestamp())
+            return parse_datetime(a_date.find("time").get("datetime"))
 
         raise TelegramParserException("Could not parse timestamp")
 
@@ -55,11 +93,14 @@ class TelegramParser:
         raise TelegramParserException("Could not parse link")
 
     @staticmethod
-    def get_body(tgme_widget: ResultSet) -> Optional[str]:
-        messages = []
-        for div_text in tgme_widget.find_all("div", "tgme_widget_message_text"):
-            messages.append(extract_text(div_text))
+    def get_message_id(link: str) -> int:
+        try:
+            return int(link.rstrip("/").rsplit("/", 1)[-1])
+        except ValueError:
+            raise TelegramParserException(f"Could not parse message id from {link}")
 
+    @staticmethod
+    def format_body(messages: List[List[str]]) -> Optional[str]:
         if messages:
             posts = []
             line_prefix = ""
@@ -69,36 +110,144 @@ class TelegramParser:
 
             return "\n\n".join(posts)
 
-    def parse_html(self, content: str) -> Generator[Post, None, None]:
+    @staticmethod
+    def get_body(tgme_widget: ResultSet) -> Optional[str]:
+        messages = []
+        for div_text in tgme_widget.find_all("div", "tgme_widget_message_text"):
+            messages.append(extract_text(div_text))
+
+        return TelegramParser.format_body(messages)
+
+    @staticmethod
+    def iter_messages_bs4(content: str, after_id: int = 0) -> Iterator[RawMessage]:
         soup = BeautifulSoup(content, "html.parser")
 
         for div in soup.find_all("div", "tgme_widget_message_wrap"):
             try:
-                timestamp = self.get_timestamp(div)
-                link = self.get_link(div)
-                text = ""
-                heading = ""
-
-                if body := self.get_body(div):
-                    text = body
-                    for line in body.splitlines():
-                        #  try to find better heading (not single tag on the line)
-                        if not heading or (heading.startswith("#") and len(heading.split()) < 3):
-                            heading = line
-                        else:
-                            break
-
-                if image_url := self.get_image_url(div):
-                    text += f'\n<img src="{image_url}"></img>'
-
-                yield Post(self.source_id, link, timestamp, heading, text)
+                link = TelegramParser.get_link(div)
+                if after_id and TelegramParser.get_message_id(link) <= after_id:
+                    continue
+
+                timestamp = TelegramParser.get_timestamp(div)
+                messages = [extract_text(div_text) for div_text in div.find_all("div", "tgme_widget_message_text")]
+
+                yield link, timestamp, messages, TelegramParser.get_image_url(div)
             except TelegramParserException:
                 logger.error(f"Except while parsing {div}")
 
-    async def get_posts(self) -> AsyncGenerator[Post, None]:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(self.link) as response:
-                html = await response.text()
-
-                for a in self.parse_html(html):
-                    yield a
+    def iter_messages(self, content: str, after_id: int = 0) -> Iterator[RawMessage]:
+        if self.backend == "lxml":
+            from .telegram_lxml import iter_messages_lxml
+            return iter_messages_lxml(content, after_id)
+
+        return self.iter_messages_bs4(content, after_id)
+
+    def parse_html(self, content: str, after_id: int = 0) -> Generator[Post, None, None]:
+        for link, timestamp, messages, image_url in self.iter_messages(content, after_id):
+            text = ""
+            heading = ""
+
+            if body := self.format_body(messages):
+                text = body
+                for line in body.splitlines():
+                    #  try to find better heading (not single tag on the line)
+                    if not heading or (heading.startswith("#") and len(heading.split()) < 3):
+                        heading = line
+                    else:
+                        break
+
+            if image_url:
+                text += f'\n<img src="{image_url}"></img>'
+
+            yield Post(self.source_id, link, timestamp, heading, text)
+
+    async def parse(self, html: str, after_id: int = 0) -> List[Post]:
+        with PARSE_SECONDS.time(backend=self.backend):
+            rows = await self.executor.run(parse_page, self.backend, html, after_id)
+        return [Post(self.source_id, *row) for row in rows]
+
+    async def download(self, url: str, state: Optional[SourceState] = None) -> Optional[str]:
+        if self.client is None:
+            raise TelegramParserException("HTTP client is required to fetch posts")
+
+        headers: Dict[str, str] = {}
+        if state and state.etag:
+            headers["If-None-Match"] = state.etag
+        if state and state.last_modified:
+            headers["If-Modified-Since"] = state.last_modified
+
+        async with self.client.session().get(url, headers=headers) as response:
+            DOWNLOADS.inc(source=self.source_id, status=str(response.status))
+            if response.status == 304:
+                return None
+            response.raise_for_status()
+            html = await response.text()
+            DOWNLOADED_BYTES.inc(response.content_length or len(html.encode()), source=self.source_id)
+
+            if state:
+                state.etag = response.headers.get("ETag", "")
+                state.last_modified = response.headers.get("Last-Modified", "")
+
+        return html
+
+    async def get_posts(self, state: Optional[SourceState] = None) -> AsyncGenerator[Post, None]:
+        # with state only posts newer than state.last_message_id are returned and the state is updated in place
+        async with self.executor.pending:
+            html = await self.download(self.link, state)
+            if html is None:
+                return
+
+            after_id = 0
+            if state:
+                content_hash = hashlib.sha1(html.encode()).hexdigest()
+                if content_hash == state.content_hash:
+                    return
+                state.content_hash = content_hash
+                after_id = state.last_message_id
+
+            if self.page_store:
+                await self.page_store.add(self.source_id, html)
+            posts = await self.parse(html, after_id)
+
+        for post in posts:
+            if state:
+                state.last_message_id = max(state.last_message_id, self.get_message_id(post.link))
+            yield post
+
+    async def get_history(self, pages: int) -> AsyncGenerator[Post, None]:
+        # follow "?before=<id>" pagination from the newest page, at most `pages` pages
+        url = self.link
+        for _ in range(pages):
+            async with self.executor.pending:
+                html = await self.download(url)
+                if html is None:
+                    break
+                if self.page_store:
+                    await self.page_store.add(self.source_id, html)
+                posts = await self.parse(html)
+
+            before = 0
+            for post in posts:
+                message_id = self.get_message_id(post.link)
+                before = min(before, message_id) if before else message_id
+                yield post
+
+            if before <= 1:
+                break
+            url = f"{self.link}?before={before}"
+
+
+def parse_page(backend: str, html: str, after_id: int = 0) -> List[PostTuple]:
+    # runs in parser processes, so it only takes and returns picklable values
+    parser = TelegramParser("", "", backend=backend)
+    return [(p.link, p.timestamp, p.heading, p.text) for p in parser.parse_html(html, after_id)]
+
+
+def parse_stored_pages(backend: str, pages: List[StoredPage], render: Callable[[Post], Post]) -> List[Post]:
+    # runs in parser processes for "main.py reparse"; a post found on several pages of the batch is returned once,
+    # in its version from the latest page
+    posts: Dict[Tuple[str, str], Post] = {}
+    for source_id, data in pages:
+        for row in parse_page(backend, unpack(data)):
+            posts[source_id, row[0]] = Post(source_id, *row)
+    return [render(post) for post in posts.values()]
@@ -0,0 +1,96 @@
+from asyncio.log import logger
+from typing import Iterator, List, Optional
+
+import lxml.html
+
+from .telegram import RawMessage, TelegramParser, TelegramParserException, fix_lines, parse_datetime
+
+
+def has_class(element: lxml.html.HtmlElement, name: str) -> bool:
+    return name in element.get("class", "").split()
+
+
+def extract_text(element: lxml.html.HtmlElement) -> List[str]:
+    # same output as bs4 get_text(" ") with <br> replaced by newlines, without mutating the tree
+    parts = []
+
+    def walk(el: lxml.html.HtmlElement) -> None:
+        if el.tag == "br":
+            parts.append("\n")
+        elif el.text and isinstance(el.tag, str):
+            parts.append(el.text)
+
+        for child in el:
+            walk(child)
+            if child.tail:
+                parts.append(child.tail)
+
+    walk(element)
+    return fix_lines(" ".join(parts))
+
+
+def get_image_url(image_a: lxml.html.HtmlElement) -> Optional[str]:
+    for s in image_a.get("style", "").split(";"):
+        if s.startswith("background-image"):
+            return s[len("background-image:url('"): -2]
+
+
+class MessageFields:
+    # date link, its time, photo link and text blocks of a message, collected in a single walk over its subtree
+    def __init__(self, div: lxml.html.HtmlElement) -> None:
+        self.a_date: Optional[lxml.html.HtmlElement] = None
+        self.dt: Optional[str] = None
+        self.image_a: Optional[lxml.html.HtmlElement] = None
+        self.messages: List[List[str]] = []
+
+        for el in div.iter("a", "div", "time"):
+            if el.tag == "a":
+                self.visit_link(el)
+            elif el.tag == "time":
+                self.visit_time(el)
+            elif has_class(el, "tgme_widget_message_text"):
+                self.messages.append(extract_text(el))
+
+    def visit_link(self, el: lxml.html.HtmlElement) -> None:
+        if self.a_date is None and has_class(el, "tgme_widget_message_date"):
+            self.a_date = el
+        elif self.image_a is None and has_class(el, "tgme_widget_message_photo_wrap"):
+            self.image_a = el
+
+    def visit_time(self, el: lxml.html.HtmlElement) -> None:
+        if self.dt is None and self.a_date is not None and self.a_date in el.iterancestors():
+            self.dt = el.get("datetime")
+
+    @property
+    def link(self) -> str:
+        if self.a_date is None:
+            raise TelegramParserException("Could not parse link")
+        return self.a_date.get("href")
+
+    @property
+    def timestamp(self) -> int:
+        if self.dt is None:
+            raise TelegramParserException("Could not parse timestamp")
+        return parse_datetime(self.dt)
+
+    @property
+    def image_url(self) -> Optional[str]:
+        return get_image_url(self.image_a) if self.image_a is not None else None
+
+
+def iter_messages_lxml(content: str, after_id: int = 0) -> Iterator[RawMessage]:
+    document = lxml.html.fromstring(content)
+
+    for div in document.find_class("tgme_widget_message_wrap"):
+        if div.tag != "div":
+            continue
+
+        try:
+            fields = MessageFields(div)
+            link = fields.link
+            if after_id and TelegramParser.get_message_id(link) <= after_id:
+                continue
+
+            yield link, fields.timestamp, fields.messages, fields.image_url
+        except TelegramParserException:
+            logger.error(f"Except while parsing {lxml.html.tostring(div, encoding='unicode')}")
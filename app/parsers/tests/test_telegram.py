@@ -1,14 +1,21 @@
+import asyncio
 import json
 import os
+from typing import List, Optional, Tuple
 
+import lxml.html
 import pytest
-from bs4 import BeautifulSoup
+from aiohttp import web
+from bs4 import BeautifulSoup, Tag
 
-from library import Post
-from parsers.telegram import TelegramParser, TelegramParserException
+from library import HttpClient, IngestRenderer, KeywordMatcher, PageStore, Post, SourceState
+from parsers import ParseExecutor
+from parsers.telegram import TelegramParser, TelegramParserException, extract_text, parse_stored_pages
+from parsers.telegram_lxml import extract_text as extract_text_lxml
 
 
-def test_parse_html() -> None:
+@pytest.mark.parametrize("backend", TelegramParser.backends)
+def test_parse_html(backend: str) -> None:
     path = os.path.dirname(__file__)
 
     with open(os.path.join(path, "tests_data", "page.html")) as fin:
@@ -19,7 +26,7 @@ def test_parse_html() -> None:
         for post_data in json.load(fin):
             canon_posts.append(Post(**post_data))
 
-    parser = TelegramParser("infoscape_test", "https://t.me/s/infoscape_test")
+    parser = TelegramParser("infoscape_test", "https://t.me/s/infoscape_test", backend=backend)
     posts = list(parser.parse_html(html))
 
     assert posts == canon_posts
@@ -90,3 +97,128 @@ def test_get_link(html: str, link: str) -> None:
 def test_get_link_exception(html: str, link: str) -> None:
     with pytest.raises(TelegramParserException):
         TelegramParser.get_link(BeautifulSoup(html, "html.parser"))
+
+
+@pytest.mark.parametrize("kind", ParseExecutor.kinds)
+def test_parse_executor(kind: str) -> None:
+    path = os.path.dirname(__file__)
+
+    with open(os.path.join(path, "tests_data", "page.html")) as fin:
+        html = fin.read()
+
+    with open(os.path.join(path, "tests_data", "canon_posts.json")) as fin:
+        canon_posts = [Post(**post_data) for post_data in json.load(fin)]
+
+    executor = ParseExecutor(kind, workers=2)
+    parser = TelegramParser("infoscape_test", "https://t.me/s/infoscape_test", backend="lxml", executor=executor)
+    try:
+        assert asyncio.run(parser.parse(html)) == canon_posts
+    finally:
+        executor.close()
+
+
+def test_parse_stored_pages(tmp_path: str) -> None:
+    path = os.path.dirname(__file__)
+
+    with open(os.path.join(path, "tests_data", "page.html")) as fin:
+        html = fin.read()
+
+    with open(os.path.join(path, "tests_data", "canon_posts.json")) as fin:
+        canon_posts = [Post(**post_data) for post_data in json.load(fin)]
+
+    async def store_and_load() -> list:
+        store = PageStore(os.path.join(tmp_path, "pages.sqlite"))
+        try:
+            assert await store.add("infoscape_test", html)
+            assert not await store.add("infoscape_test", html)
+            assert await store.add("infoscape_test", html.replace(canon_posts[0].heading, "Fixed heading"))
+            return [batch async for batch in store.iter_batches(batch_size=1)]
+        finally:
+            store.close()
+
+    batches = asyncio.run(store_and_load())
+    assert [len(batch) for batch in batches] == [1, 1]
+
+    # the same post on several pages is returned once, as on the latest page
+    render = IngestRenderer(KeywordMatcher([]))
+    posts = parse_stored_pages("lxml", batches[0] + batches[1], render)
+    assert [p.link for p in posts] == [p.link for p in canon_posts]
+    assert posts[0].heading == "Fixed heading" and posts[0].post_id
+    assert posts[1:] == [render(p) for p in canon_posts[1:]]
+
+
+@pytest.mark.parametrize("backend", TelegramParser.backends)
+def test_parse_html_after_id(backend: str) -> None:
+    path = os.path.dirname(__file__)
+
+    with open(os.path.join(path, "tests_data", "page.html")) as fin:
+        html = fin.read()
+
+    parser = TelegramParser("infoscape_test", "https://t.me/s/infoscape_test", backend=backend)
+    links = [post.link for post in parser.parse_html(html, after_id=4)]
+
+    assert links == ["https://t.me/infoscape_test/5", "https://t.me/infoscape_test/7"]
+
+
+@pytest.mark.parametrize(
+    "link, message_id",
+    (
+        ("https://t.me/infoscape_test/3", 3),
+        ("https://t.me/infoscape_test/1234/", 1234),
+    ),
+)
+def test_get_message_id(link: str, message_id: int) -> None:
+    assert TelegramParser.get_message_id(link) == message_id
+
+
+def test_get_message_id_exception() -> None:
+    with pytest.raises(TelegramParserException):
+        TelegramParser.get_message_id("https://t.me/s/infoscape_test")
+
+
+@pytest.mark.parametrize(
+    "html",
+    (
+        """<div class="tgme_widget_message_text"><b>Жирный</b>текст<br/>вторая <a href="#">строка</a>\u200b<br><br>
+        <!-- comment --><i>третья</i>   строка&nbsp;с пробелом</div>""",
+        """<div class="tgme_widget_message_text">  </div>""",
+    ),
+)
+def test_extract_text_backends(html: str) -> None:
+    div = BeautifulSoup(html, "html.parser").find("div")
+    assert isinstance(div, Tag)
+    expected = extract_text(div)
+    assert extract_text_lxml(lxml.html.fromstring(html)) == expected
+
+
+def test_conditional_download() -> None:
+    etag, last_modified = '"v1"', "Wed, 25 May 2022 10:00:00 GMT"
+    requests: List[Tuple[Optional[str], Optional[str]]] = []
+
+    async def handler(request: web.Request) -> web.Response:
+        requests.append((request.headers.get("If-None-Match"), request.headers.get("If-Modified-Since")))
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304)
+        return web.Response(text="<html></html>", headers={"ETag": etag, "Last-Modified": last_modified})
+
+    async def run() -> None:
+        app = web.Application()
+        app.router.add_get("/s/a", handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", 0).start()
+        host, port = runner.addresses[0]
+
+        try:
+            async with HttpClient() as client:
+                parser = TelegramParser("a", f"http://{host}:{port}/s/a", client)
+                state = SourceState("a")
+                assert await parser.download(parser.link, state) == "<html></html>"
+                assert (state.etag, state.last_modified) == (etag, last_modified)
+                # the second fetch sends both validators and gets 304 Not Modified
+                assert await parser.download(parser.link, state) is None
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(run())
+    assert requests == [(None, None), (etag, last_modified)]
@@ -21,3 +21,80 @@ function toggleDetails(el) {
         details.style.display = "block";
     }
 }
+
+function buildPost(post) {
+    var el = document.createElement("div");
+    el.className = "post";
+    el.dataset.timestamp = post.timestamp;
+
+    var summary = document.createElement("div");
+    summary.className = "post-summary";
+    summary.dataset.id = post.id;
+    summary.onclick = function () { toggleDetails(this); };
+
+    var date = document.createElement("a");
+    date.className = "post-date" + (post.is_fresh ? " post-fresh" : "");
+    date.href = post.link;
+    date.textContent = post.date;
+    summary.appendChild(date);
+    summary.insertAdjacentHTML("beforeend", " " + post.summary);
+
+    var details = document.createElement("div");
+    details.className = "post-details";
+    details.id = post.id;
+    details.innerHTML = post.html;
+
+    el.appendChild(summary);
+    el.appendChild(details);
+    return el;
+}
+
+function patchPost(post) {
+    var widget = document.querySelector('.widget[data-source="' + post.source_id + '"] .widget-inner');
+    if (!widget) {
+        return;
+    }
+
+    var el = buildPost(post);
+    var details = document.getElementById(post.id);
+    if (details) {
+        // edited post, keep it unfolded if it was
+        el.lastChild.style.display = details.style.display;
+        if (details.style.display == "block") {
+            el.firstChild.classList.add("post-unfolded");
+        }
+        widget.replaceChild(el, details.parentNode);
+        return;
+    }
+
+    var posts = widget.querySelectorAll(".post[data-timestamp]");
+    var limit = Number(document.getElementById("body").dataset.limit);
+    for (var i = 0; i < posts.length; i++) {
+        if (Number(posts[i].dataset.timestamp) < post.timestamp) {
+            widget.insertBefore(el, posts[i]);
+            if (posts.length >= limit) {
+                widget.removeChild(posts[posts.length - 1]);
+            }
+            return;
+        }
+    }
+    if (posts.length < limit) {
+        var more = widget.querySelector(".post-more");
+        widget.insertBefore(el, more ? more.parentNode : null);
+    }
+}
+
+function startUpdates() {
+    var body = document.getElementById("body");
+    if (!body.dataset.updates || !window.EventSource) {
+        return;
+    }
+
+    // on reconnect the browser sends Last-Event-ID, so the cursor in the url is only used once
+    var source = new EventSource(body.dataset.updates + "&since=" + body.dataset.cursor);
+    source.addEventListener("post", function (e) {
+        patchPost(JSON.parse(e.data));
+    });
+}
+
+document.addEventListener("DOMContentLoaded", startUpdates);
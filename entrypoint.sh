@@ -2,6 +2,4 @@
 
 mkdir -p /data && cd /
 
-python /app/main.py fetch &
-
-python /app/main.py serve
+exec python /app/main.py serve --web-workers "${WEB_WORKERS:-2}" --fetch